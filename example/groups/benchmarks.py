@@ -0,0 +1,226 @@
+"""Benchmarks for usergroups, run against a throwaway test database with::
+
+    django-admin.py benchmark_usergroups --settings=example.settings
+
+Every benchmark measures an operation at increasing data sizes and fails
+when the cost grows with the size of the data. ``view_queries`` requests
+every view of a configuration and fails when the number of queries a view
+runs grows with the size of the group.
+
+"""
+import resource
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db import reset_queries
+from django.test.client import Client
+from django.utils.importlib import import_module
+
+from usergroups import bulk
+from usergroups import options
+from usergroups import synthetic
+from usergroups.models import EmailInvitation
+from usergroups.models import UserGroupApplication
+
+from example.groups.models import Group
+
+def clear_table(model):
+    """Delete all rows of `model` without loading them."""
+    table = connection.ops.quote_name(model._meta.db_table)
+    connection.cursor().execute('DELETE FROM %s' % table)
+
+def measure(func):
+    """Call `func` and return the number of queries it ran, its wall time
+    and the peak resident memory of the process afterwards, in kilobytes on
+    Linux.
+
+    """
+    debug = settings.DEBUG
+    settings.DEBUG = True
+    reset_queries()
+    try:
+        start = time.time()
+        func()
+        seconds = time.time() - start
+        queries = len(connection.queries)
+    finally:
+        settings.DEBUG = debug
+    return {
+        'queries': queries,
+        'seconds': seconds,
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def timed(func, repeat):
+    """Call `func` `repeat` times and return the median wall time."""
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        func(i)
+        timings.append(time.time() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def invitation_acceptance(sizes=None, repeat=50, tolerance=3.0):
+    """Time ``EmailInvitationManager.handle_invite()`` with `sizes` rows in
+    the invitation table. Passes if accepting an invitation in the largest
+    table takes at most `tolerance` times as long as in the smallest.
+
+    """
+    sizes = sizes or (1000, 10000, 100000)
+    creator = User.objects.create_user('inviter', 'inviter@example.com')
+    group = Group.objects.create(creator=creator, name='invitations')
+    invitees = [User.objects.create_user('invitee%d' % i,
+                                         'invitee%d@example.com' % i)
+                for i in range(repeat)]
+
+    results = []
+    for size in sizes:
+        clear_table(EmailInvitation)
+        invitations = []
+        for i in range(size):
+            invitation = EmailInvitation(user=creator, group=group,
+                                         email='user%d@example.com' % i)
+            invitation.secret_key = '%030d' % i
+            invitations.append(invitation)
+        bulk.insert_objects(EmailInvitation, invitations)
+        group.remove_members(invitees)
+
+        # Accept invitations spread over the whole table; each only once,
+        # as accepting deletes it.
+        count = min(repeat, size)
+        step = max(1, size // count)
+        def accept(i):
+            key = '%030d' % (i * step)
+            assert EmailInvitation.objects.handle_invite(invitees[i], group,
+                                                         key)
+        results.append({ 'size': size, 'seconds': timed(accept, count) })
+
+    smallest = max(results[0]['seconds'], 1e-6)
+    return {
+        'results': results,
+        'passed': results[-1]['seconds'] <= smallest * tolerance,
+    }
+
+
+def view_requests(slug, group, member_id, application_ids, key):
+    """Return ``(label, method, url name, url kwargs, data)`` for a request
+    to every view of a configuration, made by the creator of `group`.
+
+    """
+    slug_kwargs = { 'slug': slug }
+    group_kwargs = { 'slug': slug, 'group_id': group.pk }
+    member_kwargs = dict(group_kwargs, user_id=member_id)
+    form = { 'name': group.name, 'extra': 'benchmark' }
+    return (
+        ('group_list', 'get', 'group_list', slug_kwargs, None),
+        ('search_groups', 'get', 'search_groups', slug_kwargs,
+         { 'q': slug }),
+        ('group_detail', 'get', 'group_detail', group_kwargs, None),
+        ('application_inbox', 'get', 'application_inbox', group_kwargs,
+         None),
+        ('export_members', 'get', 'export_members', group_kwargs, None),
+        ('create_group', 'post', 'create_group', slug_kwargs, form),
+        ('edit_group', 'post', 'edit_group', group_kwargs, form),
+        ('delete_group', 'get', 'delete_group', group_kwargs, None),
+        ('leave_group', 'get', 'leave_group', group_kwargs, None),
+        ('add_admin', 'post', 'add_admin', member_kwargs, {}),
+        ('add_admin_done', 'get', 'add_admin_done', member_kwargs, None),
+        ('revoke_admin', 'post', 'revoke_admin', member_kwargs, {}),
+        ('revoke_admin_done', 'get', 'revoke_admin_done', member_kwargs,
+         None),
+        ('batch_action', 'post', 'batch_action', group_kwargs, {
+            'actions': ['add_admin:%d' % member_id,
+                        'revoke_admin:%d' % member_id],
+        }),
+        ('remove_member', 'post', 'remove_member', member_kwargs, {}),
+        ('remove_member_done', 'get', 'remove_member_done', member_kwargs,
+         None),
+        ('create_email_invitation', 'post', 'create_email_invitation',
+         group_kwargs, { 'emails': 'invitee@example.com' }),
+        ('validate_email_invitation', 'get', 'validate_email_invitation',
+         dict(group_kwargs, key=key), None),
+        ('apply_to_join_group', 'post', 'apply_to_join', group_kwargs, {}),
+        ('approve_application', 'post', 'approve_application',
+         dict(group_kwargs, application_id=application_ids[0]), {}),
+        ('ignore_application', 'post', 'ignore_application',
+         dict(group_kwargs, application_id=application_ids[1]), {}),
+        ('done', 'get', 'delete_group_done', slug_kwargs, None),
+    )
+
+def view_queries(sizes=None, slug='test', slack=0, applications=100):
+    """Request every view of the configuration registered as `slug` for
+    groups with `sizes` members (and up to `applications` pending
+    applications), recording query counts, wall time and peak memory.
+
+    Passes if no view runs more than `slack` more queries for the largest
+    group than for the smallest. ``export_members`` reads members in chunks
+    and is expected to scale.
+
+    """
+    sizes = sizes or (10, 1000, 100000)
+    import_module(settings.ROOT_URLCONF)
+    model = options.get(slug).model
+    User.objects.create_user('%s-admin' % slug, 'admin@example.com', 'admin')
+    admin = User.objects.get(username='%s-admin' % slug)
+    client = Client()
+    client.login(username=admin.username, password='admin')
+
+    results = []
+    for size in sizes:
+        group = model._default_manager.create(creator=admin,
+                                              name='%s %d' % (slug, size))
+        member_ids = synthetic.create_users('%s-%d-member-' % (slug, size),
+                                            size)
+        group.add_members(member_ids)
+        applicant_ids = synthetic.create_users(
+            '%s-%d-applicant-' % (slug, size), min(size, applications) + 2)
+        synthetic.add_applications(group, applicant_ids)
+        application_ids = list(UserGroupApplication.objects.filter(
+            user__in=applicant_ids[:2]).order_by('pk')
+            .values_list('pk', flat=True))
+        invitation = EmailInvitation.objects.create(
+            user=admin, group=group, email='invitee@example.com')
+
+        views = {}
+        for (label, method, name, kwargs, data) in view_requests(
+            slug, group, member_ids[0], application_ids,
+            invitation.secret_key):
+            url = reverse('usergroups_%s' % name, kwargs=kwargs)
+            def request():
+                if method == 'post':
+                    response = client.post(url, data)
+                else:
+                    response = client.get(url, data or {})
+                # Streamed responses are only generated when read.
+                response.content
+                if response.status_code not in (200, 302):
+                    raise AssertionError("%s returned %d." %
+                                         (url, response.status_code))
+            views[label] = measure(request)
+        results.append({ 'size': size, 'views': views })
+
+    scaling = [label for label in results[0]['views']
+               if label != 'export_members' and
+                  results[-1]['views'][label]['queries'] >
+                  results[0]['views'][label]['queries'] + slack]
+    return {
+        'results': results,
+        'scaling': sorted(scaling),
+        'passed': not scaling,
+    }
+
+def role_view_queries(sizes=None):
+    """``view_queries()`` for groups that extend ``BaseRoleUserGroup``."""
+    return view_queries(sizes, slug='roles')
+
+
+BENCHMARKS = (
+    ('invitation_acceptance', invitation_acceptance),
+    ('view_queries', view_queries),
+    ('role_view_queries', role_view_queries),
+)
@@ -0,0 +1,55 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment
+from django.test.utils import teardown_test_environment
+from django.utils import simplejson
+
+from example.groups import benchmarks
+
+class Command(BaseCommand):
+    help = "Run the usergroups benchmarks against a test database."
+    args = '[benchmark benchmark ...]'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', dest='sizes', default=None,
+                    help='Comma-separated data sizes. Every benchmark has '
+                         'its own defaults.'),
+        make_option('--output', dest='output', default=None,
+                    help='Write a JSON report to this file.'),
+    )
+
+    def handle(self, *names, **options):
+        sizes = None
+        if options['sizes']:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        available = dict(benchmarks.BENCHMARKS)
+        for name in names:
+            if name not in available:
+                raise CommandError("Unknown benchmark '%s'." % name)
+        names = names or [name for (name, func) in benchmarks.BENCHMARKS]
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            report = {}
+            for name in names:
+                report[name] = available[name](sizes)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = simplejson.dumps(report, indent=2)
+        if options['output']:
+            f = open(options['output'], 'w')
+            f.write(output)
+            f.close()
+        else:
+            print output
+
+        failed = [name for name in names if not report[name]['passed']]
+        if failed:
+            raise CommandError("Benchmarks failed: %s" % ', '.join(failed))
@@ -1,5 +1,16 @@
 from django.db import models
+from usergroups.models import BaseMembership
+from usergroups.models import BaseRoleUserGroup
 from usergroups.models import BaseUserGroup
+from usergroups.models import UserGroupCounters
 
-class Group(BaseUserGroup):
+class Group(UserGroupCounters, BaseUserGroup):
     extra = models.CharField(max_length=200)
+
+
+class RoleGroup(UserGroupCounters, BaseRoleUserGroup):
+    pass
+
+
+class RoleGroupMembership(BaseMembership):
+    group = models.ForeignKey(RoleGroup, related_name='memberships')
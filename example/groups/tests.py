@@ -1,3 +1,7 @@
+import re
+
+from django.test import TestCase
+from django.test import TransactionTestCase
 from django.test.client import Client
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
@@ -235,3 +239,1418 @@ def post(client, view_name, data, kwargs={}):
     return client.post(url, data)
 
 __test__ = { 'doctest': tests }
+
+
+class PermissionResolverTestCase(TestCase):
+    def setUp(self):
+        # Registers the configurations.
+        import example.urls
+        self.conf = options.get('test')
+        self.admin = User.objects.create_user('admin', 'admin@example.com',
+                                              'admin')
+        self.user = User.objects.create_user('user', 'user@example.com',
+                                             'user')
+        self.group = Group.objects.create(creator=self.admin, name='perms')
+        self.group.add_members([self.user])
+
+    def request(self, user, method='GET'):
+        from django.http import HttpRequest
+        request = HttpRequest()
+        request.method = method
+        request.user = user
+        return request
+
+    def test_memoized(self):
+        from usergroups.permissions import PermissionResolver
+        resolver = PermissionResolver(self.user)
+        self.assertEqual(count_queries(resolver.get, self.group), 1)
+        self.assertEqual(count_queries(resolver.get, self.group), 0)
+        perms = resolver.get(self.group)
+        self.assertTrue(perms.is_member)
+        self.assertFalse(perms.is_admin)
+        perms = PermissionResolver(self.admin).get(self.group)
+        self.assertTrue(perms.is_owner and perms.is_admin)
+
+    def test_anonymous(self):
+        from django.contrib.auth.models import AnonymousUser
+        from usergroups.permissions import PermissionResolver
+        resolver = PermissionResolver(AnonymousUser())
+        self.assertEqual(count_queries(resolver.get, self.group), 0)
+        self.assertFalse(resolver.get(self.group).is_member)
+
+    def test_primed_by_get_group(self):
+        request = self.request(self.user)
+        group = self.conf.get_group(request, self.group.pk)
+        self.assertEqual(count_queries(self.conf.get_permissions, request,
+                                       group), 0)
+        self.assertTrue(self.conf.get_permissions(request, group).is_member)
+
+    def test_forgotten_after_change(self):
+        from usergroups.permissions import get_resolver
+        self.group.add_admins([self.user])
+        request = self.request(self.user)
+        group = self.conf.get_group(request, self.group.pk)
+        self.assertTrue(self.conf.get_permissions(request, group).is_admin)
+        group.remove_admin(self.user)
+        get_resolver(request).forget(group)
+        perms = self.conf.get_permissions(request, group)
+        self.assertFalse(perms.is_admin)
+        self.assertTrue(perms.is_member)
+
+        request = self.request(self.user)
+        group = self.conf.get_group(request, self.group.pk)
+        self.assertTrue(self.conf.get_permissions(request, group).is_member)
+        group.remove_members([self.user])
+        get_resolver(request).forget(group)
+        self.assertFalse(self.conf.get_permissions(request, group).is_member)
+
+
+class BulkMembershipTestCase(TestCase):
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'c@example.com')
+        self.users = [User.objects.create_user('user%d' % i,
+                                               'u%d@example.com' % i)
+                      for i in range(5)]
+        self.group = Group.objects.create(creator=self.creator, name='bulk')
+
+    def test_add_and_remove_members(self):
+        added = self.group.add_members(self.users[:3])
+        self.assertEqual(added, set([u.pk for u in self.users[:3]]))
+        # Existing members and plain ids are accepted.
+        added = self.group.add_members([self.users[0], self.users[3].pk])
+        self.assertEqual(added, set([self.users[3].pk]))
+        self.assertEqual(self.group.members.count(), 5)
+
+        removed = self.group.remove_members([self.users[0], self.users[4]])
+        self.assertEqual(removed, set([self.users[0].pk]))
+        self.assertEqual(self.group.members.count(), 4)
+
+    def test_promote_and_demote(self):
+        promoted = self.group.add_admins(self.users[:2])
+        self.assertEqual(len(promoted), 2)
+        self.assertEqual(self.group.admins.count(), 3)
+        self.assertEqual(self.group.members.count(), 3)
+
+        self.group.remove_admins([self.users[0]])
+        self.assertEqual(self.group.admins.count(), 2)
+        self.assertEqual(self.group.members.count(), 3)
+
+        self.group.remove_members([self.users[1]])
+        self.assertEqual(self.group.admins.count(), 1)
+
+    def test_creator_succession(self):
+        self.group.add_admins([self.users[0]])
+        self.group.remove_admins([self.creator])
+        group = Group.objects.get(pk=self.group.pk)
+        self.assertEqual(group.creator, self.users[0])
+
+    def test_one_signal_per_batch(self):
+        from usergroups.signals import memberships_changed
+        received = []
+        def receiver(sender, **kwargs):
+            received.append((kwargs['role'], kwargs['action'],
+                             kwargs['user_ids']))
+        memberships_changed.connect(receiver)
+        try:
+            self.group.add_members(self.users)
+            self.group.members.remove(self.users[0], self.users[1])
+        finally:
+            memberships_changed.disconnect(receiver)
+        self.assertEqual(received, [
+            ('members', 'add', frozenset([u.pk for u in self.users])),
+            ('members', 'remove', frozenset([self.users[0].pk,
+                                             self.users[1].pk])),
+        ])
+
+
+
+class CounterTestCase(TestCase):
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'c@example.com')
+        self.users = [User.objects.create_user('user%d' % i,
+                                               'u%d@example.com' % i)
+                      for i in range(3)]
+        self.group = Group.objects.create(creator=self.creator, name='count')
+
+    def assertCounters(self, member_count, admin_count):
+        group = Group.objects.get(pk=self.group.pk)
+        self.assertEqual((group.member_count, group.admin_count),
+                         (member_count, admin_count))
+        self.assertEqual((group.members.count(), group.admins.count()),
+                         (member_count, admin_count))
+
+    def test_counters(self):
+        self.assertCounters(1, 1)
+        self.assertEqual(self.group.get_member_count(), 1)
+
+        self.group.add_admins(self.users[:2])
+        self.assertCounters(3, 3)
+        self.group.members.add(self.users[2])
+        self.assertCounters(4, 3)
+        self.users[2].member_of_groups.remove(self.group)
+        self.assertCounters(3, 3)
+        self.group.remove_members([self.users[0], self.users[2]])
+        self.assertCounters(2, 2)
+        self.group.admins.clear()
+        self.assertCounters(2, 0)
+
+    def test_save_keeps_counters(self):
+        stale = Group.objects.get(pk=self.group.pk)
+        self.group.add_members(self.users)
+        stale.name = 'renamed'
+        stale.save()
+        self.assertCounters(4, 1)
+
+    def test_save_races_increment(self):
+        from django.db.models import F
+        from django.db.models import signals
+        def add_member(sender, instance, **kwargs):
+            # Committed by someone else while the group is being saved.
+            Group.objects.filter(pk=instance.pk).update(
+                member_count=F('member_count') + 1)
+        group = Group.objects.get(pk=self.group.pk)
+        signals.pre_save.connect(add_member, sender=Group)
+        try:
+            group.save()
+        finally:
+            signals.pre_save.disconnect(add_member, sender=Group)
+        self.assertEqual(group.member_count, 2)
+        self.assertEqual(Group.objects.get(pk=group.pk).member_count, 2)
+
+    def test_rebuild(self):
+        from django.core.management import call_command
+        Group.objects.filter(pk=self.group.pk).update(member_count=0,
+                                                      admin_count=7)
+        call_command('rebuild_usergroup_counters', 'test', verbosity=0)
+        self.assertCounters(1, 1)
+
+
+def count_queries(func, *args, **kwargs):
+    """Return the number of queries executed by calling `func`."""
+    from django.conf import settings
+    from django.db import connection
+    debug = settings.DEBUG
+    settings.DEBUG = True
+    try:
+        connection.queries = []
+        func(*args, **kwargs)
+        return len(connection.queries)
+    finally:
+        settings.DEBUG = debug
+
+
+class GroupListTestCase(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create_user('viewer', 'v@example.com',
+                                               'viewer')
+        self.other = User.objects.create_user('other', 'o@example.com')
+        self.client.login(username='viewer', password='viewer')
+
+    def create_groups(self, count):
+        for i in range(count):
+            group = Group.objects.create(creator=self.other,
+                                         name='group %d' % i)
+            group.add_members([self.viewer])
+
+    def get_list(self):
+        return get(self.client, 'usergroups_group_list', { 'slug': 'test' })
+
+    def test_annotations(self):
+        group = Group.objects.create(creator=self.viewer, name='mine')
+        group.add_members([self.other])
+        UserGroupApplication.objects.create(
+            user=User.objects.create_user('applicant', 'a@example.com'),
+            group=group)
+        self.create_groups(1)
+
+        r = self.get_list()
+        groups = dict([(g.pk, g) for g in r.context['group_list']])
+        mine = groups.pop(group.pk)
+        self.assertEqual((mine.num_members, mine.num_admins), (2, 1))
+        self.assertTrue(mine.viewer_is_admin and mine.viewer_is_member)
+        self.assertEqual(mine.num_applications, 1)
+
+        other = groups.values()[0]
+        self.assertTrue(other.viewer_is_member)
+        self.assertFalse(other.viewer_is_admin)
+        self.assertEqual(other.num_applications, 0)
+
+    def test_constant_queries(self):
+        self.create_groups(2)
+        small = count_queries(self.get_list)
+        self.create_groups(20)
+        self.assertEqual(count_queries(self.get_list), small)
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        import datetime
+        now = datetime.datetime(2010, 1, 1)
+        self.users = []
+        for i in range(7):
+            user = User.objects.create_user('user%d' % i, 'u%d@example.com' % i)
+            # Pairs of users share a timestamp to exercise the tiebreaker.
+            user.date_joined = now + datetime.timedelta(seconds=i // 2)
+            user.save()
+            self.users.append(user)
+
+    def test_paginator(self):
+        from usergroups.pagination import KeysetPaginator
+        paginator = KeysetPaginator(User.objects.all(), '-date_joined', 3)
+        expected = sorted(self.users, key=lambda u: (u.date_joined, u.pk),
+                          reverse=True)
+
+        first = paginator.page()
+        self.assertEqual(first.object_list, expected[:3])
+        self.assertFalse(first.has_previous())
+        second = paginator.page(first.next_cursor)
+        self.assertEqual(second.object_list, expected[3:6])
+        third = paginator.page(second.next_cursor)
+        self.assertEqual(third.object_list, expected[6:])
+        self.assertFalse(third.has_next())
+
+        back = paginator.page(third.previous_cursor)
+        self.assertEqual(back.object_list, expected[3:6])
+        back = paginator.page(back.previous_cursor)
+        self.assertEqual(back.object_list, expected[:3])
+        self.assertFalse(back.has_previous())
+
+    def test_views(self):
+        conf = options.get('test')
+        conf.pagination = 'keyset'
+        conf.paginate_members_by = 5
+        try:
+            group = Group.objects.create(creator=self.users[0], name='keyset')
+            group.add_members(self.users)
+            kwargs = { 'slug': 'test', 'group_id': group.pk }
+            r = get(self.client, 'usergroups_group_detail', kwargs)
+            self.assertEqual(len(r.context['member_list']), 5)
+            cursor = r.context['page_obj'].next_cursor
+            url = reverse('usergroups_group_detail', kwargs=kwargs)
+            r = self.client.get(url, { 'cursor': cursor })
+            self.assertEqual(len(r.context['member_list']), 2)
+            r = self.client.get(url, { 'cursor': 'garbage' })
+            self.assertEqual(r.status_code, 404)
+
+            r = get(self.client, 'usergroups_group_list', { 'slug': 'test' })
+            self.assertEqual(list(r.context['group_list']), [group])
+        finally:
+            conf.pagination = BaseUserGroupConfiguration.pagination
+            conf.paginate_members_by = \
+                BaseUserGroupConfiguration.paginate_members_by
+
+
+class EmailInvitationTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', 'admin@example.com',
+                                              'admin')
+        self.group = Group.objects.create(creator=self.admin, name='invite')
+        self.client.login(username='admin', password='admin')
+
+    def test_batch(self):
+        from django.core import mail
+        emails = ['user%d@example.com' % i for i in range(20)]
+        r = post(self.client, 'usergroups_create_email_invitation',
+                 { 'emails': '\n'.join(emails + emails[:3]) },
+                 { 'slug': 'test', 'group_id': self.group.pk })
+        self.assertEqual(r.status_code, 302)
+        self.assertEqual(EmailInvitation.objects.count(), 20)
+        self.assertEqual(len(mail.outbox), 20)
+
+        invitation = EmailInvitation.objects.get(email=emails[0])
+        self.assertEqual(invitation.group, self.group)
+        message = [m for m in mail.outbox if m.to == [emails[0]]][0]
+        self.assertTrue(invitation.secret_key in message.body)
+
+    def test_secret_keys(self):
+        invitation = EmailInvitation(user=self.admin, group=self.group)
+        keys = set([invitation.generate_secret_key() for i in range(2000)])
+        self.assertEqual(len(keys), 2000)
+        for key in keys:
+            self.assertEqual(len(key), 30)
+
+
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', 'admin@example.com',
+                                              'admin')
+        self.group = Group.objects.create(creator=self.admin, name='outbox')
+        self.client.login(username='admin', password='admin')
+        self.conf = options.get('test')
+        self.conf.use_outbox = True
+
+    def tearDown(self):
+        self.conf.use_outbox = BaseUserGroupConfiguration.use_outbox
+
+    def test_invitations_are_queued(self):
+        from django.core import mail
+        from django.core.management import call_command
+        from usergroups.models import OutboxMessage
+
+        emails = ['user%d@example.com' % i for i in range(5)]
+        r = post(self.client, 'usergroups_create_email_invitation',
+                 { 'emails': ' '.join(emails) },
+                 { 'slug': 'test', 'group_id': self.group.pk })
+        self.assertEqual(r.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxMessage.objects.count(), 5)
+
+        call_command('process_usergroup_outbox', batch_size=2, verbosity=0)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(sorted([m.to[0] for m in mail.outbox]), emails)
+        self.assertEqual(OutboxMessage.objects.filter(
+            status=OutboxMessage.STATUS_SENT).count(), 5)
+
+    def test_retry_and_failure(self):
+        from usergroups import outbox
+        from usergroups.models import OutboxMessage
+
+        message = OutboxMessage.objects.create(kind=OutboxMessage.KIND_EMAIL,
+                                               payload='["incomplete"]')
+        worker = outbox.worker_id()
+        self.assertEqual(outbox.deliver(outbox.claim(worker, 10), 2), (0, 1))
+        message = OutboxMessage.objects.get(pk=message.pk)
+        self.assertEqual(message.attempts, 1)
+        self.assertEqual(message.status, OutboxMessage.STATUS_PENDING)
+        self.assertTrue(message.last_error)
+        # Backing off; not available yet.
+        self.assertEqual(outbox.claim(worker, 10), [])
+
+        OutboxMessage.objects.filter(pk=message.pk).update(
+            available=message.created)
+        outbox.deliver(outbox.claim(worker, 10), 2)
+        message = OutboxMessage.objects.get(pk=message.pk)
+        self.assertEqual(message.status, OutboxMessage.STATUS_FAILED)
+
+    def test_expired_claim(self):
+        import datetime
+        from django.core import mail
+        from usergroups import outbox
+        from usergroups.models import OutboxMessage
+
+        outbox.enqueue_emails([('subject', 'body', 'admin@example.com',
+                                ['user%d@example.com' % i]) for i in range(2)])
+        worker = outbox.worker_id()
+        messages = outbox.claim(worker, 10)
+        # The claim on the second message expired and another worker took
+        # it over while the first one was being delivered.
+        expired = datetime.datetime.now() - outbox.CLAIM_TIMEOUT * 2
+        OutboxMessage.objects.filter(pk=messages[1].pk).update(claimed=expired)
+        self.assertEqual(len(outbox.claim(outbox.worker_id(), 10)), 1)
+
+        self.assertEqual(outbox.deliver(messages, 2), (1, 0))
+        self.assertEqual([m.to for m in mail.outbox], [['user0@example.com']])
+        message = OutboxMessage.objects.get(pk=messages[1].pk)
+        self.assertEqual(message.status, OutboxMessage.STATUS_PENDING)
+        self.assertNotEqual(message.claimed_by, worker)
+
+
+class HandleInviteTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', 'admin@example.com')
+        self.user = User.objects.create_user('user', 'user@example.com')
+        self.group = Group.objects.create(creator=self.admin, name='a')
+        self.other = Group.objects.create(creator=self.admin, name='b')
+        self.invitation = EmailInvitation.objects.create(
+            user=self.admin, group=self.group, email=self.user.email)
+
+    def test_scoped_to_group(self):
+        key = self.invitation.secret_key
+        self.assertFalse(EmailInvitation.objects.handle_invite(
+            self.user, self.other, key))
+        self.assertEqual(self.other.members.filter(pk=self.user.pk).count(), 0)
+
+        self.assertTrue(EmailInvitation.objects.handle_invite(
+            self.user, self.group, key))
+        self.assertEqual(self.group.members.filter(pk=self.user.pk).count(), 1)
+        self.assertEqual(EmailInvitation.objects.count(), 0)
+
+        # Invitations can only be used once.
+        self.assertFalse(EmailInvitation.objects.handle_invite(
+            self.user, self.group, key))
+
+
+class InvitationExpiryTestCase(TestCase):
+    def setUp(self):
+        import datetime
+        self.admin = User.objects.create_user('admin', 'admin@example.com')
+        self.user = User.objects.create_user('user', 'user@example.com',
+                                             'user')
+        self.group = Group.objects.create(creator=self.admin, name='expiry')
+        old = datetime.datetime.now() - datetime.timedelta(days=30)
+        self.expired = EmailInvitation.objects.create(
+            user=self.admin, group=self.group, email='a@example.com',
+            created=old)
+        self.fresh = EmailInvitation.objects.create(
+            user=self.admin, group=self.group, email='b@example.com')
+        self.conf = options.get('test')
+        self.conf.invitation_ttl = datetime.timedelta(days=7)
+
+    def tearDown(self):
+        self.conf.invitation_ttl = BaseUserGroupConfiguration.invitation_ttl
+
+    def test_expired_invitation_rejected(self):
+        self.client.login(username='user', password='user')
+        kwargs = { 'slug': 'test', 'group_id': self.group.pk }
+        kwargs['key'] = self.expired.secret_key
+        r = get(self.client, 'usergroups_validate_email_invitation', kwargs)
+        self.assertEqual(r.status_code, 200)
+        kwargs['key'] = self.fresh.secret_key
+        r = get(self.client, 'usergroups_validate_email_invitation', kwargs)
+        self.assertEqual(r.status_code, 302)
+
+    def test_purge(self):
+        from django.core.management import call_command
+        call_command('purge_usergroup_invitations', 'test', chunk_size=1,
+                     verbosity=0)
+        self.assertEqual(list(EmailInvitation.objects.all()), [self.fresh])
+
+    def test_purge_shared_model(self):
+        import datetime
+        from django.core.management import call_command
+        options.register('expiry', Group)
+        try:
+            other = options.get('expiry')
+            other.invitation_ttl = datetime.timedelta(days=60)
+            call_command('purge_usergroup_invitations', 'test', verbosity=0)
+            self.assertEqual(EmailInvitation.objects.count(), 2)
+            other.invitation_ttl = None
+            call_command('purge_usergroup_invitations', verbosity=0)
+            self.assertEqual(EmailInvitation.objects.count(), 2)
+        finally:
+            del options.options.configurations['expiry']
+
+
+class SignedInvitationTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', 'admin@example.com',
+                                              'admin')
+        self.user = User.objects.create_user('user', 'user@example.com',
+                                             'user')
+        self.group = Group.objects.create(creator=self.admin, name='signed')
+        self.other = Group.objects.create(creator=self.admin, name='other')
+        self.conf = options.get('test')
+        self.conf.signed_invitations = True
+
+    def tearDown(self):
+        self.conf.signed_invitations = \
+            BaseUserGroupConfiguration.signed_invitations
+
+    def test_tokens(self):
+        import datetime
+        from usergroups import tokens
+        token = tokens.make_token(self.group, u'user@example.com')
+        self.assertEqual(tokens.check_token(token, self.group)[0],
+                         u'user@example.com')
+        self.assertEqual(tokens.check_token(token, self.other), None)
+        self.assertEqual(tokens.check_token(token[:-1] + 'x', self.group),
+                         None)
+        old = tokens.make_token(self.group, u'user@example.com',
+                                timestamp=1000000000)
+        self.assertEqual(tokens.check_token(old, self.group,
+                                            datetime.timedelta(days=1)), None)
+
+    def test_views(self):
+        from django.core import mail
+        from usergroups import tokens
+        from usergroups.models import UsedInvitationToken
+
+        self.client.login(username='admin', password='admin')
+        r = post(self.client, 'usergroups_create_email_invitation',
+                 { 'emails': self.user.email },
+                 { 'slug': 'test', 'group_id': self.group.pk })
+        self.assertEqual(r.status_code, 302)
+        self.assertEqual(EmailInvitation.objects.count(), 0)
+        token = re.search(r'/validate/([^/]+)/', mail.outbox[0].body).group(1)
+        self.assertTrue(tokens.is_token(token))
+
+        self.client.login(username='user', password='user')
+        kwargs = { 'slug': 'test', 'group_id': self.group.pk, 'key': token }
+        r = get(self.client, 'usergroups_validate_email_invitation', kwargs)
+        self.assertEqual(r.status_code, 302)
+        self.assertEqual(UsedInvitationToken.objects.count(), 1)
+        self.assertEqual(self.group.members.filter(pk=self.user.pk).count(), 1)
+
+        # A token can only be used once.
+        self.group.remove_members([self.user])
+        r = get(self.client, 'usergroups_validate_email_invitation', kwargs)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.group.members.filter(pk=self.user.pk).count(), 0)
+
+
+class ApplicationInboxTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', 'admin@example.com',
+                                              'admin')
+        self.group = Group.objects.create(creator=self.admin, name='inbox')
+        for i in range(8):
+            UserGroupApplication.objects.create(
+                user=User.objects.create_user('applicant%d' % i,
+                                              'a%d@example.com' % i),
+                group=self.group)
+        self.client.login(username='admin', password='admin')
+        self.kwargs = { 'slug': 'test', 'group_id': self.group.pk }
+
+    def test_detail_shows_newest(self):
+        r = get(self.client, 'usergroups_group_detail', self.kwargs)
+        self.assertEqual(r.context['application_count'], 8)
+        self.assertEqual(len(r.context['application_list']), 5)
+
+    def test_inbox(self):
+        conf = options.get('test')
+        conf.paginate_applications_by = 5
+        try:
+            r = get(self.client, 'usergroups_application_inbox', self.kwargs)
+            self.assertEqual(r.status_code, 200)
+            first = list(r.context['application_list'])
+            self.assertEqual(len(first), 5)
+            url = reverse('usergroups_application_inbox', kwargs=self.kwargs)
+            r = self.client.get(url, {
+                'cursor': r.context['page_obj'].next_cursor,
+            })
+            second = list(r.context['application_list'])
+            self.assertEqual(len(second), 3)
+            self.assertEqual(len(set(first + second)), 8)
+        finally:
+            conf.paginate_applications_by = \
+                BaseUserGroupConfiguration.paginate_applications_by
+
+        def render_inbox():
+            get(self.client, 'usergroups_application_inbox', self.kwargs)
+        queries = count_queries(render_inbox)
+        UserGroupApplication.objects.create(
+            user=User.objects.create_user('late', 'late@example.com'),
+            group=self.group)
+        self.assertEqual(count_queries(render_inbox), queries)
+
+    def test_admins_only(self):
+        User.objects.create_user('user', 'user@example.com', 'user')
+        self.client.login(username='user', password='user')
+        r = get(self.client, 'usergroups_application_inbox', self.kwargs)
+        self.assertEqual(r.status_code, 400)
+
+
+class BatchActionTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', 'admin@example.com',
+                                              'admin')
+        self.users = [User.objects.create_user('user%d' % i,
+                                               'u%d@example.com' % i, 'user')
+                      for i in range(6)]
+        self.group = Group.objects.create(creator=self.admin, name='batch')
+        self.group.add_members(self.users[:3])
+        self.group.add_admins([self.users[2]])
+        self.applications = [
+            UserGroupApplication.objects.create(user=user, group=self.group)
+            for user in self.users[3:]]
+        self.client.login(username='admin', password='admin')
+        self.url = reverse('usergroups_batch_action',
+                           kwargs={ 'slug': 'test',
+                                    'group_id': self.group.pk })
+
+    def test_batch(self):
+        from django.utils import simplejson
+        actions = [
+            'approve_application:%d' % self.applications[0].pk,
+            'approve_application:%d' % self.applications[1].pk,
+            'ignore_application:%d' % self.applications[2].pk,
+            'add_admin:%d' % self.users[0].pk,
+            'revoke_admin:%d' % self.users[2].pk,
+            'remove_member:%d' % self.users[1].pk,
+            'remove_member:%d' % self.admin.pk,
+        ]
+        r = self.client.post(self.url, { 'actions': actions })
+        self.assertEqual(r.status_code, 200)
+        data = simplejson.loads(r.content)
+        self.assertEqual(data['approve_application'],
+                         [a.pk for a in self.applications[:2]])
+        self.assertEqual(data['ignore_application'],
+                         [self.applications[2].pk])
+        self.assertEqual(data['remove_member'], [self.users[1].pk])
+        self.assertEqual(data['message'], u"6 action(s) performed.")
+
+        self.assertEqual(UserGroupApplication.objects.count(), 0)
+        self.assertEqual(set(self.group.members.all()),
+                         set([self.admin, self.users[0], self.users[2],
+                              self.users[3], self.users[4]]))
+        self.assertEqual(set(self.group.admins.all()),
+                         set([self.admin, self.users[0]]))
+
+    def test_json_body(self):
+        from django.utils import simplejson
+        body = simplejson.dumps({ 'actions': [['add_admin', self.users[1].pk]] })
+        r = self.client.post(self.url, body, content_type='application/json')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.group.admins.filter(pk=self.users[1].pk).count(),
+                         1)
+
+    def test_rejected(self):
+        r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 405)
+        r = self.client.post(self.url, { 'actions': ['delete_group:1'] })
+        self.assertEqual(r.status_code, 400)
+        self.client.login(username='user0', password='user')
+        r = self.client.post(self.url, {
+            'actions': ['remove_member:%d' % self.admin.pk],
+        })
+        self.assertEqual(r.status_code, 400)
+
+
+class BatchActionTransactionTestCase(TransactionTestCase):
+    """Batches run in one transaction; ``TestCase`` can't roll back."""
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', 'admin@example.com',
+                                              'admin')
+        self.user = User.objects.create_user('user', 'user@example.com')
+        self.group = Group.objects.create(creator=self.admin, name='batch')
+        self.application = UserGroupApplication.objects.create(
+            user=self.user, group=self.group)
+
+    def tearDown(self):
+        # Tests that run after this one, such as the doctests, expect an
+        # empty database.
+        from django.core.management import call_command
+        call_command('flush', verbosity=0, interactive=False)
+
+    def test_rollback(self):
+        class Request(object):
+            user = self.admin
+        def fail(*args, **kwargs):
+            raise RuntimeError
+        # Registers the configurations.
+        import example.urls
+        conf = options.get('test')
+        actions = dict([(action, set()) for action in conf.batch_actions])
+        actions.update({
+            'approve_application': set([self.application.pk]),
+            'add_admin': set([self.user.pk]),
+            'remove_member': set([self.user.pk]),
+        })
+        self.group._remove_members = fail
+        self.assertRaises(RuntimeError, conf.apply_batch_actions, Request(),
+                          self.group, actions)
+        self.assertEqual(UserGroupApplication.objects.count(), 1)
+        self.assertEqual(self.group.members.filter(pk=self.user.pk).count(), 0)
+        self.assertEqual(self.group.admins.filter(pk=self.user.pk).count(), 0)
+
+
+class SearchIndexTransactionTestCase(TransactionTestCase):
+    """Groups saved outside transaction management, as in a request that
+    has not entered a transaction yet.
+
+    """
+    def setUp(self):
+        import thread
+        from django.db import transaction
+        self.admin = User.objects.create_user('admin', 'admin@example.com')
+        # Forget this thread's transaction state, as in a fresh thread.
+        transaction.dirty.pop(thread.get_ident(), None)
+
+    def tearDown(self):
+        from django.core.management import call_command
+        call_command('flush', verbosity=0, interactive=False)
+
+    def test_save(self):
+        from django.db import transaction
+        from usergroups import search
+        group = Group.objects.create(creator=self.admin, name='Foo bar')
+        self.assertFalse(transaction.is_dirty())
+        self.assertEqual(group.member_count, 1)
+        self.assertEqual(list(search.search(Group.objects.all(), 'foo')),
+                         [group])
+        # Queryset deletes only reach the index through `post_delete`.
+        Group.objects.filter(pk=group.pk).delete()
+        self.assertFalse(transaction.is_dirty())
+        self.assertEqual(list(search.search(Group.objects.all(), 'foo')), [])
+
+
+class GroupRelationPrefetchTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', 'admin@example.com')
+        self.groups = [Group.objects.create(creator=self.admin,
+                                            name='group%d' % i)
+                       for i in range(3)]
+        for (i, group) in enumerate(self.groups):
+            UserGroupApplication.objects.create(
+                user=User.objects.create_user('applicant%d' % i,
+                                              'a%d@example.com' % i),
+                group=group)
+
+    def test_with_groups(self):
+        def describe():
+            return [unicode(application) for application in
+                    UserGroupApplication.objects.with_groups().order_by('pk')]
+        # One query for the applications and their users, one for the groups.
+        self.assertEqual(count_queries(describe), 2)
+        self.assertEqual([a.group for a in
+                          UserGroupApplication.objects.with_groups()
+                                                      .order_by('pk')],
+                         self.groups)
+
+    def test_known_group(self):
+        group = self.groups[0]
+        def load():
+            for application in UserGroupApplication.objects.filter(
+                object_id=group.pk).with_groups(group):
+                self.assertTrue(application.group is group)
+        self.assertEqual(count_queries(load), 1)
+
+
+class URLTemplateTestCase(TestCase):
+    def test_get_url(self):
+        conf = options.get('test')
+        self.assertEqual(conf.get_url('usergroups_group_list'),
+                         reverse('usergroups_group_list', args=('test', )))
+        self.assertEqual(conf.get_url('usergroups_add_admin_done', 12, 345),
+                         reverse('usergroups_add_admin_done',
+                                 args=('test', 12, 345)))
+        self.assertEqual(
+            conf.get_url('usergroups_validate_email_invitation', 1, 'abc'),
+            reverse('usergroups_validate_email_invitation',
+                    args=('test', 1, 'abc')))
+
+    def test_content_type(self):
+        from django.contrib.contenttypes.models import ContentType
+        conf = options.get('test')
+        self.assertEqual(conf.content_type,
+                         ContentType.objects.get_for_model(Group))
+
+
+class MembershipCacheTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.admin = User.objects.create_user('admin', 'admin@example.com',
+                                              'admin')
+        self.user = User.objects.create_user('user', 'user@example.com',
+                                             'user')
+        self.group = Group.objects.create(creator=self.admin, name='cached')
+        self.conf = options.get('test')
+        self.conf.cache_memberships = True
+
+    def tearDown(self):
+        self.conf.cache_memberships = \
+            BaseUserGroupConfiguration.cache_memberships
+
+    def test_is_admin(self):
+        self.assertTrue(self.conf.is_admin(self.admin, self.group))
+        self.assertEqual(count_queries(self.conf.is_admin, self.admin,
+                                       self.group), 0)
+        self.assertFalse(self.conf.is_admin(self.user, self.group))
+
+        self.group.add_admins([self.user])
+        self.assertTrue(self.conf.is_admin(self.user, self.group))
+        self.group.admins.remove(self.user)
+        self.assertFalse(self.conf.is_admin(self.user, self.group))
+
+    def test_related_managers(self):
+        from usergroups.cache import get_memberships
+        self.assertEqual(get_memberships(Group, self.user.pk),
+                         (frozenset(), frozenset()))
+        self.user.member_of_groups.add(self.group)
+        self.assertEqual(get_memberships(Group, self.user.pk),
+                         (frozenset([self.group.pk]), frozenset()))
+        get_memberships(Group, self.admin.pk)
+        self.group.members.clear()
+        self.assertEqual(get_memberships(Group, self.admin.pk)[0],
+                         frozenset())
+
+    def test_group_deleted(self):
+        from usergroups.cache import get_memberships
+        self.assertEqual(get_memberships(Group, self.admin.pk)[1],
+                         frozenset([self.group.pk]))
+        self.group.delete()
+        self.assertEqual(get_memberships(Group, self.admin.pk),
+                         (frozenset(), frozenset()))
+
+    def test_invalidated_after_commit(self):
+        from django.core.cache import cache
+        from usergroups.cache import cache_key
+        from usergroups.cache import commit_then_invalidate
+        from usergroups.cache import get_memberships
+        self.group.add_admins([self.user])
+        stale = get_memberships(Group, self.user.pk)
+        key = cache_key(Group, self.user.pk)
+        @commit_then_invalidate
+        def demote():
+            self.group._remove_admins([self.user])
+            # Cached by a concurrent request before the commit.
+            cache.set(key, stale)
+        demote()
+        self.assertEqual(cache.get(key), None)
+        self.assertFalse(self.conf.is_admin(self.user, self.group))
+
+    def test_views(self):
+        self.client.login(username='user', password='user')
+        kwargs = { 'slug': 'test', 'group_id': self.group.pk }
+        r = get(self.client, 'usergroups_group_detail', kwargs)
+        self.assertFalse(r.context['is_member'])
+        self.group.add_members([self.user])
+        r = get(self.client, 'usergroups_group_detail', kwargs)
+        self.assertTrue(r.context['is_member'])
+        r = post(self.client, 'usergroups_apply_to_join', {}, kwargs)
+        self.assertEqual(UserGroupApplication.objects.count(), 0)
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', 'admin@example.com',
+                                              'admin')
+        self.users = [User.objects.create_user('user%d' % i,
+                                               'u%d@example.com' % i, 'user')
+                      for i in range(5)]
+        self.group = Group.objects.create(creator=self.admin, name='export')
+        self.group.add_members(self.users)
+        self.group.add_admins([self.users[3]])
+        self.kwargs = { 'slug': 'test', 'group_id': self.group.pk }
+
+    def test_iter_members(self):
+        from usergroups.export import iter_members
+        members = list(iter_members(self.group, chunk_size=2))
+        self.assertEqual([m['user_id'] for m in members],
+                         sorted([self.admin.pk] +
+                                [user.pk for user in self.users]))
+        roles = dict([(m['username'], m['role']) for m in members])
+        self.assertEqual(roles['admin'], 'admin')
+        self.assertEqual(roles['user3'], 'admin')
+        self.assertEqual(roles['user0'], 'member')
+
+    def test_view(self):
+        from django.utils import simplejson
+        self.client.login(username='admin', password='admin')
+        url = reverse('usergroups_export_members', kwargs=self.kwargs)
+        r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        lines = r.content.splitlines()
+        self.assertEqual(lines[0], 'user_id,username,role,joined')
+        self.assertEqual(len(lines), 7)
+
+        r = self.client.get(url, { 'format': 'ndjson' })
+        rows = [simplejson.loads(line) for line in r.content.splitlines()]
+        self.assertEqual(len(rows), 6)
+
+        self.client.login(username='user0', password='user')
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_command(self):
+        import os
+        import tempfile
+        from django.core.management import call_command
+        (fd, path) = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            call_command('export_usergroup_members', 'test',
+                         str(self.group.pk), output=path, chunk_size=4)
+            self.assertEqual(len(open(path).read().splitlines()), 7)
+        finally:
+            os.remove(path)
+
+
+class ImportTestCase(TestCase):
+    def setUp(self):
+        import tempfile
+        self.admin = User.objects.create_user('admin', 'admin@example.com')
+        self.users = [User.objects.create_user('user%d' % i,
+                                               'u%d@example.com' % i)
+                      for i in range(4)]
+        self.group = Group.objects.create(creator=self.admin, name='import')
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def write(self, name, content):
+        import os
+        path = os.path.join(self.dir, name)
+        f = open(path, 'w')
+        f.write(content)
+        f.close()
+        return path
+
+    def test_csv(self):
+        from django.core.management import call_command
+        gid = self.group.pk
+        path = self.write('in.csv', 'group,user,role\n' + ''.join([
+            '%d,user0,\n' % gid,
+            '%d,user1,admin\n' % gid,
+            '%d,nobody,member\n' % gid,
+            '%d,user2,member\n' % (gid + 1),
+            '%d,user0,member\n' % gid,
+        ]))
+        call_command('import_usergroup_memberships', 'test', path,
+                     chunk_size=2, verbosity=0)
+        self.assertEqual(set(self.group.members.all()),
+                         set([self.admin, self.users[0], self.users[1]]))
+        self.assertEqual(set(self.group.admins.all()),
+                         set([self.admin, self.users[1]]))
+        self.assertEqual(Group.objects.get(pk=gid).member_count, 3)
+
+    def test_resume(self):
+        import os
+        from django.core.management import call_command
+        lines = ['{"group": %d, "user_id": %d}\n' % (self.group.pk, user.pk)
+                 for user in self.users]
+        path = self.write('in.ndjson', ''.join(lines))
+        self.write('in.ndjson.state', '2')
+        call_command('import_usergroup_memberships', 'test', path,
+                     verbosity=0)
+        self.assertEqual(set(self.group.members.all()),
+                         set([self.admin] + self.users[2:]))
+        self.assertFalse(os.path.exists(path + '.state'))
+
+
+class SuccessionTestCase(TestCase):
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'c@example.com')
+        self.users = [User.objects.create_user('user%d' % i,
+                                               'u%d@example.com' % i)
+                      for i in range(3)]
+        self.group = Group.objects.create(creator=self.creator, name='a')
+        for user in self.users:
+            self.group.add_admins([user])
+
+    def test_oldest_admin(self):
+        self.group.remove_admins([self.creator, self.users[0]])
+        self.assertEqual(self.group.creator, self.users[1])
+        self.assertEqual(Group.objects.get(pk=self.group.pk).creator_id,
+                         self.users[1].pk)
+
+    def test_policy(self):
+        from usergroups import succession
+        self.group.remove_members([self.creator],
+                                  succession=succession.newest_admin)
+        self.assertEqual(Group.objects.get(pk=self.group.pk).creator_id,
+                         self.users[2].pk)
+        self.group.remove_admins([self.users[2]],
+                                 succession=succession.random_admin)
+        self.assertTrue(Group.objects.get(pk=self.group.pk).creator_id in
+                        (self.users[0].pk, self.users[1].pk))
+
+    def test_bounded_queries(self):
+        more = [User.objects.create_user('more%d' % i, 'm%d@example.com' % i)
+                for i in range(20)]
+        group = Group.objects.create(creator=self.creator, name='b')
+        group.add_admins(self.users)
+        def remove(group, user):
+            group.remove_admins([user])
+        few = count_queries(remove, group, self.creator)
+        group.add_admins(more)
+        self.assertEqual(count_queries(remove, group, group.creator), few)
+
+    def test_stale_creator(self):
+        stale = Group.objects.get(pk=self.group.pk)
+        self.group.remove_admins([self.creator])
+        self.assertEqual(self.group.creator_id, self.users[0].pk)
+        # `stale` still thinks `creator` is the creator; the new creator is
+        # read from the locked row before succession is decided.
+        stale.remove_admins([self.users[0]])
+        self.assertEqual(stale.creator_id, self.users[1].pk)
+        self.assertEqual(Group.objects.get(pk=self.group.pk).creator_id,
+                         self.users[1].pk)
+
+    def test_no_admins_left(self):
+        group = Group.objects.create(creator=self.creator, name='b')
+        group.remove_admins([self.creator])
+        self.assertEqual(Group.objects.get(pk=group.pk).creator_id,
+                         self.creator.pk)
+
+
+class RoleGroupTestCase(TestCase):
+    def setUp(self):
+        from example.groups.models import RoleGroup
+        self.creator = User.objects.create_user('creator', 'c@example.com',
+                                                'creator')
+        self.users = [User.objects.create_user('user%d' % i,
+                                               'u%d@example.com' % i)
+                      for i in range(4)]
+        self.group = RoleGroup.objects.create(creator=self.creator,
+                                              name='roles')
+
+    def memberships(self):
+        from example.groups.models import RoleGroupMembership
+        return dict(RoleGroupMembership.objects.filter(group=self.group)
+                    .values_list('user', 'role'))
+
+    def test_roles(self):
+        from example.groups.models import RoleGroupMembership as M
+        self.assertEqual(self.memberships(), { self.creator.pk: M.ROLE_ADMIN })
+        self.group.add_members(self.users[:2])
+        self.group.add_admins(self.users[1:3])
+        self.assertEqual(self.memberships(), {
+            self.creator.pk: M.ROLE_ADMIN,
+            self.users[0].pk: M.ROLE_MEMBER,
+            self.users[1].pk: M.ROLE_ADMIN,
+            self.users[2].pk: M.ROLE_ADMIN,
+        })
+        self.assertEqual(self.group.member_count, 4)
+        self.assertEqual(self.group.admin_count, 3)
+
+        self.group.remove_admins([self.users[1]])
+        self.group.remove_members([self.users[2], self.users[3]])
+        self.assertEqual(self.memberships(), {
+            self.creator.pk: M.ROLE_ADMIN,
+            self.users[0].pk: M.ROLE_MEMBER,
+            self.users[1].pk: M.ROLE_MEMBER,
+        })
+        self.assertEqual(self.group.member_count, 3)
+        self.assertEqual(self.group.admin_count, 1)
+
+    def test_compatibility_accessors(self):
+        self.group.members.add(self.users[0])
+        self.group.admins.add(self.users[1])
+        self.assertEqual(set(self.group.members.all()),
+                         set([self.creator, self.users[0], self.users[1]]))
+        self.assertEqual(self.group.admins.count(), 2)
+        self.assertEqual(self.group.get_member_count(), 3)
+        self.group.admins.remove(self.users[1])
+        self.assertEqual(self.group.admins.filter(pk=self.users[1].pk)
+                                          .count(), 0)
+
+    def test_succession(self):
+        self.group.add_admins(self.users[:2])
+        self.group.remove_members([self.creator])
+        self.assertEqual(self.group.creator_id, self.users[0].pk)
+
+    def test_views(self):
+        from usergroups.permissions import PermissionResolver
+        self.group.add_members([self.users[0]])
+        self.assertTrue(options.get('roles').is_admin(self.creator,
+                                                      self.group))
+        perms = PermissionResolver(self.users[0]).get(self.group)
+        self.assertTrue(perms.is_member and not perms.is_admin)
+
+        self.client.login(username='creator', password='creator')
+        r = get(self.client, 'usergroups_group_detail',
+                { 'slug': 'roles', 'group_id': self.group.pk })
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.context['is_admin'])
+        r = get(self.client, 'usergroups_group_list', { 'slug': 'roles' })
+        group = r.context['group_list'][0]
+        self.assertEqual((group.num_members, group.num_admins), (2, 1))
+
+    def test_export_joined(self):
+        from usergroups.export import iter_members
+        self.assertTrue(list(iter_members(self.group))[0]['joined'])
+
+    def test_migrate(self):
+        from django.core.management import call_command
+        # The old tables of a group with the same id.
+        old = Group.objects.create(pk=self.group.pk, creator=self.creator,
+                                   name='old')
+        old.add_members([self.users[0]])
+        old.add_admins([self.users[1], self.users[2]])
+        self.group.add_members([self.users[2]])
+        call_command('migrate_usergroup_memberships', 'roles',
+                     members_table=Group._meta.get_field('members')
+                                              .m2m_db_table(),
+                     admins_table=Group._meta.get_field('admins')
+                                             .m2m_db_table(),
+                     group_column='group_id', verbosity=0)
+        self.assertEqual(set(self.group.members.all()),
+                         set([self.creator] + self.users[:3]))
+        self.assertEqual(set(self.group.admins.all()),
+                         set([self.creator, self.users[1], self.users[2]]))
+
+
+class ViewQueriesTestCase(TestCase):
+    """Small runs of the view benchmark, to catch queries that scale with
+    the size of a group.
+
+    """
+    def test_views(self):
+        from example.groups.benchmarks import view_queries
+        report = view_queries(sizes=(2, 40), applications=30)
+        self.assertEqual(report['scaling'], [])
+
+    def test_role_views(self):
+        from example.groups.benchmarks import view_queries
+        report = view_queries(sizes=(2, 40), slug='roles', applications=30)
+        self.assertEqual(report['scaling'], [])
+
+
+class InvitationAcceptanceTestCase(TestCase):
+    def test_small_sizes(self):
+        from example.groups.benchmarks import invitation_acceptance
+        report = invitation_acceptance(sizes=(10, 200), tolerance=1000)
+        self.assertEqual([r['size'] for r in report['results']], [10, 200])
+
+
+class SyntheticDataTestCase(TestCase):
+    def generate(self, prefix):
+        from usergroups import synthetic
+        return synthetic.generate(Group, users=60, groups=8, max_members=40,
+                                  application_rate=0.1, invitation_rate=0.1,
+                                  seed=3, prefix=prefix, batch_size=3)
+
+    def test_generate(self):
+        totals = self.generate('a')
+        self.assertEqual(totals['groups'], 8)
+        groups = Group.objects.filter(name__startswith='a-')
+        self.assertEqual(groups.count(), 8)
+        sizes = sorted([group.members.count() for group in groups])
+        self.assertEqual(sizes[-1], 40)
+        self.assertEqual(sum(sizes), totals['members'])
+        for group in groups:
+            self.assertEqual(group.member_count, group.members.count())
+            self.assertEqual(group.admin_count, group.admins.count())
+            self.assertTrue(group.admins.filter(pk=group.creator_id).count())
+        self.assertEqual(UserGroupApplication.objects.count(),
+                         totals['applications'])
+        self.assertEqual(EmailInvitation.objects.count(),
+                         totals['invitations'])
+
+    def test_seeded(self):
+        first = self.generate('a')
+        second = self.generate('b')
+        self.assertEqual(first, second)
+        sizes = lambda prefix: [g.members.count() for g in
+                                Group.objects.filter(name__startswith=prefix)
+                                             .order_by('pk')]
+        self.assertEqual(sizes('a-'), sizes('b-'))
+
+
+class InstrumentationTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.admin = User.objects.create_user('admin', 'admin@example.com',
+                                              'admin')
+        self.group = Group.objects.create(creator=self.admin, name='timed')
+        self.client.login(username='admin', password='admin')
+
+    def tearDown(self):
+        from django.conf import settings
+        from usergroups import instrumentation
+        for name in ('USERGROUPS_INSTRUMENTATION',
+                     'USERGROUPS_STATSD_ADDRESS'):
+            if hasattr(settings, name):
+                delattr(settings, name)
+        instrumentation.reset_sinks()
+
+    def configure(self, *sinks):
+        from django.conf import settings
+        from usergroups import instrumentation
+        settings.USERGROUPS_INSTRUMENTATION = sinks
+        instrumentation.reset_sinks()
+
+    def test_ring_buffer(self):
+        import sys
+        from StringIO import StringIO
+        from django.core.management import call_command
+        from usergroups.instrumentation import RingBufferSink
+        self.configure('usergroups.instrumentation.RingBufferSink')
+        get(self.client, 'usergroups_group_detail',
+            { 'slug': 'test', 'group_id': self.group.pk })
+        get(self.client, 'usergroups_group_detail',
+            { 'slug': 'test', 'group_id': self.group.pk + 1 })
+        records = RingBufferSink().records()
+        self.assertEqual([(r['slug'], r['view'], r['status'])
+                          for r in records],
+                         [('test', 'group_detail', 200),
+                          ('test', 'group_detail', 404)])
+        self.assertTrue(records[0]['queries'] > 0)
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            call_command('show_usergroup_view_stats', clear=True)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertTrue('test.group_detail' in output)
+        self.assertEqual(RingBufferSink().records(), [])
+
+    def test_statsd(self):
+        import socket
+        from django.conf import settings
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        try:
+            settings.USERGROUPS_STATSD_ADDRESS = server.getsockname()
+            self.configure('usergroups.instrumentation.StatsdSink')
+            get(self.client, 'usergroups_group_list', { 'slug': 'test' })
+            metrics = server.recv(4096).split('\n')
+        finally:
+            server.close()
+        names = [metric.split(':')[0] for metric in metrics]
+        self.assertEqual(names, ['usergroups.test.group_list.time',
+                                 'usergroups.test.group_list.queries',
+                                 'usergroups.test.group_list.query_time',
+                                 'usergroups.test.group_list.status.200'])
+
+
+class SearchTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', 'admin@example.com',
+                                              'admin')
+        self.climbers = Group.objects.create(
+            creator=self.admin, name='Climbers of Sweden',
+            info='Bouldering and sport climbing.')
+        self.hikers = Group.objects.create(
+            creator=self.admin, name='Hikers',
+            info='Walks in the mountains, and some climbing.')
+        self.chess = Group.objects.create(creator=self.admin, name='Chess')
+        self.client.login(username='admin', password='admin')
+
+    def search(self, query):
+        from usergroups import search
+        queryset = search.search(Group.objects.all(), query)
+        return [group.pk for group in queryset]
+
+    def test_tokenize(self):
+        from usergroups.search import tokenize
+        self.assertEqual(tokenize(u'Climbers, climbers & the A-Team!'),
+                         [u'climbers', u'the', u'team'])
+
+    def test_prefix_and_relevance(self):
+        self.assertEqual(self.search('climb'),
+                         [self.climbers.pk, self.hikers.pk])
+        self.assertEqual(self.search('CLIMB swe'), [self.climbers.pk])
+        self.assertEqual(self.search('mountain climbing'), [self.hikers.pk])
+        self.assertEqual(self.search('golf'), [])
+        self.assertEqual(self.search('a !'), [])
+
+    def test_index_follows_changes(self):
+        self.chess.name = 'Chess climbers'
+        self.chess.save()
+        self.assertEqual(self.search('climbers'),
+                         [self.climbers.pk, self.chess.pk])
+        self.climbers.delete()
+        self.assertEqual(self.search('climbers'), [self.chess.pk])
+
+    def test_rebuild(self):
+        from django.core.management import call_command
+        from usergroups.models import GroupSearchToken
+        GroupSearchToken.objects.all().delete()
+        GroupSearchToken.objects.create(group=self.chess, token='stale',
+                                        weight=1)
+        call_command('rebuild_usergroup_search_index', 'test', verbosity=0)
+        self.assertEqual(self.search('stale'), [])
+        self.assertEqual(self.search('climb'),
+                         [self.climbers.pk, self.hikers.pk])
+
+    def test_view(self):
+        url = reverse('usergroups_search_groups', kwargs={ 'slug': 'test' })
+        response = self.client.get(url, { 'q': 'climb' })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([group.pk for group in
+                          response.context['group_list']],
+                         [self.climbers.pk, self.hikers.pk])
+        self.assertEqual(response.context['query'], 'climb')
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['group_list']), [])
+
+
+class MyGroupsTestCase(TestCase):
+    def setUp(self):
+        import datetime
+        from example.groups.models import RoleGroup
+        from example.groups.models import RoleGroupMembership
+        self.admin = User.objects.create_user('admin', 'admin@example.com',
+                                              'admin')
+        self.user = User.objects.create_user('user', 'user@example.com',
+                                             'user')
+        day = lambda n: datetime.datetime(2010, 1, n)
+        self.groups = []
+        for (n, model) in ((4, RoleGroup), (3, Group), (2, RoleGroup),
+                           (1, Group)):
+            group = model.objects.create(creator=self.admin, created=day(n),
+                                         name='group %d' % n)
+            group.add_members([self.user])
+            self.groups.append(group)
+        RoleGroupMembership.objects.filter(user=self.user).update(
+            joined=day(2))
+        RoleGroupMembership.objects.filter(group=self.groups[0],
+                                           user=self.user).update(
+            joined=day(4))
+        self.client.login(username='user', password='user')
+
+    def keys(self, page):
+        return [(group.group_config.slug, group.pk) for group in page]
+
+    def expected(self, groups):
+        return [(isinstance(group, Group) and 'test' or 'roles', group.pk)
+                for group in groups]
+
+    def test_groups_for_user(self):
+        groups_for_user = options.options.groups_for_user
+        first = groups_for_user(self.user, per_page=3)
+        self.assertEqual(self.keys(first), self.expected(self.groups[:3]))
+        self.assertFalse(first.has_previous())
+        second = groups_for_user(self.user, per_page=3,
+                                 cursor=first.next_cursor)
+        self.assertEqual(self.keys(second), self.expected(self.groups[3:]))
+        self.assertFalse(second.has_next())
+        previous = groups_for_user(self.user, per_page=3,
+                                   cursor=second.previous_cursor)
+        self.assertEqual(self.keys(previous), self.expected(self.groups[:3]))
+
+        self.assertEqual(list(groups_for_user(self.user, 'admins')), [])
+        self.assertEqual(len(groups_for_user(self.admin, 'admins')), 4)
+
+    def test_one_query_per_model(self):
+        self.assertEqual(count_queries(options.options.groups_for_user,
+                                       self.user), 2)
+
+    def test_view(self):
+        url = reverse('usergroups_my_groups')
+        response = self.client.get(url, { 'cursor': 'bogus' })
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(url)
+        self.assertEqual(self.keys(response.context['group_list']),
+                         self.expected(self.groups))
+        response = self.client.get(reverse('usergroups_my_admin_groups'))
+        self.assertEqual(list(response.context['group_list']), [])
+
+
+class MembershipMatrixTestCase(TestCase):
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'c@example.com',
+                                                'creator')
+        self.users = [User.objects.create_user('user%d' % i,
+                                               'u%d@example.com' % i)
+                      for i in range(3)]
+
+    def create_groups(self, model):
+        first = model.objects.create(creator=self.creator, name='first')
+        second = model.objects.create(creator=self.creator, name='second')
+        first.add_members(self.users[:2])
+        first.add_admins(self.users[1:2])
+        second.add_members(self.users[2:])
+        return [first, second]
+
+    def check(self, slug, model, queries):
+        conf = options.get(slug)
+        groups = self.create_groups(model)
+        users = [self.creator] + self.users
+        self.assertEqual(count_queries(conf.membership_matrix, users,
+                                       groups), queries)
+        matrix = conf.membership_matrix(users, groups)
+        self.assertEqual([[matrix.role(user, group) for user in users]
+                          for group in groups],
+                         [['owner', 'member', 'admin', None],
+                          ['owner', None, None, 'member']])
+        self.assertFalse(matrix.get(self.users[0].pk, groups[1]).is_member)
+        return matrix, groups
+
+    def test_m2m(self):
+        self.check('test', Group, 2)
+
+    def test_role_table(self):
+        from example.groups.models import RoleGroup
+        self.check('roles', RoleGroup, 1)
+
+    def test_template_tag(self):
+        from django.template import Context
+        from django.template import Template
+        matrix, groups = self.check('test', Group, 2)
+        template = Template('{% load usergroups_tags %}'
+                            '{% for user in users %}'
+                            '{% group_role matrix user group as role %}'
+                            '{{ role|default:"-" }} {% endfor %}')
+        output = template.render(Context({ 'matrix': matrix,
+                                           'users': self.users,
+                                           'group': groups[0] }))
+        self.assertEqual(output, 'member admin - ')
@@ -6,11 +6,13 @@ admin.autodiscover()
 from usergroups import options
 
 from example.groups.models import Group
+from example.groups.models import RoleGroup
 
 class GroupConfig(options.BaseUserGroupConfiguration):
     pass
 
 options.register('test', Group, GroupConfig)
+options.register('roles', RoleGroup)
 
 urlpatterns = patterns('',
     (r'^', include('usergroups.urls')),
@@ -6,5 +6,8 @@ from distutils.core import setup
 setup(name='usergroups', version='0.2',
       description='Simple reusable Django group app',
       author='Gustaf Sjöberg', author_email='gs@distrop.com',
-      packages=['usergroups'],
+      packages=['usergroups', 'usergroups.management',
+                'usergroups.management.commands', 'usergroups.templatetags'],
+      package_data={'usergroups': ['sql/*.sql']},
+      requires=['django (>=1.2)'],
       zip_safe=False)
@@ -1,5 +1,21 @@
 from django.contrib import admin
 
+from usergroups.models import EmailInvitation
 from usergroups.models import UserGroupApplication
 
-admin.site.register(UserGroupApplication)
+class GroupRelationAdmin(admin.ModelAdmin):
+    def queryset(self, request):
+        qs = super(GroupRelationAdmin, self).queryset(request)
+        return qs.with_groups()
+
+
+class UserGroupApplicationAdmin(GroupRelationAdmin):
+    list_display = ('__unicode__', 'created')
+
+
+class EmailInvitationAdmin(GroupRelationAdmin):
+    list_display = ('email', 'group', 'user', 'created')
+
+
+admin.site.register(UserGroupApplication, UserGroupApplicationAdmin)
+admin.site.register(EmailInvitation, EmailInvitationAdmin)
@@ -0,0 +1,87 @@
+"""Helpers for set-based writes that the ORM does not offer (multi-row
+inserts and deletes), used by the bulk membership API and management
+commands.
+
+Like the ORM's own writes, every helper commits its statements when it is
+called outside transaction management, and otherwise marks the current
+transaction as dirty. Callers that need several writes to be atomic manage
+the transaction themselves.
+
+"""
+from django.db import connection
+from django.db import models
+from django.db import transaction
+
+# Rows per INSERT and values per ``IN`` clause. Kept well below SQLite's
+# limit of 999 bound parameters per statement.
+CHUNK_SIZE = 400
+
+def chunked(iterable, size=CHUNK_SIZE):
+    """Yield lists of at most `size` items from `iterable`."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def supports_multirow_insert():
+    """Return whether the database accepts ``INSERT ... VALUES (..), (..)``.
+    """
+    return not connection.settings_dict['ENGINE'].endswith('oracle')
+
+def insert_rows(table, columns, rows):
+    """Insert `rows` (sequences of values matching `columns`) into `table`
+    using multi-row ``INSERT`` statements.
+
+    """
+    qn = connection.ops.quote_name
+    placeholder = '(%s)' % ', '.join(['%s'] * len(columns))
+    sql = 'INSERT INTO %s (%s) VALUES ' % (qn(table),
+                                            ', '.join([qn(c) for c in columns]))
+    size = max(1, CHUNK_SIZE * 2 // len(columns))
+    cursor = connection.cursor()
+    for chunk in chunked(rows, size):
+        if supports_multirow_insert():
+            params = []
+            for row in chunk:
+                params.extend(row)
+            cursor.execute(sql + ', '.join([placeholder] * len(chunk)),
+                           params)
+        else:
+            cursor.executemany(sql + placeholder, chunk)
+    transaction.commit_unless_managed()
+
+def delete_rows(table, column, value, in_column, values):
+    """Delete rows in `table` where `column` equals `value` and `in_column`
+    is one of `values`. Return the number of deleted rows.
+
+    """
+    qn = connection.ops.quote_name
+    sql = 'DELETE FROM %s WHERE %s = %%s AND %s IN ' % (qn(table), qn(column),
+                                                       qn(in_column))
+    deleted = 0
+    cursor = connection.cursor()
+    for chunk in chunked(values):
+        cursor.execute(sql + '(%s)' % ', '.join(['%s'] * len(chunk)),
+                       [value] + chunk)
+        deleted += cursor.rowcount
+    transaction.commit_unless_managed()
+    return deleted
+
+def insert_objects(model, objects):
+    """Insert unsaved instances of `model` with multi-row ``INSERT``
+    statements. Automatic primary keys are left to the database and not set
+    on the instances, and no signals are sent.
+
+    """
+    fields = [f for f in model._meta.local_fields
+              if not isinstance(f, models.AutoField)]
+    rows = []
+    for obj in objects:
+        rows.append([f.get_db_prep_save(f.pre_save(obj, True),
+                                        connection=connection)
+                     for f in fields])
+    insert_rows(model._meta.db_table, [f.column for f in fields], rows)
@@ -0,0 +1,92 @@
+"""A cache of the groups each user belongs to, kept in the Django cache
+framework so that it is shared by all processes.
+
+For every user and group model the ids of the groups the user is a member
+and an admin of are stored under one key. Entries are deleted whenever the
+memberships of the user change (see ``memberships_changed``) or a group they
+belong to is deleted, and are otherwise kept for the given timeout.
+
+Entries are deleted when the memberships change, which is before the change
+is committed, so a concurrent request could cache the old memberships again
+until the timeout. Code that changes memberships in a transaction should
+therefore use ``commit_then_invalidate`` instead of
+``transaction.commit_on_success``; it deletes the entries once more after
+the commit. All membership changes made through ``usergroups`` do.
+
+Membership does not depend on the configuration, so configurations of the
+same model share entries. Bump ``VERSION`` when the format of the entries
+changes.
+
+"""
+from threading import local
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.functional import wraps
+
+VERSION = 1
+
+# Keys invalidated inside ``commit_then_invalidate``, per thread.
+_pending = local()
+
+def cache_key(model, user_id):
+    opts = model._meta
+    return 'usergroups:memberships:%s.%s:%d:%d' % (
+        opts.app_label, opts.object_name.lower(), VERSION, user_id)
+
+def get_memberships(model, user_id, timeout=None):
+    """Return a ``(member_of, admin_of)`` tuple of the sets of ids of the
+    groups of `model` that the user with `user_id` belongs to.
+
+    """
+    key = cache_key(model, user_id)
+    memberships = cache.get(key)
+    if memberships is None:
+        memberships = []
+        for name in ('members', 'admins'):
+            relation = model.get_relation(name)
+            memberships.append(frozenset(relation.filter(**{
+                relation.user_field: user_id,
+            }).values_list(relation.group_field, flat=True)))
+        memberships = tuple(memberships)
+        if timeout is None:
+            cache.set(key, memberships)
+        else:
+            cache.set(key, memberships, timeout)
+    return memberships
+
+def invalidate_memberships(model, user_ids):
+    """Drop the cached memberships of `user_ids` in groups of `model`, now
+    and, inside ``commit_then_invalidate``, again after the commit.
+
+    """
+    keys = [cache_key(model, user_id) for user_id in user_ids]
+    if keys:
+        cache.delete_many(keys)
+        pending = getattr(_pending, 'keys', None)
+        if pending is not None:
+            pending.update(keys)
+
+def commit_then_invalidate(func):
+    """Like ``transaction.commit_on_success``, and delete the entries
+    invalidated while `func` ran again once it has committed.
+
+    In Django 1.2 ``commit_on_success`` commits even when nested, so the
+    entries are deleted after the changes of `func` are visible to other
+    connections.
+
+    """
+    func = transaction.commit_on_success(func)
+    def _inner(*args, **kwargs):
+        outermost = getattr(_pending, 'keys', None) is None
+        if outermost:
+            _pending.keys = set()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if outermost:
+                keys = _pending.keys
+                _pending.keys = None
+                if keys:
+                    cache.delete_many(list(keys))
+    return wraps(func)(_inner)
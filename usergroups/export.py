@@ -0,0 +1,84 @@
+"""Streaming export of the members of a group.
+
+Members are read in chunks ordered by user id, seeking past the last id of
+the previous chunk, so memory use doesn't depend on the size of the group.
+
+"""
+import csv
+from cStringIO import StringIO
+
+from django.utils import simplejson
+
+FIELDS = ('user_id', 'username', 'role', 'joined')
+
+def iter_members(group, chunk_size=1000):
+    """Yield a dict with the ``FIELDS`` of every member of `group`.
+
+    ``role`` is ``'admin'`` or ``'member'``. ``joined`` is the time the user
+    joined as an ISO 8601 string, or ``None`` when the membership table
+    doesn't record it.
+
+    """
+    members = group.get_relation('members')
+    admins = group.get_relation('admins')
+    user_field = members.user_field
+    queryset = members.filter(**{ members.group_field: group.pk })
+    queryset = queryset.order_by(user_field)
+    fields = [user_field, '%s__username' % user_field]
+    if members.joined_field is not None:
+        fields.append(members.joined_field)
+    queryset = queryset.values_list(*fields)
+
+    last_id = None
+    while True:
+        chunk = queryset
+        if last_id is not None:
+            chunk = chunk.filter(**{ '%s__gt' % user_field: last_id })
+        rows = list(chunk[:chunk_size].iterator())
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        admin_ids = set(admins.filter(**{
+            admins.group_field: group.pk,
+            '%s__gte' % admins.user_field: rows[0][0],
+            '%s__lte' % admins.user_field: last_id,
+        }).values_list(admins.user_field, flat=True).iterator())
+        for row in rows:
+            (user_id, username) = row[:2]
+            joined = len(row) > 2 and row[2].isoformat() or None
+            yield {
+                'user_id': user_id,
+                'username': username,
+                'role': user_id in admin_ids and 'admin' or 'member',
+                'joined': joined,
+            }
+        if len(rows) < chunk_size:
+            break
+
+def ndjson_lines(members):
+    """Yield one JSON object per line for each of `members`."""
+    for member in members:
+        yield simplejson.dumps(member) + '\n'
+
+def csv_lines(members):
+    """Yield a header line followed by one CSV line for each of
+    `members`.
+
+    """
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(FIELDS)
+    for member in members:
+        writer.writerow([unicode(member[field] or '').encode('utf-8')
+                         for field in FIELDS])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+# Maps the name of an export format to ``(line_generator, mimetype)``.
+FORMATS = {
+    'csv': (csv_lines, 'text/csv; charset=utf-8'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
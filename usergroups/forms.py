@@ -1,11 +1,20 @@
 from django import forms
-from django.template.loader import render_to_string
+from django.template import Context
+from django.template.loader import get_template
 from django.contrib.sites.models import Site
-from django.forms.fields import email_re
+from django.db import transaction
 from django.conf import settings
+from django.core.validators import email_re
 
+from usergroups import bulk
+from usergroups import outbox
+from usergroups import tokens
 from usergroups.models import EmailInvitation
 
+# Substituted for the secret key when reversing the validation URL once per
+# batch of invitations.
+KEY_PLACEHOLDER = 'KEY_PLACEHOLDER'
+
 class EmailInvitationForm(forms.Form):
     """Simple form to clean multiple e-mail addresses."""
     emails = forms.CharField(widget=forms.Textarea(), required=False)
@@ -37,32 +46,77 @@ class EmailInvitationForm(forms.Form):
                                             u"were not valid.")
         return emails
     
-    def send_invitations(self, slug):
-        # TODO: Move to manager
+    @transaction.commit_on_success
+    def create_invitations(self, signed=False):
+        """Create an ``EmailInvitation`` for every (unique) e-mail address
+        with a single multi-row insert and return the invitations.
+
+        If `signed` is true nothing is stored; the invitations are returned
+        unsaved with a signed token (see ``usergroups.tokens``) as their
+        secret key.
+
+        """
+        invitations = []
+        seen = set()
+        for email in self.cleaned_data['emails']:
+            if email.lower() in seen:
+                continue
+            seen.add(email.lower())
+            invitation = EmailInvitation(user=self.user, group=self.group,
+                                         email=email)
+            if signed:
+                invitation.secret_key = tokens.make_token(self.group, email)
+            else:
+                invitation.secret_key = invitation.generate_secret_key()
+            invitations.append(invitation)
+        if not signed:
+            bulk.insert_objects(EmailInvitation, invitations)
+        return invitations
+
+    def build_messages(self, slug, invitations):
+        """Return a ``send_mass_mail()`` datatuple with an e-mail for every
+        invitation in `invitations`. The templates are loaded once.
+
+        """
+        # TODO: Move templates to config class.
         from django.core.urlresolvers import reverse
-        if "mailer" in settings.INSTALLED_APPS:
-            from mailer import send_mail
-        else:
-            from django.core.mail import send_mail
         current_site = Site.objects.get_current()
-        
-        for email in self.cleaned_data['emails']:
-            invitation = EmailInvitation.objects.create(user=self.user,
-                                                        group=self.group,
-                                                        email=email)
-            # TODO: Move templates to config class.
-            url = reverse('usergroups_validate_email_invitation',
-                          args=(slug, self.group.pk, invitation.secret_key))
-            full_url = 'http://%s%s' % (current_site.domain, url)
-            subject = render_to_string('usergroups/invitation_subject.txt', {
-                'user': self.user,
-                'site': current_site
-            }).replace('\n', ' ')
-            message = render_to_string('usergroups/invitation_body.txt', {
+
+        url = reverse('usergroups_validate_email_invitation',
+                      args=(slug, self.group.pk, KEY_PLACEHOLDER))
+        url = 'http://%s%s' % (current_site.domain, url)
+        subject = get_template('usergroups/invitation_subject.txt').render(
+            Context({ 'user': self.user, 'site': current_site }))
+        subject = subject.replace('\n', ' ')
+        body_template = get_template('usergroups/invitation_body.txt')
+
+        datatuple = []
+        for invitation in invitations:
+            message = body_template.render(Context({
                 'activation_key': invitation.secret_key,
                 'user': self.user,
                 'site': current_site,
                 'group': self.group,
-                'url': full_url,
-            })
-            send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [email])
+                'url': url.replace(KEY_PLACEHOLDER, invitation.secret_key),
+            }))
+            datatuple.append((subject, message, settings.DEFAULT_FROM_EMAIL,
+                              [invitation.email]))
+        return datatuple
+
+    def send_invitations(self, slug, use_outbox=False, signed=False):
+        """Create invitations for all e-mail addresses and send them over a
+        single connection, or leave them in the outbox if `use_outbox` is
+        true. See ``create_invitations()`` for `signed`.
+
+        """
+        invitations = self.create_invitations(signed=signed)
+        datatuple = self.build_messages(slug, invitations)
+        if use_outbox:
+            outbox.enqueue_emails(datatuple)
+        elif "mailer" in settings.INSTALLED_APPS:
+            from mailer import send_mass_mail
+            send_mass_mail(datatuple)
+        else:
+            from django.core.mail import get_connection
+            from django.core.mail import send_mass_mail
+            send_mass_mail(datatuple, connection=get_connection())
@@ -0,0 +1,113 @@
+"""Bulk import of memberships, as used by ``import_usergroup_memberships``.
+
+Input rows have a ``group`` (the group id), a ``user`` (a username) or a
+``user_id``, and an optional ``role`` (``member``, the default, or
+``admin``; admins are made members as well). Rows are read lazily and
+imported in chunks: usernames and groups are resolved with one query per
+chunk, and only users that aren't related yet are inserted, so importing
+the same rows twice is harmless.
+
+"""
+import csv
+
+from django.contrib.auth.models import User
+from django.utils import simplejson
+
+from usergroups import bulk
+
+ROLES = {
+    'member': ('members', ),
+    'admin': ('members', 'admins'),
+}
+
+class InvalidRow(Exception):
+    pass
+
+
+def _decode(value):
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+    return value
+
+def parse_row(data):
+    """Return ``(group_id, user, role)`` from a dict read from the input,
+    where `user` is a username or an integer user id.
+
+    """
+    try:
+        group_id = int(data['group'])
+        if data.get('user_id') not in (None, ''):
+            user = int(data['user_id'])
+        else:
+            user = _decode(data['user'])
+    except (KeyError, TypeError, ValueError):
+        raise InvalidRow(data)
+    role = data.get('role') or 'member'
+    if role not in ROLES:
+        raise InvalidRow(data)
+    return (group_id, user, role)
+
+def read_csv(fileobj):
+    """Yield rows from CSV with a header line naming the columns."""
+    for data in csv.DictReader(fileobj):
+        yield data
+
+def read_ndjson(fileobj):
+    """Yield rows from newline-delimited JSON objects."""
+    for line in fileobj:
+        if line.strip():
+            try:
+                yield simplejson.loads(line)
+            except ValueError:
+                raise InvalidRow(line)
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+}
+
+def import_chunk(model, rows):
+    """Import `rows` of ``(group_id, user, role)`` into groups of `model`
+    and return ``(added, skipped)``: the number of relations created and
+    the number of rows whose group or user doesn't exist.
+
+    Should be called inside a transaction.
+
+    """
+    usernames = set([user for (_, user, _) in rows
+                     if not isinstance(user, (int, long))])
+    ids = {}
+    for chunk in bulk.chunked(usernames):
+        ids.update(User.objects.filter(username__in=chunk)
+                   .values_list('username', 'pk'))
+    user_pks = set([user for (_, user, _) in rows
+                    if isinstance(user, (int, long))])
+    existing = set()
+    for chunk in bulk.chunked(user_pks):
+        existing.update(User.objects.filter(pk__in=chunk)
+                        .values_list('pk', flat=True))
+
+    groups = {}
+    for chunk in bulk.chunked(set([row[0] for row in rows])):
+        groups.update(model._default_manager.in_bulk(chunk))
+
+    wanted = {}
+    skipped = 0
+    for (group_id, user, role) in rows:
+        if isinstance(user, (int, long)):
+            user_id = user in existing and user or None
+        else:
+            user_id = ids.get(user)
+        if user_id is None or group_id not in groups:
+            skipped += 1
+            continue
+        for name in ROLES[role]:
+            wanted.setdefault((group_id, name), set()).add(user_id)
+
+    added = 0
+    # Members are added before admins, so admins are always members.
+    for name in ('members', 'admins'):
+        for ((group_id, role), user_ids) in wanted.items():
+            if role == name:
+                added += len(groups[group_id]._add_users(name, user_ids))
+    return (added, skipped)
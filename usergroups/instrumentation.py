@@ -0,0 +1,210 @@
+"""Optional instrumentation of the views dispatched by
+``usergroups.views.dispatcher``.
+
+For every request the wall time, the number of queries and their total
+time, and the response status are recorded per ``(slug, view_name)`` and
+passed to the sinks listed (as dotted paths) in the
+``USERGROUPS_INSTRUMENTATION`` setting::
+
+    USERGROUPS_INSTRUMENTATION = (
+        'usergroups.instrumentation.LogSink',
+        'usergroups.instrumentation.StatsdSink',
+    )
+
+A sink is a class instantiated without arguments with an ``emit(record)``
+method. Queries are counted on the default database connection without
+requiring ``DEBUG``. Queries run while a streamed response is read, after
+the view has returned, are not counted.
+
+"""
+import logging
+import socket
+import time
+
+from django import http
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.utils.importlib import import_module
+
+logger = logging.getLogger('usergroups.instrumentation')
+
+class CountingCursor(object):
+    """Wrap a cursor, adding the number and duration of executed queries to
+    `counter`.
+
+    """
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def _timed(self, method, *args):
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            self.counter['queries'] += 1
+            self.counter['query_seconds'] += time.time() - start
+
+    def execute(self, sql, params=()):
+        return self._timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(self.cursor.executemany, sql, param_list)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+# Sinks
+
+class LogSink(object):
+    """Log a line per request to the ``usergroups.instrumentation``
+    logger.
+
+    """
+    def emit(self, record):
+        logger.info('%(slug)s.%(view)s status=%(status)d '
+                    'time=%(seconds).4f queries=%(queries)d '
+                    'query_time=%(query_seconds).4f' % record)
+
+
+class RingBufferSink(object):
+    """Keep the last ``USERGROUPS_INSTRUMENTATION_BUFFER_SIZE`` (1000)
+    records in the cache framework, to be read by the
+    ``show_usergroup_view_stats`` command.
+
+    Records are written to slots chosen by an atomically incremented
+    counter, so concurrent requests don't overwrite each other. The buffer
+    is only shared between processes if the cache backend is (e.g.
+    memcached).
+
+    """
+    key_prefix = 'usergroups:instrumentation'
+
+    def __init__(self):
+        self.size = getattr(settings, 'USERGROUPS_INSTRUMENTATION_BUFFER_SIZE',
+                            1000)
+
+    def emit(self, record):
+        counter_key = '%s:counter' % self.key_prefix
+        try:
+            position = cache.incr(counter_key)
+        except ValueError:
+            cache.add(counter_key, 0)
+            position = cache.incr(counter_key)
+        cache.set('%s:%d' % (self.key_prefix, position % self.size),
+                  dict(record, position=position))
+
+    def records(self):
+        """Return the buffered records, oldest first."""
+        keys = ['%s:%d' % (self.key_prefix, slot)
+                for slot in range(self.size)]
+        records = cache.get_many(keys).values()
+        records.sort(key=lambda record: record['position'])
+        return records
+
+    def clear(self):
+        cache.delete_many(['%s:%d' % (self.key_prefix, slot)
+                           for slot in range(self.size)])
+
+
+class StatsdSink(object):
+    """Send timings and a status counter per request to a statsd server at
+    ``USERGROUPS_STATSD_ADDRESS`` (``('127.0.0.1', 8125)``) over UDP, with
+    metric names prefixed by ``USERGROUPS_STATSD_PREFIX`` (``usergroups``).
+
+    """
+    def __init__(self):
+        self.address = getattr(settings, 'USERGROUPS_STATSD_ADDRESS',
+                               ('127.0.0.1', 8125))
+        self.prefix = getattr(settings, 'USERGROUPS_STATSD_PREFIX',
+                              'usergroups')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def emit(self, record):
+        name = '%s.%s.%s' % (self.prefix, record['slug'], record['view'])
+        metrics = [
+            '%s.time:%.3f|ms' % (name, record['seconds'] * 1000),
+            '%s.queries:%d|ms' % (name, record['queries']),
+            '%s.query_time:%.3f|ms' % (name, record['query_seconds'] * 1000),
+            '%s.status.%d:1|c' % (name, record['status']),
+        ]
+        try:
+            self.socket.sendto('\n'.join(metrics), self.address)
+        except socket.error:
+            pass
+
+
+_sinks = None
+
+def get_sinks():
+    """Return instances of the sinks in ``USERGROUPS_INSTRUMENTATION``,
+    created on first use.
+
+    """
+    global _sinks
+    if _sinks is None:
+        sinks = []
+        for path in getattr(settings, 'USERGROUPS_INSTRUMENTATION', ()):
+            (module, name) = path.rsplit('.', 1)
+            try:
+                sinks.append(getattr(import_module(module), name)())
+            except (ImportError, AttributeError), e:
+                raise ImproperlyConfigured("Error loading instrumentation "
+                                           "sink %s: %s" % (path, e))
+        _sinks = sinks
+    return _sinks
+
+def reset_sinks():
+    """Forget the sinks, so they are created again from the settings."""
+    global _sinks
+    _sinks = None
+
+def emit(record):
+    for sink in get_sinks():
+        try:
+            sink.emit(record)
+        except Exception:
+            logger.exception("Instrumentation sink %r failed." % sink)
+
+def instrument(slug, view_name, view, request, *args, **kwargs):
+    """Call `view` and pass a record of the call to the sinks.
+
+    Database connections are thread-local, so replacing
+    ``connection.cursor`` while the view runs only counts the queries of
+    this request.
+
+    """
+    counter = { 'queries': 0, 'query_seconds': 0.0 }
+    previous = connection.__dict__.get('cursor')
+    cursor = connection.cursor
+    connection.cursor = lambda: CountingCursor(cursor(), counter)
+    status = 500
+    start = time.time()
+    try:
+        response = view(request, *args, **kwargs)
+        status = response.status_code
+        return response
+    except http.Http404:
+        status = 404
+        raise
+    finally:
+        seconds = time.time() - start
+        if previous is None:
+            del connection.cursor
+        else:
+            connection.cursor = previous
+        emit({
+            'slug': slug,
+            'view': view_name,
+            'status': status,
+            'seconds': seconds,
+            'queries': counter['queries'],
+            'query_seconds': counter['query_seconds'],
+            'time': time.time(),
+        })
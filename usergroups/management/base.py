@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.utils.importlib import import_module
+
+from usergroups import options
+
+class ConfigurationCommand(BaseCommand):
+    """Base class for commands that operate on registered configurations.
+
+    Configurations are usually registered alongside the URLconf, so the root
+    URLconf is imported before they are looked up.
+
+    """
+    def get_configurations(self, slugs=None):
+        """Return the configurations registered as `slugs`, or all
+        registered configurations if no slugs are given.
+
+        """
+        import_module(settings.ROOT_URLCONF)
+        if not slugs:
+            return options.options.configurations.values()
+        configurations = []
+        for slug in slugs:
+            try:
+                configurations.append(options.get(slug))
+            except options.ConfigurationNotRegistered:
+                raise CommandError("No configuration registered as '%s'." %
+                                   slug)
+        return configurations
+
+    def get_configuration(self, slug):
+        return self.get_configurations([slug])[0]
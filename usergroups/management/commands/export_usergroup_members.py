@@ -0,0 +1,47 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import CommandError
+
+from usergroups import export
+from usergroups.management.base import ConfigurationCommand
+
+class Command(ConfigurationCommand):
+    help = "Write the members of a group as CSV or newline-delimited JSON."
+    args = '<slug> <group_id>'
+
+    option_list = ConfigurationCommand.option_list + (
+        make_option('--format', dest='format', default='csv',
+                    help='Either csv (the default) or ndjson.'),
+        make_option('--output', dest='output', default=None,
+                    help='File to write to instead of standard output.'),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=None, help='Number of members read per query.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Usage: export_usergroup_members %s" %
+                               self.args)
+        configuration = self.get_configuration(args[0])
+        model = configuration.model
+        try:
+            group = model._default_manager.get(pk=args[1])
+        except (model.DoesNotExist, ValueError):
+            raise CommandError("No group with id '%s'." % args[1])
+        try:
+            (lines, mimetype) = export.FORMATS[options['format']]
+        except KeyError:
+            raise CommandError("Unknown format '%s'." % options['format'])
+
+        chunk_size = options['chunk_size'] or configuration.export_chunk_size
+        if options['output']:
+            output = open(options['output'], 'wb')
+        else:
+            output = sys.stdout
+        try:
+            for line in lines(export.iter_members(group, chunk_size)):
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
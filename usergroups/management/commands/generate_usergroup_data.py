@@ -0,0 +1,72 @@
+import datetime
+import time
+from optparse import make_option
+
+from django.core.management.base import CommandError
+
+from usergroups import synthetic
+from usergroups.management.base import ConfigurationCommand
+
+class Command(ConfigurationCommand):
+    help = ("Generate synthetic users, groups, memberships, applications and "
+            "invitations for load testing. Group sizes are skewed: a few "
+            "groups are huge and most are small. The same options and seed "
+            "produce the same data.")
+    args = '<slug>'
+
+    option_list = ConfigurationCommand.option_list + (
+        make_option('--users', dest='users', type='int', default=10000,
+                    help='Number of users to create.'),
+        make_option('--groups', dest='groups', type='int', default=1000,
+                    help='Number of groups to create.'),
+        make_option('--max-members', dest='max_members', type='int',
+                    default=5000, help='Members of the largest group.'),
+        make_option('--skew', dest='skew', type='float', default=1.2,
+                    help='Exponent of the group size distribution; higher '
+                         'values make small groups more common.'),
+        make_option('--admins', dest='admins', type='int', default=3,
+                    help='Admins per group, including the creator.'),
+        make_option('--applications', dest='applications', type='float',
+                    default=0.01, help='Pending applications per member.'),
+        make_option('--invitations', dest='invitations', type='float',
+                    default=0.01, help='Invitations per member.'),
+        make_option('--invitation-age', dest='invitation_age', type='int',
+                    default=30, help='Invitations are created at random '
+                                     'times within this many days.'),
+        make_option('--seed', dest='seed', type='int', default=0,
+                    help='Seed of the random number generator.'),
+        make_option('--prefix', dest='prefix', default='synthetic',
+                    help='Prefix of generated usernames and group names. '
+                         'Must not be in use already.'),
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=100, help='Groups per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: generate_usergroup_data %s" %
+                               self.args)
+        model = self.get_configuration(args[0]).model
+        verbosity = int(options.get('verbosity', 1))
+        start = time.time()
+
+        def progress(totals):
+            if verbosity >= 2:
+                print "%(groups)d groups, %(members)d memberships" % totals
+
+        totals = synthetic.generate(
+            model, users=options['users'], groups=options['groups'],
+            max_members=options['max_members'], skew=options['skew'],
+            admins=options['admins'],
+            application_rate=options['applications'],
+            invitation_rate=options['invitations'],
+            invitation_age=datetime.timedelta(days=options['invitation_age']),
+            seed=options['seed'], prefix=options['prefix'],
+            batch_size=options['batch_size'], progress=progress)
+
+        if verbosity >= 1:
+            totals['seconds'] = time.time() - start
+            print ("Created %(users)d users, %(groups)d groups, %(members)d "
+                   "memberships, %(admins)d admins, %(applications)d "
+                   "applications and %(invitations)d invitations in "
+                   "%(seconds).1fs." % totals)
@@ -0,0 +1,109 @@
+import os
+import time
+from optparse import make_option
+
+from django.core.management.base import CommandError
+
+from usergroups import importer
+from usergroups.cache import commit_then_invalidate
+from usergroups.management.base import ConfigurationCommand
+
+class Command(ConfigurationCommand):
+    help = ("Import (group, user, role) rows from a CSV or newline-delimited "
+            "JSON file into groups of a configuration, in chunks of one "
+            "transaction each. See usergroups.importer for the format.")
+    args = '<slug> <file>'
+
+    option_list = ConfigurationCommand.option_list + (
+        make_option('--format', dest='format', default=None,
+                    help='Either csv or ndjson. Guessed from the file '
+                         'extension by default.'),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=1000, help='Number of rows per transaction.'),
+        make_option('--state', dest='state', default=None,
+                    help='File recording the number of rows imported, used '
+                         'to resume an interrupted import. Defaults to '
+                         '<file>.state.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Usage: import_usergroup_memberships %s" %
+                               self.args)
+        model = self.get_configuration(args[0]).model
+        path = args[1]
+        verbosity = int(options.get('verbosity', 1))
+        chunk_size = options['chunk_size']
+        format = options['format'] or os.path.splitext(path)[1].lstrip('.')
+        try:
+            reader = importer.READERS[format]
+        except KeyError:
+            raise CommandError("Unknown format '%s'." % format)
+        state = options['state'] or path + '.state'
+
+        done = self.read_state(state)
+        if done and verbosity >= 1:
+            print "Resuming after %d row(s)." % done
+
+        fileobj = open(path, 'rb')
+        start = time.time()
+        position = added = skipped = 0
+        chunk = []
+        try:
+            for data in reader(fileobj):
+                position += 1
+                if position <= done:
+                    continue
+                chunk.append(data)
+                if len(chunk) == chunk_size:
+                    (a, s) = self.import_chunk(model, chunk)
+                    self.write_state(state, position)
+                    added += a
+                    skipped += s
+                    chunk = []
+                    if verbosity >= 2:
+                        self.report(position - done, added, skipped, start)
+            if chunk:
+                (a, s) = self.import_chunk(model, chunk)
+                self.write_state(state, position)
+                added += a
+                skipped += s
+        except importer.InvalidRow, e:
+            raise CommandError("Invalid row %d: %r" % (position, e.args[0]))
+        finally:
+            fileobj.close()
+
+        if verbosity >= 1:
+            self.report(position - done, added, skipped, start)
+        if os.path.exists(state):
+            os.remove(state)
+
+    @commit_then_invalidate
+    def import_chunk(self, model, chunk):
+        """Import the rows in `chunk` and return ``(added, skipped)``."""
+        rows = [importer.parse_row(data) for data in chunk]
+        return importer.import_chunk(model, rows)
+
+    def read_state(self, state):
+        if not os.path.exists(state):
+            return 0
+        try:
+            return int(open(state).read())
+        except ValueError:
+            raise CommandError("Invalid state file '%s'." % state)
+
+    def write_state(self, state, position):
+        # Written after the chunk is committed. Should the command stop in
+        # between, the chunk is imported again on resume, which is harmless
+        # as only missing relations are added.
+        tmp = state + '.tmp'
+        f = open(tmp, 'w')
+        f.write(str(position))
+        f.close()
+        os.rename(tmp, state)
+
+    def report(self, rows, added, skipped, start):
+        elapsed = max(time.time() - start, 0.001)
+        print ("%d row(s) in %.1fs (%.0f rows/s): %d relation(s) added, "
+               "%d row(s) skipped." % (rows, elapsed, rows / elapsed, added,
+                                       skipped))
@@ -0,0 +1,127 @@
+from optparse import make_option
+
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db import transaction
+from django.db.models import Max
+from django.db.models import Min
+
+from usergroups.management.base import ConfigurationCommand
+from usergroups.models import BaseRoleUserGroup
+
+class Command(ConfigurationCommand):
+    help = ("Copy memberships from the members and admins tables of a model "
+            "that extended BaseUserGroup into the membership table of the "
+            "BaseRoleUserGroup it was changed to. Groups are copied in "
+            "primary key ranges, one transaction each, and rows that were "
+            "already copied are skipped, so the command can be run again. "
+            "Run rebuild_usergroup_counters afterwards if the model keeps "
+            "counters.")
+    args = '<slug>'
+
+    option_list = ConfigurationCommand.option_list + (
+        make_option('--members-table', dest='members_table', default=None,
+                    help='Defaults to <group table>_members.'),
+        make_option('--admins-table', dest='admins_table', default=None,
+                    help='Defaults to <group table>_admins.'),
+        make_option('--group-column', dest='group_column', default=None,
+                    help='Column referring to the group in both tables. '
+                         'Defaults to <model name>_id.'),
+        make_option('--user-column', dest='user_column', default='user_id',
+                    help='Column referring to the user in both tables.'),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=1000, help='Size of the group primary key range '
+                                       'copied per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: migrate_usergroup_memberships %s" %
+                               self.args)
+        model = self.get_configuration(args[0]).model
+        if not issubclass(model, BaseRoleUserGroup):
+            raise CommandError("%s doesn't extend BaseRoleUserGroup." %
+                               model.__name__)
+        verbosity = int(options.get('verbosity', 1))
+        opts = model._meta
+        names = {
+            'members': options['members_table'] or opts.db_table + '_members',
+            'admins': options['admins_table'] or opts.db_table + '_admins',
+            'source_group': options['group_column'] or
+                            '%s_id' % opts.object_name.lower(),
+            'source_user': options['user_column'],
+        }
+
+        bounds = model._default_manager.aggregate(low=Min('pk'),
+                                                  high=Max('pk'))
+        if bounds['low'] is None:
+            return
+        copied = 0
+        low = bounds['low']
+        while low <= bounds['high']:
+            high = low + options['chunk_size']
+            copied += self.copy_range(model, names, low, high)
+            low = high
+        if verbosity >= 1:
+            print "%s: copied %d membership(s)." % (opts.object_name, copied)
+
+    @transaction.commit_on_success
+    def copy_range(self, model, names, low, high):
+        """Copy the memberships of groups with primary keys in
+        ``[low, high)`` and return the number of rows inserted.
+
+        """
+        qn = connection.ops.quote_name
+        relation = model.get_relation('members')
+        through = relation.through
+        opts = model._meta
+        sql_names = {
+            'table': qn(relation.table),
+            'group': qn(relation.group_column),
+            'user': qn(relation.user_column),
+            'role': qn(relation.role_column),
+            'joined': qn(relation.joined_column),
+            'members': qn(names['members']),
+            'admins': qn(names['admins']),
+            'source_group': qn(names['source_group']),
+            'source_user': qn(names['source_user']),
+            'group_table': qn(opts.db_table),
+            'pk': qn(opts.pk.column),
+            'created': qn(opts.get_field('created').column),
+            'admin': through.ROLE_ADMIN,
+            'member': through.ROLE_MEMBER,
+        }
+        is_admin = ('EXISTS (SELECT 1 FROM %(admins)s a WHERE '
+                    'a.%(source_group)s = s.%(source_group)s AND '
+                    'a.%(source_user)s = s.%(source_user)s)')
+        not_copied = ('NOT EXISTS (SELECT 1 FROM %(table)s m WHERE '
+                      'm.%(group)s = s.%(source_group)s AND '
+                      'm.%(user)s = s.%(source_user)s)')
+        cursor = connection.cursor()
+        inserted = 0
+
+        # Members, then admins that somehow weren't members. The old tables
+        # don't record when users joined, so the group's creation time is
+        # used instead.
+        for (source, role) in (('members', 'CASE WHEN ' + is_admin +
+                                ' THEN %(admin)d ELSE %(member)d END'),
+                               ('admins', '%(admin)d')):
+            sql = ('INSERT INTO %(table)s (%(group)s, %(user)s, %(role)s, '
+                   '%(joined)s) SELECT s.%(source_group)s, '
+                   's.%(source_user)s, ' + role + ', g.%(created)s FROM '
+                   '%(' + source + ')s s INNER JOIN %(group_table)s g ON '
+                   'g.%(pk)s = s.%(source_group)s WHERE s.%(source_group)s '
+                   '>= %%s AND s.%(source_group)s < %%s AND ' + not_copied)
+            cursor.execute(sql % sql_names, [low, high])
+            inserted += cursor.rowcount
+
+        # Rows created since the switch (e.g. the creator's) keep their
+        # join date, but are promoted if they were admins.
+        sql = ('UPDATE %(table)s SET %(role)s = %(admin)d WHERE %(group)s >= '
+               '%%s AND %(group)s < %%s AND %(role)s = %(member)d AND '
+               'EXISTS (SELECT 1 FROM %(admins)s a WHERE a.%(source_group)s = '
+               '%(table)s.%(group)s AND a.%(source_user)s = '
+               '%(table)s.%(user)s)')
+        cursor.execute(sql % sql_names, [low, high])
+        transaction.set_dirty()
+        return inserted
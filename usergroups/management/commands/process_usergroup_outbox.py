@@ -0,0 +1,36 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from usergroups import outbox
+
+class Command(NoArgsCommand):
+    help = "Deliver pending e-mails and notices from the usergroups outbox."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=100, help='Number of messages claimed at once.'),
+        make_option('--max-attempts', dest='max_attempts', type='int',
+                    default=5, help='Give up on a message after this many '
+                                    'failed attempts.'),
+        make_option('--loop', dest='loop', action='store_true',
+                    default=False, help='Keep polling for new messages.'),
+        make_option('--sleep', dest='sleep', type='float', default=5.0,
+                    help='Seconds to wait when the outbox is empty.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        worker = outbox.worker_id()
+        while True:
+            messages = outbox.claim(worker, options['batch_size'])
+            if messages:
+                (sent, failed) = outbox.deliver(messages,
+                                                options['max_attempts'])
+                if verbosity >= 1:
+                    print "Sent %d message(s), %d failed." % (sent, failed)
+            elif options['loop']:
+                time.sleep(options['sleep'])
+            else:
+                break
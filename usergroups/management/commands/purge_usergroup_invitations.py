@@ -0,0 +1,100 @@
+import datetime
+import time
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db import transaction
+from django.db.models import Max
+from django.db.models import Min
+
+from usergroups.management.base import ConfigurationCommand
+from usergroups.models import EmailInvitation
+from usergroups.models import UsedInvitationToken
+
+class Command(ConfigurationCommand):
+    help = ("Delete e-mail invitations older than the longest invitation_ttl "
+            "of the configurations of their group model, in bounded primary "
+            "key ranges, and used signed tokens that have expired.")
+    args = '[slug slug ...]'
+
+    option_list = ConfigurationCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=1000, help='Size of the primary key range '
+                                       'deleted per transaction.'),
+        make_option('--sleep', dest='sleep', type='float', default=0,
+                    help='Seconds to pause between chunks.'),
+    )
+
+    def handle(self, *slugs, **options):
+        verbosity = int(options.get('verbosity', 1))
+        now = datetime.datetime.now()
+        bounds = EmailInvitation.objects.aggregate(low=Min('pk'),
+                                                   high=Max('pk'))
+
+        # Invitations only record the model of their group, so those of a
+        # model shared by several configurations are purged after the
+        # longest TTL of any of them, and kept if one has no TTL.
+        models = []
+        for configuration in self.get_configurations(slugs):
+            if configuration.model not in models:
+                models.append(configuration.model)
+        for model in models:
+            ttls = [c.invitation_ttl for c in self.get_configurations()
+                    if c.model is model]
+            if None in ttls or bounds['low'] is None:
+                continue
+            ctype = ContentType.objects.get_for_model(model)
+            cutoff = now - max(ttls)
+            deleted = 0
+            low = bounds['low']
+            while low <= bounds['high']:
+                high = low + options['chunk_size']
+                deleted += self.purge_range(ctype, cutoff, low, high)
+                low = high
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+            if verbosity >= 1:
+                print "%s: deleted %d expired invitation(s)." % \
+                    (model._meta.object_name, deleted)
+
+        # Used signed tokens only need to be remembered until the tokens
+        # expire, which depends on the longest TTL of any configuration.
+        ttls = [c.invitation_ttl for c in self.get_configurations()
+                if c.signed_invitations]
+        if ttls and None not in ttls:
+            cutoff = now - max(ttls)
+            deleted = 0
+            while True:
+                count = self.purge_tokens(cutoff, options['chunk_size'])
+                deleted += count
+                if count < options['chunk_size']:
+                    break
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+            if verbosity >= 1:
+                print "Deleted %d expired used token(s)." % deleted
+
+    @transaction.commit_on_success
+    def purge_tokens(self, cutoff, chunk_size):
+        """Delete up to `chunk_size` used tokens older than `cutoff`."""
+        signatures = list(UsedInvitationToken.objects.filter(used__lt=cutoff)
+                          .values_list('pk', flat=True)[:chunk_size])
+        UsedInvitationToken.objects.filter(pk__in=signatures).delete()
+        return len(signatures)
+
+    @transaction.commit_on_success
+    def purge_range(self, ctype, cutoff, low, high):
+        """Delete expired invitations with ``low <= pk < high``."""
+        qn = connection.ops.quote_name
+        opts = EmailInvitation._meta
+        cursor = connection.cursor()
+        cursor.execute(
+            'DELETE FROM %s WHERE %s >= %%s AND %s < %%s AND %s = %%s AND '
+            '%s < %%s' % (qn(opts.db_table), qn(opts.pk.column),
+                          qn(opts.pk.column),
+                          qn(opts.get_field('content_type').column),
+                          qn(opts.get_field('created').column)),
+            [low, high, ctype.pk, connection.ops.value_to_db_datetime(cutoff)])
+        transaction.set_dirty()
+        return cursor.rowcount
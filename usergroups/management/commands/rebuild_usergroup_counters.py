@@ -0,0 +1,79 @@
+from optparse import make_option
+
+from django.db import transaction
+from django.db.models import Count
+
+from usergroups.management.base import ConfigurationCommand
+from usergroups.models import COUNTER_FIELDS
+from usergroups.models import UserGroupCounters
+
+class Command(ConfigurationCommand):
+    help = ("Recompute the member and admin counters of groups, in chunks of "
+            "groups ordered by primary key.")
+    args = '[slug slug ...]'
+
+    option_list = ConfigurationCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=500, help='Number of groups per transaction.'),
+    )
+
+    def handle(self, *slugs, **options):
+        chunk_size = options['chunk_size']
+        verbosity = int(options.get('verbosity', 1))
+
+        models = []
+        for configuration in self.get_configurations(slugs):
+            model = configuration.model
+            if issubclass(model, UserGroupCounters) and model not in models:
+                models.append(model)
+
+        for model in models:
+            updated = 0
+            last_pk = None
+            while True:
+                (last_pk, count) = self.rebuild_chunk(model, last_pk,
+                                                      chunk_size)
+                updated += count
+                if last_pk is None:
+                    break
+            if verbosity >= 1:
+                print "%s: updated counters of %d groups." % \
+                    (model._meta.object_name, updated)
+
+    @transaction.commit_on_success
+    def rebuild_chunk(self, model, last_pk, chunk_size):
+        """Rebuild the counters of up to `chunk_size` groups following
+        `last_pk`. Return the last primary key processed (or ``None`` when
+        done) and the number of groups that were updated.
+
+        """
+        queryset = model._default_manager.order_by('pk')
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        fields = ['pk'] + [COUNTER_FIELDS[name] for name in
+                           ('members', 'admins')]
+        rows = list(queryset.values_list(*fields)[:chunk_size])
+        if not rows:
+            return (None, 0)
+        group_ids = [row[0] for row in rows]
+
+        actual = {}
+        for name in ('members', 'admins'):
+            relation = model.get_relation(name)
+            counts = relation.filter(**{
+                '%s__in' % relation.group_field: group_ids,
+            }).values(relation.group_field).annotate(n=Count('pk'))
+            actual[name] = dict([(row[relation.group_field], row['n'])
+                                 for row in counts])
+
+        updated = 0
+        for row in rows:
+            values = {}
+            for (i, name) in enumerate(('members', 'admins')):
+                count = actual[name].get(row[0], 0)
+                if row[i + 1] != count:
+                    values[COUNTER_FIELDS[name]] = count
+            if values:
+                model._default_manager.filter(pk=row[0]).update(**values)
+                updated += 1
+        return (group_ids[-1], updated)
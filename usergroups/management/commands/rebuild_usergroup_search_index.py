@@ -0,0 +1,73 @@
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db import transaction
+
+from usergroups import search
+from usergroups.management.base import ConfigurationCommand
+from usergroups.models import GroupSearchToken
+
+class Command(ConfigurationCommand):
+    help = ("Rebuild the search index of groups, in chunks of groups ordered "
+            "by primary key, and remove the entries of deleted groups.")
+    args = '[slug slug ...]'
+
+    option_list = ConfigurationCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=500, help='Number of groups per transaction.'),
+    )
+
+    def handle(self, *slugs, **options):
+        chunk_size = options['chunk_size']
+        verbosity = int(options.get('verbosity', 1))
+
+        models = []
+        for configuration in self.get_configurations(slugs):
+            if configuration.model not in models:
+                models.append(configuration.model)
+
+        for model in models:
+            indexed = 0
+            last_pk = None
+            while True:
+                (last_pk, count) = self.index_chunk(model, last_pk,
+                                                    chunk_size)
+                indexed += count
+                if last_pk is None:
+                    break
+            removed = self.remove_orphans(model)
+            if verbosity >= 1:
+                print "%s: indexed %d groups, removed %d stale entries." % \
+                    (model._meta.object_name, indexed, removed)
+
+    @transaction.commit_on_success
+    def index_chunk(self, model, last_pk, chunk_size):
+        """Index up to `chunk_size` groups following `last_pk`. Return the
+        last primary key processed (or ``None`` when done) and the number of
+        groups indexed.
+
+        """
+        queryset = model._default_manager.order_by('pk')
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        groups = list(queryset[:chunk_size])
+        if not groups:
+            return (None, 0)
+        search.index_groups(groups)
+        return (groups[-1].pk, len(groups))
+
+    @transaction.commit_on_success
+    def remove_orphans(self, model):
+        """Delete index entries of groups of `model` that no longer exist."""
+        qn = connection.ops.quote_name
+        opts = GroupSearchToken._meta
+        cursor = connection.cursor()
+        cursor.execute(
+            'DELETE FROM %s WHERE %s = %%s AND %s NOT IN (SELECT %s FROM %s)' %
+            (qn(opts.db_table), qn(opts.get_field('content_type').column),
+             qn(opts.get_field('object_id').column),
+             qn(model._meta.pk.column), qn(model._meta.db_table)),
+            [ContentType.objects.get_for_model(model).pk])
+        transaction.set_dirty()
+        return cursor.rowcount
@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from usergroups.instrumentation import RingBufferSink
+
+class Command(NoArgsCommand):
+    help = ("Summarize the view timings kept by the ring buffer "
+            "instrumentation sink, per configuration and view.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--clear', dest='clear', action='store_true',
+                    default=False, help='Empty the buffer afterwards.'),
+    )
+
+    def handle_noargs(self, **options):
+        sink = RingBufferSink()
+        stats = {}
+        for record in sink.records():
+            key = (record['slug'], record['view'])
+            stats.setdefault(key, []).append(record)
+
+        print '%-30s %6s %9s %9s %8s %9s %6s' % ('view', 'count', 'mean ms',
+                                                 'p95 ms', 'queries',
+                                                 'query ms', 'errors')
+        for (key, records) in sorted(stats.items()):
+            count = len(records)
+            times = sorted([r['seconds'] * 1000 for r in records])
+            print '%-30s %6d %9.1f %9.1f %8.1f %9.1f %6d' % (
+                '%s.%s' % key, count, sum(times) / count,
+                times[min(count - 1, int(count * 0.95))],
+                sum([r['queries'] for r in records]) / float(count),
+                sum([r['query_seconds'] for r in records]) * 1000 / count,
+                len([r for r in records if r['status'] >= 500]))
+
+        if options['clear']:
+            sink.clear()
@@ -1,16 +1,113 @@
+import datetime
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
 from django.db import models
+from django.db import transaction
+
+from usergroups.cache import commit_then_invalidate
+
+def attach_groups(objects, group=None):
+    """Resolve the ``group`` generic foreign key of `objects` (instances of
+    ``BaseGroupRelation`` subclasses) with one query per content type. If
+    `group` is given, it's used for the objects that relate to it.
+
+    """
+    from usergroups import bulk
+    wanted = {}
+    for obj in objects:
+        wanted.setdefault(obj.content_type_id, set()).add(obj.object_id)
+
+    groups = {}
+    if group is not None:
+        ctype = ContentType.objects.get_for_model(group)
+        groups[(ctype.pk, group.pk)] = group
+        wanted.get(ctype.pk, set()).discard(group.pk)
+    for (ctype_id, object_ids) in wanted.items():
+        model = ContentType.objects.get_for_id(ctype_id).model_class()
+        for chunk in bulk.chunked(object_ids):
+            for (pk, obj) in model._default_manager.in_bulk(chunk).items():
+                groups[(ctype_id, pk)] = obj
+
+    for obj in objects:
+        cache_attr = obj.__class__.group.cache_attr
+        setattr(obj, cache_attr, groups.get((obj.content_type_id,
+                                             obj.object_id)))
+
+
+class GroupRelationQuerySet(models.query.QuerySet):
+    def __init__(self, *args, **kwargs):
+        super(GroupRelationQuerySet, self).__init__(*args, **kwargs)
+        self._with_groups = False
+        self._known_group = None
+
+    def _clone(self, *args, **kwargs):
+        clone = super(GroupRelationQuerySet, self)._clone(*args, **kwargs)
+        clone._with_groups = self._with_groups
+        clone._known_group = self._known_group
+        return clone
+
+    def with_groups(self, group=None):
+        """Return a ``QuerySet`` that loads ``user`` with a join and resolves
+        ``group`` for all fetched rows at once (see ``attach_groups()``)
+        instead of with two queries per row.
 
-class EmailInvitationManager(models.Manager):
-    def handle_invite(self, user, group, secret_key):
+        """
+        clone = self.select_related('user')
+        clone._with_groups = True
+        clone._known_group = group
+        return clone
+
+    def iterator(self):
+        if not self._with_groups:
+            for obj in super(GroupRelationQuerySet, self).iterator():
+                yield obj
+            return
+        objects = list(super(GroupRelationQuerySet, self).iterator())
+        attach_groups(objects, self._known_group)
+        for obj in objects:
+            yield obj
+
+
+class GroupRelationManager(models.Manager):
+    def get_query_set(self):
+        return GroupRelationQuerySet(self.model)
+
+    def with_groups(self, group=None):
+        return self.get_query_set().with_groups(group)
+
+
+class EmailInvitationManager(GroupRelationManager):
+    @commit_then_invalidate
+    def handle_invite(self, user, group, secret_key, max_age=None):
         """Validate invitation key and add user to the group specified in the
         invitation. Return boolean stating whether the invitation was valid
         and processed or not.
+
+        The invitation is claimed by deleting it, matching both the key and
+        the group, before the user is added. Both happen in one transaction,
+        so an invitation can only ever be used once.
+
+        If `max_age` (a ``timedelta``) is given, older invitations are
+        rejected.
         
         """
-        try:
-            invitation = self.get(secret_key=secret_key)
-            group.members.add(user)
-            invitation.delete()
-            return True
-        except self.model.DoesNotExist:
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        ctype = ContentType.objects.get_for_model(group)
+        sql = 'DELETE FROM %s WHERE %s = %%s AND %s = %%s AND %s = %%s' % (
+            qn(opts.db_table), qn(opts.get_field('secret_key').column),
+            qn(opts.get_field('content_type').column),
+            qn(opts.get_field('object_id').column))
+        params = [secret_key, ctype.pk, group.pk]
+        if max_age is not None:
+            sql += ' AND %s >= %%s' % qn(opts.get_field('created').column)
+            params.append(connection.ops.value_to_db_datetime(
+                datetime.datetime.now() - max_age))
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        transaction.set_dirty()
+        if cursor.rowcount != 1:
             return False
+        group._add_members([user])
+        return True
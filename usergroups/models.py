@@ -1,45 +1,188 @@
 import datetime
-import hashlib
 import random
 
 from django.contrib.auth.models import User
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
 from django.db import models
+from django.db.models import F
+from django.db.models import signals
 
+from usergroups import search
+from usergroups import succession as succession_module
+from usergroups.cache import commit_then_invalidate
+from usergroups.cache import invalidate_memberships
 from usergroups.managers import EmailInvitationManager
+from usergroups.managers import GroupRelationManager
+from usergroups.relations import M2MRelation
+from usergroups.relations import RoleRelation
+from usergroups.relations import get_relation
+from usergroups.signals import memberships_changed
 
-class BaseUserGroup(models.Model):
-    """An abstract base class for a group of people; an association."""
+_system_random = random.SystemRandom()
+
+def user_ids(users):
+    """Return a set of primary keys from an iterable of users or ids."""
+    return set([int(getattr(user, 'pk', user)) for user in users])
+
+
+class AbstractUserGroup(models.Model):
+    """The fields and logic shared by ``BaseUserGroup`` and
+    ``BaseRoleUserGroup``, which differ in how memberships are stored.
+    Extend one of those.
+
+    """
     name = models.CharField(max_length=130)
 
     info = models.TextField(blank=True)
     website = models.URLField(blank=True)
     
     creator = models.ForeignKey(User)
-    admins = models.ManyToManyField(User, related_name='admin_of_groups')
-    members = models.ManyToManyField(User, related_name='member_of_groups')
     
     created = models.DateTimeField(default=datetime.datetime.now)
+
+    # The ``usergroups.relations`` class describing the membership tables.
+    relation_class = None
     
-    def remove_admin(self, user):
+    @classmethod
+    def get_relation(cls, name):
+        """Return a description of the table holding `name` (``members`` or
+        ``admins``) for this model. See ``usergroups.relations``.
+
+        """
+        return get_relation(cls, name, cls.relation_class)
+
+    def _memberships_changed(self, name, action, ids):
+        memberships_changed.send(sender=self.__class__, instance=self,
+                                 group_id=self.pk, role=name, action=action,
+                                 user_ids=frozenset(ids))
+
+    def _add_users(self, name, users):
+        """Add `users` to relation `name` and return the ids of those that
+        weren't already related.
+
+        """
+        relation = self.get_relation(name)
+        ids = user_ids(users)
+        new_ids = ids - relation.user_ids(self.pk, ids)
+        if new_ids:
+            relation.add(self.pk, new_ids)
+            self._memberships_changed(name, 'add', new_ids)
+        return new_ids
+
+    def _remove_users(self, name, users, succession=None):
+        """Remove `users` from relation `name` and return the ids of those
+        that were related.
+
+        """
+        relation = self.get_relation(name)
+        if name == 'admins':
+            # Serialize removals of admins, so that concurrent removals
+            # can't make a removed admin creator. This also refreshes
+            # creator_id, which succession is decided from below.
+            succession_module.lock_group(self)
+        old_ids = relation.user_ids(self.pk, user_ids(users))
+        if old_ids:
+            relation.remove(self.pk, old_ids)
+            self._memberships_changed(name, 'remove', old_ids)
+            if name == 'admins' and self.creator_id in old_ids:
+                self._succeed_creator(succession)
+        return old_ids
+
+    def _succeed_creator(self, succession=None):
+        """Make the admin chosen by `succession` (see
+        ``usergroups.succession``) creator. A group can thus (if other logic
+        allows for it) have no admins, but it always has a creator.
+
+        """
+        succession = succession or succession_module.oldest_admin
+        creator_id = succession(self)
+        if creator_id is not None:
+            self.__class__._default_manager.filter(pk=self.pk).update(
+                creator=creator_id)
+            self.creator_id = creator_id
+            if hasattr(self, '_creator_cache'):
+                del self._creator_cache
+
+    # Bulk membership API. All methods accept an iterable of users or user
+    # ids, touch only the users whose membership actually changes, run in a
+    # single transaction and send one ``memberships_changed`` signal per
+    # relation. They return the set of ids that were changed. The
+    # underscored variants do the same within the caller's transaction, so
+    # several changes can be committed together.
+
+    @commit_then_invalidate
+    def add_members(self, users):
+        """Add `users` to the group."""
+        return self._add_members(users)
+
+    @commit_then_invalidate
+    def remove_members(self, users, succession=None):
+        """Remove `users` from the group, and from the admins if
+        applicable.
+
+        """
+        return self._remove_members(users, succession)
+
+    @commit_then_invalidate
+    def add_admins(self, users):
+        """Promote `users` to admins, making them members if they aren't
+        already.
+
+        """
+        return self._add_admins(users)
+
+    @commit_then_invalidate
+    def remove_admins(self, users, succession=None):
+        """Demote `users` to plain members. If the creator is demoted another
+        admin, chosen by the `succession` policy (the oldest admin by
+        default), is made creator.
+
+        """
+        return self._remove_admins(users, succession)
+
+    def _add_members(self, users):
+        return self._add_users('members', users)
+
+    def _remove_members(self, users, succession=None):
+        users = user_ids(users)
+        self._remove_users('admins', users, succession)
+        return self._remove_users('members', users)
+
+    def _add_admins(self, users):
+        users = user_ids(users)
+        self._add_users('members', users)
+        return self._add_users('admins', users)
+
+    def _remove_admins(self, users, succession=None):
+        return self._remove_users('admins', users, succession)
+
+    def remove_admin(self, user, succession=None):
         """Remove an admin from the group."""
-        self.admins.remove(user)
-        if user == self.creator and self.admins.count():
-            # Assign a random admin to the role of being the group's creator.
-            # A group can thus (if other logic allows for it) have no admins,
-            # but it always has a creator.
-            self.creator = self.admins.all().order_by('?')[0]
-            self.save()
+        self.remove_admins([user], succession)
+
+    def get_member_count(self):
+        return self.members.count()
+
+    def get_admin_count(self):
+        return self.admins.count()
     
     def save(self, *args, **kwargs):
         """Override to set add the creator as an admin and member."""
         created = self.pk is None
-        super(BaseUserGroup, self).save(*args, **kwargs)
+        super(AbstractUserGroup, self).save(*args, **kwargs)
         if created:
-            self.admins.add(self.creator)
-            self.members.add(self.creator)
+            self.add_admins([self.creator_id])
     
+    @commit_then_invalidate
+    def delete(self, *args, **kwargs):
+        """Override to drop the cached memberships of the users of the group
+        once the deletion has committed.
+
+        """
+        super(AbstractUserGroup, self).delete(*args, **kwargs)
+
     def __unicode__(self):
         return self.name
     
@@ -47,12 +190,215 @@ class BaseUserGroup(models.Model):
         abstract = True
 
 
+class BaseUserGroup(AbstractUserGroup):
+    """An abstract base class for a group of people; an association.
+    Members and admins are kept in two many-to-many relations; admins are
+    related through both.
+
+    """
+    admins = models.ManyToManyField(User, related_name='admin_of_groups')
+    members = models.ManyToManyField(User, related_name='member_of_groups')
+
+    relation_class = M2MRelation
+
+    class Meta:
+        abstract = True
+
+
+class RoleUsers(object):
+    """Stands in for the ``members`` and ``admins`` related managers of
+    ``BaseRoleUserGroup``, so that code written for ``BaseUserGroup`` keeps
+    working. Query methods return ``User`` querysets; ``add()``,
+    ``remove()`` and ``clear()`` use the bulk membership API.
+
+    """
+    def __init__(self, group, name):
+        self.group = group
+        self.name = name
+
+    def get_query_set(self):
+        relation = self.group.get_relation(self.name)
+        rows = relation.filter(**{ relation.group_field: self.group.pk })
+        return User.objects.filter(pk__in=rows.values(relation.user_field))
+
+    def __getattr__(self, name):
+        # Delegate all(), filter(), count() etc. to the queryset.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get_query_set(), name)
+
+    def add(self, *users):
+        if self.name == 'admins':
+            self.group.add_admins(users)
+        else:
+            self.group.add_members(users)
+
+    def remove(self, *users):
+        if self.name == 'admins':
+            self.group.remove_admins(users)
+        else:
+            self.group.remove_members(users)
+
+    def clear(self):
+        relation = self.group.get_relation(self.name)
+        self.remove(*relation.user_ids(self.group.pk))
+
+
+class RoleUsersDescriptor(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return RoleUsers(instance, self.name)
+
+
+class BaseRoleUserGroup(AbstractUserGroup):
+    """An abstract base class for a group that keeps memberships in a single
+    table with a role column, defined by extending ``BaseMembership``::
+
+        class MyGroup(BaseRoleUserGroup):
+            ...
+
+        class MyGroupMembership(BaseMembership):
+            group = models.ForeignKey(MyGroup)
+
+    Every user is written once, whether member or admin, and the status of
+    a user in a group is a single lookup on the ``(group, user)`` index.
+    ``members`` and ``admins`` behave much like the related managers of
+    ``BaseUserGroup`` (see ``RoleUsers``).
+
+    """
+    members = RoleUsersDescriptor('members')
+    admins = RoleUsersDescriptor('admins')
+
+    relation_class = RoleRelation
+
+    @classmethod
+    def get_membership_model(cls):
+        """Return the ``BaseMembership`` subclass relating users to groups of
+        this model.
+
+        """
+        for related in cls._meta.get_all_related_objects():
+            if issubclass(related.model, BaseMembership) and \
+               related.field.name == 'group':
+                return related.model
+        raise ImproperlyConfigured("No membership model has a 'group' "
+                                   "foreign key to %s." % cls.__name__)
+
+    def _add_admins(self, users):
+        """Promote `users` to admins, adding those that aren't members with
+        the admin role right away.
+
+        """
+        ids = user_ids(users)
+        new_members = ids - self.get_relation('members').user_ids(self.pk,
+                                                                  ids)
+        new_admins = self._add_users('admins', ids)
+        if new_members:
+            self._memberships_changed('members', 'add', new_members)
+        return new_admins
+
+    def _remove_members(self, users, succession=None):
+        """Remove `users` from the group, deleting their rows whether they are
+        admins or not.
+
+        """
+        ids = user_ids(users)
+        # Refreshes creator_id; see _remove_users().
+        succession_module.lock_group(self)
+        old_admins = self.get_relation('admins').user_ids(self.pk, ids)
+        removed = self._remove_users('members', ids)
+        if old_admins:
+            self._memberships_changed('admins', 'remove', old_admins)
+            if self.creator_id in old_admins:
+                self._succeed_creator(succession)
+        return removed
+
+    class Meta:
+        abstract = True
+
+
+class BaseMembership(models.Model):
+    """An abstract base class for the membership table of a
+    ``BaseRoleUserGroup``. Subclasses add a ``group`` foreign key.
+
+    """
+    ROLE_MEMBER = 0
+    ROLE_ADMIN = 1
+    ROLE_CHOICES = (
+        (ROLE_MEMBER, 'Member'),
+        (ROLE_ADMIN, 'Admin'),
+    )
+
+    user = models.ForeignKey(User, related_name='%(app_label)s_%(class)s_set')
+    role = models.PositiveSmallIntegerField(choices=ROLE_CHOICES,
+                                            default=ROLE_MEMBER)
+    joined = models.DateTimeField(default=datetime.datetime.now)
+
+    def __unicode__(self):
+        return u'%s in %s' % (self.user, self.group)
+
+    class Meta:
+        abstract = True
+        unique_together = (('group', 'user'), )
+
+
+class UserGroupCounters(models.Model):
+    """An abstract mixin that keeps denormalized member and admin counts on
+    a group, so they can be read without counting the relation tables::
+
+        class MyGroup(UserGroupCounters, BaseUserGroup):
+            ...
+
+    The counters are updated atomically on every ``memberships_changed``
+    signal. The ``rebuild_usergroup_counters`` command recomputes them.
+
+    """
+    member_count = models.PositiveIntegerField(default=0, editable=False)
+    admin_count = models.PositiveIntegerField(default=0, editable=False)
+
+    def get_member_count(self):
+        return self.member_count
+
+    def get_admin_count(self):
+        return self.admin_count
+
+    def save(self, *args, **kwargs):
+        """Override to leave the counters of existing groups to the database:
+        they are written back as themselves, so increments committed by
+        someone else since the group was loaded are kept. The counters are
+        reloaded afterwards.
+
+        """
+        force_insert = kwargs.get('force_insert', args and args[0])
+        counts = self.__class__._default_manager.filter(pk=self.pk)
+        if self.pk is None or force_insert or not counts.exists():
+            return super(UserGroupCounters, self).save(*args, **kwargs)
+        self.member_count = F('member_count')
+        self.admin_count = F('admin_count')
+        try:
+            super(UserGroupCounters, self).save(*args, **kwargs)
+        finally:
+            for (member_count, admin_count) in \
+                counts.values_list('member_count', 'admin_count'):
+                self.member_count = member_count
+                self.admin_count = admin_count
+
+    class Meta:
+        abstract = True
+
+
 class BaseGroupRelation(models.Model):
     content_type = models.ForeignKey(ContentType)
     object_id = models.PositiveIntegerField()
 
     group = generic.GenericForeignKey()
 
+    objects = GroupRelationManager()
+
     class Meta:
         abstract = True
 
@@ -71,17 +417,200 @@ class EmailInvitation(BaseGroupRelation):
     """An invitation to join a user group."""
     user = models.ForeignKey(User)
     email = models.EmailField()
-    secret_key = models.CharField(max_length=30)
-    created = models.DateTimeField(default=datetime.datetime.now)
+    secret_key = models.CharField(max_length=30, unique=True)
+    created = models.DateTimeField(default=datetime.datetime.now,
+                                   db_index=True)
     
     objects = EmailInvitationManager()
     
     def generate_secret_key(self):
-        """Generate a secret key."""
-        salt = hashlib.sha1(str(random.random())).hexdigest()[:5]
-        return hashlib.sha1(salt + self.user.username).hexdigest()[:30]
+        """Generate a secret key of 120 random bits from the operating
+        system's source of randomness, so keys can't be guessed and don't
+        collide even when one user sends thousands of invitations.
+
+        """
+        return '%030x' % _system_random.getrandbits(120)
     
     def save(self, *args, **kwargs):
         if not self.secret_key:
             self.secret_key = self.generate_secret_key()
         super(EmailInvitation, self).save(*args, **kwargs)
+
+
+class GroupSearchToken(BaseGroupRelation):
+    """A token of the name or info of a group, used by
+    ``usergroups.search``.
+
+    """
+    token = models.CharField(max_length=30)
+    weight = models.PositiveIntegerField()
+
+    def __unicode__(self):
+        return self.token
+
+
+class UsedInvitationToken(models.Model):
+    """The signature of a signed invitation token that has been used. See
+    ``usergroups.tokens``.
+
+    """
+    signature = models.CharField(max_length=20, primary_key=True)
+    used = models.DateTimeField(default=datetime.datetime.now, db_index=True)
+
+    def __unicode__(self):
+        return self.signature
+
+
+class OutboxMessage(models.Model):
+    """An e-mail or notice waiting to be delivered by the
+    ``process_usergroup_outbox`` command. See ``usergroups.outbox``.
+
+    """
+    KIND_EMAIL = 'email'
+    KIND_NOTICE = 'notice'
+    KIND_CHOICES = (
+        (KIND_EMAIL, 'E-mail'),
+        (KIND_NOTICE, 'Notice'),
+    )
+
+    STATUS_PENDING = 0
+    STATUS_SENT = 1
+    STATUS_FAILED = 2
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    payload = models.TextField()
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES,
+                                              default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available = models.DateTimeField(default=datetime.datetime.now)
+    claimed_by = models.CharField(max_length=40, blank=True, db_index=True)
+    claimed = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(default=datetime.datetime.now)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return '%s #%s (%s)' % (self.get_kind_display(), self.pk,
+                                self.get_status_display())
+
+
+def relay_m2m_changed(sender, instance, action, reverse, model, pk_set,
+                      **kwargs):
+    """Translate ``m2m_changed`` for the ``members`` and ``admins`` relations
+    of user groups into ``memberships_changed``, so that changes made through
+    the related managers are seen by the same receivers as bulk changes.
+
+    """
+    group_model = getattr(sender._meta, 'auto_created', None)
+    if not group_model or not issubclass(group_model, BaseUserGroup):
+        return
+    for name in ('members', 'admins'):
+        relation = group_model.get_relation(name)
+        if relation.through is sender:
+            break
+    else:
+        return
+
+    # Django sends every given id on removal; look up which rows exist
+    # before they are deleted so that receivers get exact sets.
+    if action in ('pre_remove', 'pre_clear'):
+        if reverse:
+            queryset = relation.filter(**{ relation.user_field: instance.pk })
+            if pk_set is not None:
+                queryset = queryset.filter(**{
+                    '%s__in' % relation.group_field: list(pk_set),
+                })
+            pairs = [(group_id, instance.pk) for group_id in
+                     queryset.values_list(relation.group_field, flat=True)]
+        else:
+            pairs = [(instance.pk, user_id) for user_id in
+                     relation.user_ids(instance.pk, pk_set)]
+        if not hasattr(instance, '_usergroups_removed'):
+            instance._usergroups_removed = {}
+        instance._usergroups_removed[sender] = pairs
+        return
+    elif action == 'post_add':
+        if reverse:
+            pairs = [(group_id, instance.pk) for group_id in pk_set]
+        else:
+            pairs = [(instance.pk, user_id) for user_id in pk_set]
+        change = 'add'
+    elif action in ('post_remove', 'post_clear'):
+        pairs = getattr(instance, '_usergroups_removed', {}).pop(sender, [])
+        change = 'remove'
+    else:
+        return
+
+    changed = {}
+    for (group_id, user_id) in pairs:
+        changed.setdefault(group_id, set()).add(user_id)
+    for (group_id, ids) in changed.items():
+        memberships_changed.send(sender=group_model,
+                                 instance=not reverse and instance or None,
+                                 group_id=group_id, role=name, action=change,
+                                 user_ids=frozenset(ids))
+
+signals.m2m_changed.connect(relay_m2m_changed)
+
+COUNTER_FIELDS = {
+    'members': 'member_count',
+    'admins': 'admin_count',
+}
+
+def update_counters(sender, instance, group_id, role, action, user_ids,
+                    **kwargs):
+    """Keep the counters of ``UserGroupCounters`` groups up to date."""
+    if not issubclass(sender, UserGroupCounters):
+        return
+    field = COUNTER_FIELDS[role]
+    delta = action == 'add' and len(user_ids) or -len(user_ids)
+    sender._default_manager.filter(pk=group_id).update(**{
+        field: F(field) + delta,
+    })
+    if instance is not None:
+        setattr(instance, field, getattr(instance, field) + delta)
+
+memberships_changed.connect(update_counters)
+
+def invalidate_membership_cache(sender, group_id, user_ids, **kwargs):
+    """Drop the cached memberships of users whose memberships changed."""
+    invalidate_memberships(sender, user_ids)
+
+memberships_changed.connect(invalidate_membership_cache)
+
+def collect_group_users(sender, instance, **kwargs):
+    """Remember the users of a group that is about to be deleted. The
+    relation rows are deleted without ``m2m_changed`` being sent.
+
+    """
+    if not isinstance(instance, AbstractUserGroup):
+        return
+    ids = set()
+    for name in ('members', 'admins'):
+        ids |= sender.get_relation(name).user_ids(instance.pk)
+    instance._usergroups_deleted_users = ids
+
+def invalidate_deleted_group(sender, instance, **kwargs):
+    ids = getattr(instance, '_usergroups_deleted_users', None)
+    if ids:
+        invalidate_memberships(sender, ids)
+
+signals.pre_delete.connect(collect_group_users)
+signals.post_delete.connect(invalidate_deleted_group)
+
+def update_search_index(sender, instance, **kwargs):
+    """Reindex groups when they are saved."""
+    if isinstance(instance, AbstractUserGroup):
+        search.index_groups([instance])
+
+def remove_from_search_index(sender, instance, **kwargs):
+    if isinstance(instance, AbstractUserGroup):
+        search.unindex_groups(sender, [instance.pk])
+
+signals.post_save.connect(update_search_index)
+signals.post_delete.connect(remove_from_search_index)
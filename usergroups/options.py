@@ -1,6 +1,7 @@
 from django import http
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.utils.decorators import method_decorator
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.forms.models import modelform_factory
@@ -9,11 +10,32 @@ from django.utils import simplejson
 from django.views.generic import list_detail
 from django.views.generic.simple import direct_to_template
 from django.contrib.contenttypes.models import ContentType
-
+from django.db import connection
+from django.db import models
+from django.db.models import Q
+from django.utils.datastructures import SortedDict
+
+from usergroups import export
+from usergroups import outbox
+from usergroups import search
+from usergroups import succession
+from usergroups import tokens
+from usergroups.cache import commit_then_invalidate
+from usergroups.cache import get_memberships
 from usergroups.forms import EmailInvitationForm
-from usergroups.models import BaseUserGroup
+from usergroups.models import AbstractUserGroup
 from usergroups.models import EmailInvitation
 from usergroups.models import UserGroupApplication
+from usergroups.models import UserGroupCounters
+from usergroups.pagination import InvalidCursor
+from usergroups.pagination import KeysetPage
+from usergroups.pagination import KeysetPaginator
+from usergroups.pagination import decode_cursor
+from usergroups.pagination import encode_cursor
+from usergroups.permissions import MembershipMatrix
+from usergroups.permissions import PermissionResolver
+from usergroups.permissions import get_resolver
+from usergroups.relations import RoleRelation
 
 if "notification" in settings.INSTALLED_APPS and \
    hasattr(settings, 'USERGROUPS_SEND_NOTIFICATIONS') and \
@@ -22,6 +44,9 @@ if "notification" in settings.INSTALLED_APPS and \
 else:
     notification = None
 
+# Stands in for the arguments of a route while its URL template is built.
+URL_SENTINEL = '7310948265%d'
+
 class BaseUserGroupConfiguration(object):
     order_groups_by = '-created'
     paginate_groups_by = 25
@@ -29,8 +54,54 @@ class BaseUserGroupConfiguration(object):
     order_members_by = '-date_joined'
     paginate_members_by = 25
 
+    order_applications_by = '-created'
+    paginate_applications_by = 25
+    # Number of (newest) applications shown to admins in `group_detail`.
+    detail_applications_limit = 5
+
+    # Either 'offset' (numbered pages) or 'keyset' (opaque cursors passed in
+    # the `cursor_parameter` GET parameter; no total count is computed).
+    pagination = 'offset'
+    cursor_parameter = 'cursor'
+
+    # GET parameter holding the query of `search_groups`. Results are paged
+    # by `paginate_groups_by`, always with numbered pages since they are
+    # ordered by relevance.
+    search_parameter = 'q'
+
+    # Number of members read per query by `export_members`.
+    export_chunk_size = 1000
+
+    # Actions accepted by `batch_action`, and the most allowed per request.
+    batch_actions = ('approve_application', 'ignore_application',
+                     'remove_member', 'add_admin', 'revoke_admin')
+    max_batch_actions = 1000
+
+    # Keep the ids of the groups each user belongs to in the cache framework
+    # (see `usergroups.cache`) and check permissions against them instead of
+    # the database. `membership_cache_timeout` of None uses the cache
+    # backend's default.
+    cache_memberships = False
+    membership_cache_timeout = None
+
+    # Leave invitations and notices in the outbox, to be delivered by the
+    # `process_usergroup_outbox` command, instead of sending them during the
+    # request.
+    use_outbox = False
+
+    # A `datetime.timedelta` after which e-mail invitations expire, or None.
+    # Expired invitations are removed by `purge_usergroup_invitations`, after
+    # the longest TTL of the configurations registered for the same model.
+    invitation_ttl = None
+
+    # Send signed, timestamped tokens instead of storing an `EmailInvitation`
+    # for every invited address. Only used tokens are stored.
+    signed_invitations = False
+
     list_template_name = 'usergroups/group_list.html'
+    search_template_name = 'usergroups/group_search.html'
     detail_template_name = 'usergroups/group_detail.html'
+    application_inbox_template_name = 'usergroups/application_inbox.html'
     create_group_template_name = 'usergroups/group_form.html'
     edit_group_template_name = 'usergroups/group_form.html'
     create_email_invitation_template_name = \
@@ -68,29 +139,157 @@ class BaseUserGroupConfiguration(object):
         'application_failed': u"You are already a member of %(group_name)s.",
         'application_approved': u"Application approved.",
         'application_ignored': u"Application ignored.",
+        'batch_done': u"%(count)d action(s) performed.",
     }
 
     def __init__(self, slug, model):
-        # Make sure that we're extending BaseUserGroup. (This isn't strictly
-        # necessary, but it's easier than checking attribute availability and
-        # explaining).
-        if not issubclass(model, BaseUserGroup):
+        # Make sure that we're extending BaseUserGroup or BaseRoleUserGroup.
+        # (This isn't strictly necessary, but it's easier than checking
+        # attribute availability and explaining).
+        if not issubclass(model, AbstractUserGroup):
             raise ValueError(("The model used in usergroups must extend "
-                              "BaseUserGroup."))
+                              "BaseUserGroup or BaseRoleUserGroup."))
 
         self.slug = slug
         self.model = model
+        self._content_type = None
+        self._url_templates = None
+
+    def get_content_type(self):
+        """Return the ``ContentType`` of the group model. Looked up once."""
+        if self._content_type is None:
+            self._content_type = ContentType.objects.get_for_model(self.model)
+        return self._content_type
+    content_type = property(get_content_type)
+
+    def get_url_templates(self):
+        """Return a dict mapping the name of every route of a configuration
+        in ``usergroups.urls`` to a string template of its URL for this
+        configuration, with a ``%s`` for every argument following the slug.
+
+        The templates are built on first use rather than in ``__init__``, as
+        configurations are usually registered while the URLconf that includes
+        ``usergroups.urls`` is still being imported.
+
+        """
+        if self._url_templates is None:
+            from usergroups import urls
+            templates = {}
+            for pattern in urls.urlpatterns:
+                if 'slug' not in pattern.regex.groupindex:
+                    continue
+                sentinels = [URL_SENTINEL % i for i in
+                             range(len(pattern.regex.groupindex) - 1)]
+                url = reverse(pattern.name, args=[self.slug] + sentinels)
+                url = url.replace('%', '%%')
+                for sentinel in sentinels:
+                    url = url.replace(sentinel, '%s', 1)
+                templates[pattern.name] = url
+            self._url_templates = templates
+        return self._url_templates
+
+    def get_url(self, name, *args):
+        """Return the URL of the route `name` for this configuration, like
+        ``reverse(name, args=(self.slug, ) + args)`` but without walking the
+        URL resolver.
+
+        """
+        return self.get_url_templates()[name] % args
 
-    _is_admin = {}
     def is_admin(self, user, group):
         """Return a boolean that indicates whether `user` has administrative
         privileges in `group` or not.
+
+        Views should use ``get_permissions()``, which memoizes the result for
+        the rest of the request.
         
         """
-        if not self._is_admin.has_key(user.pk):
-            self._is_admin[user.pk] = user == group.creator or \
-                group.admins.filter(pk=user.pk)
-        return self._is_admin[user.pk]
+        resolver = PermissionResolver(user)
+        self.prime_from_cache(resolver, group)
+        return resolver.get(group).is_admin
+
+    def get_permissions(self, request, group):
+        """Return the ``GroupPermissions`` of the requesting user in `group`.
+        The status is resolved once per request and group.
+
+        """
+        resolver = get_resolver(request)
+        self.prime_from_cache(resolver, group)
+        return resolver.get(group)
+
+    def membership_matrix(self, users, groups):
+        """Return a ``MembershipMatrix`` of the status of each of `users`
+        (instances or ids) in each of `groups` (instances).
+
+        Runs one query per relation table: two for groups with separate
+        member and admin tables, one for groups with a role table (see
+        ``BaseRoleUserGroup``). Meant for pages showing dozens of users and
+        groups; the ids of both are passed as query parameters.
+
+        """
+        user_ids = list(set([getattr(user, 'pk', user) for user in users]))
+        groups = list(groups)
+        creators = dict([(group.pk, group.creator_id) for group in groups])
+        members = set()
+        admins = set()
+        if not user_ids or not groups:
+            return MembershipMatrix(creators, members, admins)
+
+        group_ids = creators.keys()
+        relation = self.model.get_relation('members')
+        if isinstance(relation, RoleRelation):
+            # Every row is a member; the role column tells admins apart.
+            rows = relation.filter(**{
+                '%s__in' % relation.user_field: user_ids,
+                '%s__in' % relation.group_field: group_ids,
+            }).values_list(relation.user_field, relation.group_field, 'role')
+            for (user_id, group_id, role) in rows:
+                members.add((user_id, group_id))
+                if role == relation.through.ROLE_ADMIN:
+                    admins.add((user_id, group_id))
+        else:
+            for (name, pairs) in (('members', members), ('admins', admins)):
+                relation = self.model.get_relation(name)
+                pairs.update(relation.filter(**{
+                    '%s__in' % relation.user_field: user_ids,
+                    '%s__in' % relation.group_field: group_ids,
+                }).values_list(relation.user_field, relation.group_field))
+        return MembershipMatrix(creators, members, admins)
+
+    def prime_from_cache(self, resolver, group):
+        """Prime `resolver` with the status of its user in `group` from the
+        membership cache, if ``cache_memberships`` is set.
+
+        """
+        if not self.cache_memberships or resolver.is_resolved(group) or \
+           not resolver.user.is_authenticated():
+            return
+        (member_of, admin_of) = get_memberships(self.model, resolver.user.pk,
+                                                self.membership_cache_timeout)
+        resolver.prime(group, group.pk in admin_of, group.pk in member_of)
+
+    def get_group(self, request, group_id):
+        """Return the group with primary key `group_id` or raise ``Http404``.
+
+        Unless ``cache_memberships`` is set, the requesting user's status in
+        the group is loaded by the same query and primed in the request's
+        permission resolver.
+
+        """
+        queryset = self.model._default_manager.all()
+        if request.user.is_authenticated() and not self.cache_memberships:
+            select, params = get_resolver(request).status_selects(self.model)
+            queryset = queryset.extra(select=select, select_params=params)
+        return get_object_or_404(queryset, pk=group_id)
+
+    def get_application_queryset(self, group):
+        """Return the pending applications to join `group`, with the
+        applicants loaded by the same query and ``group`` set up front.
+
+        """
+        ctype = self.content_type
+        return UserGroupApplication.objects.filter(
+            content_type=ctype, object_id=group.pk).with_groups(group)
 
     # Forms
 
@@ -104,60 +303,184 @@ class BaseUserGroupConfiguration(object):
     def get_email_invitation_form(self):
         return EmailInvitationForm
 
+    # Policies
+
+    def get_succession_policy(self):
+        """Return the policy choosing a new creator when the creator stops
+        being an admin. See ``usergroups.succession``.
+
+        """
+        return succession.oldest_admin
+
     # Views
 
+    def get_group_list_queryset(self, request):
+        """Return the groups listed by ``group_list()``, ordered according to
+        ``order_groups_by``.
+
+        Every group is annotated with ``num_members``, ``num_admins``,
+        ``viewer_is_member``, ``viewer_is_admin`` and ``num_applications``
+        (the number of pending applications, only counted for groups the
+        viewer administers), so that listing a page of groups costs a
+        constant number of queries.
+
+        """
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        # Anonymous users have an id of None, which matches no rows.
+        user_id = request.user.id
+        members = self.model.get_relation('members')
+        admins = self.model.get_relation('admins')
+
+        select = SortedDict()
+        if issubclass(self.model, UserGroupCounters):
+            select['num_members'] = '%s.%s' % (qn(opts.db_table),
+                                               qn('member_count'))
+            select['num_admins'] = '%s.%s' % (qn(opts.db_table),
+                                              qn('admin_count'))
+        else:
+            select['num_members'] = members.count_sql()
+            select['num_admins'] = admins.count_sql()
+        select['viewer_is_member'] = members.exists_sql()
+        select['viewer_is_admin'] = admins.exists_sql()
+
+        applications = UserGroupApplication._meta
+        select['num_applications'] = (
+            'CASE WHEN %(is_admin)s THEN (SELECT COUNT(*) FROM %(table)s '
+            'WHERE %(table)s.%(ctype)s = %%s AND %(table)s.%(object_id)s = '
+            '%(group_table)s.%(pk)s) ELSE 0 END' % {
+                'is_admin': admins.exists_sql(),
+                'table': qn(applications.db_table),
+                'ctype': qn(applications.get_field('content_type').column),
+                'object_id': qn(applications.get_field('object_id').column),
+                'group_table': qn(opts.db_table),
+                'pk': qn(opts.pk.column),
+            })
+        ctype = self.content_type
+        params = (user_id, user_id, user_id, ctype.pk)
+
+        queryset = self.model._default_manager.extra(select=select,
+                                                     select_params=params)
+        return queryset.order_by(self.order_groups_by)
+
     def group_list(self, request, queryset=None, extra_context=None):
         """Present the visitor with a paginated list of groups.
         
         A custom `QuerySet` can be supplied via the ``queryset`` argument.
+        Defaults to ``get_group_list_queryset()``.
 
         """
         if queryset is None:
-            queryset = self.model.objects.all().select_related()
-            queryset = queryset.order_by(self.order_groups_by)
+            queryset = self.get_group_list_queryset(request)
+
+        return self.paginate(request, queryset, self.order_groups_by,
+                             self.paginate_groups_by, self.list_template_name,
+                             'group', extra_context)
+
+    def search_groups(self, request, extra_context=None):
+        """Present the visitor with a paginated list of the groups whose name
+        or info matches the query in the ``search_parameter`` GET parameter
+        (see ``usergroups.search``), most relevant first.
 
-        return list_detail.object_list(request, queryset,
-                                       template_object_name='group',
-                                       extra_context=extra_context or {},
-                                       paginate_by=self.paginate_groups_by,
-                                       template_name=self.list_template_name)
+        Groups are annotated like in ``group_list()``, and additionally with
+        ``relevance``.
+
+        """
+        query = request.GET.get(self.search_parameter, '').strip()
+        queryset = search.search(self.get_group_list_queryset(request), query)
+        extra_context = extra_context or {}
+        extra_context.update({ 'query': query })
+        return self.paginate(request, queryset, None, self.paginate_groups_by,
+                             self.search_template_name, 'group',
+                             extra_context, pagination='offset')
 
     def group_detail(self, request, group_id, extra_context=None):
         """Present the user with a detailed view of a group and a paginated
         list of members.
         
         """
-        group = get_object_or_404(self.model, pk=group_id)
+        group = self.get_group(request, group_id)
 
         queryset = group.members.all().select_related()
         queryset = queryset.order_by(self.order_members_by)
 
         extra_context = extra_context or {}
-        is_admin = self.is_admin(request.user, group)
-        is_owner = request.user == group.creator
-        is_member = is_admin or group.members.filter(pk=request.user.pk)
+        perms = self.get_permissions(request, group)
 
         application_list = None
-        if is_admin:
-            ctype = ContentType.objects.get_for_model(self.model)
-            application_list = UserGroupApplication.objects.filter(
-                content_type=ctype, object_id=group.pk)
+        application_count = 0
+        if perms.is_admin:
+            applications = self.get_application_queryset(group)
+            application_count = applications.count()
+            if application_count:
+                applications = applications.order_by(
+                    self.order_applications_by)
+                application_list = \
+                    list(applications[:self.detail_applications_limit])
 
         extra_context.update({
             'group': group,
-            'is_admin': is_admin,
-            'is_owner': is_owner,
-            'is_member': is_member,
+            'is_admin': perms.is_admin,
+            'is_owner': perms.is_owner,
+            'is_member': perms.is_member,
             'application_list': application_list,
+            'application_count': application_count,
         })
 
-        return list_detail.object_list(request, queryset,
-                                       template_object_name='member',
-                                       extra_context=extra_context,
-                                       paginate_by=self.paginate_members_by,
-                                       template_name=self.detail_template_name)
+        return self.paginate(request, queryset, self.order_members_by,
+                             self.paginate_members_by,
+                             self.detail_template_name, 'member',
+                             extra_context)
+
+    @method_decorator(login_required)
+    def application_inbox(self, request, group_id, extra_context=None):
+        """Present a user with administrative privileges with the pending
+        applications to join group, newest first, paginated by cursor.
+
+        """
+        group = self.get_group(request, group_id)
+
+        if not self.get_permissions(request, group).is_admin:
+            return http.HttpResponseBadRequest()
+
+        extra_context = extra_context or {}
+        extra_context.update({ 'group': group })
+
+        return self.paginate(request, self.get_application_queryset(group),
+                             self.order_applications_by,
+                             self.paginate_applications_by,
+                             self.application_inbox_template_name,
+                             'application', extra_context, 'keyset')
+
+    @method_decorator(login_required)
+    def export_members(self, request, group_id, extra_context=None):
+        """Allow a user with administrative privileges to download the
+        members of a group.
+
+        The ``format`` GET parameter selects CSV (``csv``, the default) or
+        newline-delimited JSON (``ndjson``). The response is streamed while
+        the members are read in chunks; middleware that consumes the
+        content (e.g. ``GZipMiddleware``) defeats this.
+
+        """
+        group = self.get_group(request, group_id)
+
+        if not self.get_permissions(request, group).is_admin:
+            return http.HttpResponseBadRequest()
 
-    @login_required
+        try:
+            (lines, mimetype) = export.FORMATS[request.GET.get('format',
+                                                              'csv')]
+        except KeyError:
+            return http.HttpResponseBadRequest()
+
+        members = export.iter_members(group, self.export_chunk_size)
+        response = http.HttpResponse(lines(members), mimetype=mimetype)
+        response['Content-Disposition'] = 'attachment; filename=%s-%d.%s' % \
+            (self.slug, group.pk, request.GET.get('format', 'csv'))
+        return response
+
+    @method_decorator(login_required)
     def create_group(self, request, extra_context=None):
         """Allow user to create a group. The requesting user will be set as the
         `creator` (and added as an admin in the model-level logic).
@@ -171,8 +494,7 @@ class BaseUserGroupConfiguration(object):
 
         if form.is_valid():
             instance = form.save()
-            url = reverse('usergroups_group_detail',
-                          args=(self.slug, instance.pk))
+            url = self.get_url('usergroups_group_detail', instance.pk)
             return http.HttpResponseRedirect(url)
 
         extra_context = extra_context or {}
@@ -181,15 +503,15 @@ class BaseUserGroupConfiguration(object):
         return direct_to_template(request, extra_context=extra_context,
                                   template=self.create_group_template_name)
 
-    @login_required
+    @method_decorator(login_required)
     def edit_group(self, request, group_id, extra_context=None):
         """Allow user with administrative privileges to edit a existing
         group.
         
         """
-        instance = get_object_or_404(self.model, pk=group_id)
+        instance = self.get_group(request, group_id)
 
-        if not self.is_admin(request.user, instance):
+        if not self.get_permissions(request, instance).is_admin:
             return http.HttpResponseBadRequest()
 
         form_class = self.get_edit_group_form()
@@ -198,8 +520,7 @@ class BaseUserGroupConfiguration(object):
 
         if form.is_valid():
             instance = form.save()
-            url = reverse('usergroups_group_detail',
-                          args=(self.slug, instance.pk))
+            url = self.get_url('usergroups_group_detail', instance.pk)
             return http.HttpResponseRedirect(url)
 
         extra_context = extra_context or None
@@ -208,15 +529,15 @@ class BaseUserGroupConfiguration(object):
         return direct_to_template(request, extra_context=extra_context,
                                   template=self.edit_group_template_name)
 
-    @login_required
+    @method_decorator(login_required)
     def delete_group(self, request, group_id, extra_context=None):
         """Allow a user with administrative privileges to delete an existing
         group.
         
         """
-        group = get_object_or_404(self.model, pk=group_id)
+        group = self.get_group(request, group_id)
 
-        if not self.is_admin(request.user, group):
+        if not self.get_permissions(request, group).is_admin:
             return http.HttpResponseBadRequest()
 
         if request.method != 'POST':
@@ -225,12 +546,12 @@ class BaseUserGroupConfiguration(object):
         group_id = group.pk
         group.delete()
 
-        url = reverse('usergroups_delete_group_done', args=(self.slug, ))
+        url = self.get_url('usergroups_delete_group_done')
         return http.HttpResponseRedirect(url)
 
     # Leave group
 
-    @login_required
+    @method_decorator(login_required)
     def leave_group(self, request, group_id, extra_context=None):
         """Allow a user to leave a group. Also removes the user from the list
         of admins if applicable.
@@ -239,19 +560,20 @@ class BaseUserGroupConfiguration(object):
         ``is_ajax()``.
 
         """
-        group = get_object_or_404(self.model, pk=group_id)
+        group = self.get_group(request, group_id)
 
         if request.method != 'POST':
             return self.confirmation(request, 'leave_group', group)
 
         # TODO: We should have a "cannot leave group"-view for this situation.
-        if group.admins.count() <= 1 and request.user in group.admins.all():
-            url = reverse('usergroups_delete_group',
-                          args=(self.slug, group.pk))
+        if self.get_permissions(request, group).is_admin and \
+           group.get_admin_count() <= 1:
+            url = self.get_url('usergroups_delete_group', group.pk)
             return http.HttpResponseRedirect(url)
 
-        group.remove_admin(request.user)
-        group.members.remove(request.user)
+        group.remove_members([request.user],
+                             succession=self.get_succession_policy())
+        get_resolver(request).forget(group)
 
         extra_context = extra_context or {}
 
@@ -260,13 +582,12 @@ class BaseUserGroupConfiguration(object):
             return self.json_done(request, 'leave_group_done', data, group,
                                   extra_context)
 
-        url = reverse('usergroups_leave_group_done',
-                      args=(self.slug, group.pk))
+        url = self.get_url('usergroups_leave_group_done', group.pk)
         return http.HttpResponseRedirect(url)
 
     # Manage members
 
-    @login_required
+    @method_decorator(login_required)
     def remove_member(self, request, group_id, user_id, extra_context=None):
         """Allow a user with administrative privileges to remove a member from
         the group. Also removes the user from the list of admins if applicable.
@@ -276,13 +597,13 @@ class BaseUserGroupConfiguration(object):
 
         """
         member = get_object_or_404(User, pk=user_id)
-        group = get_object_or_404(self.model, pk=group_id)
+        group = self.get_group(request, group_id)
 
-        if not self.is_admin(request.user, group):
+        if not self.get_permissions(request, group).is_admin:
             return http.HttpResponseBadRequest()
 
         if member == request.user:
-            url = reverse('usergroups_leave_group', args=(self.slug, group.pk))
+            url = self.get_url('usergroups_leave_group', group.pk)
             return http.HttpResponseRedirect(url)
 
         extra_context = extra_context or {}
@@ -295,22 +616,23 @@ class BaseUserGroupConfiguration(object):
             return self.confirmation(request, 'remove_member', group,
                                      extra_context)
 
-        group.remove_admin(member)
-        group.members.remove(member)
+        group.remove_members([member],
+                             succession=self.get_succession_policy())
+        get_resolver(request).forget(group)
 
         if request.is_ajax():
             data = { 'user_id': member.id }
             return self.json_done(request, 'remove_member_done',
                                   data, group, extra_context)
 
-        url = reverse('usergroups_remove_member_done',
-                      args=(self.slug, group.pk, member.pk))
+        url = self.get_url('usergroups_remove_member_done', group.pk,
+                           member.pk)
         return http.HttpResponseRedirect(url)
 
     def remove_member_done(self, request, group_id, user_id,
                            extra_context=None):
         """Notify visitor that member has been removed from the group."""
-        group = get_object_or_404(self.model, pk=group_id)
+        group = self.get_group(request, group_id)
         member = get_object_or_404(User, pk=user_id)
 
         extra_context = extra_context or {}
@@ -323,16 +645,16 @@ class BaseUserGroupConfiguration(object):
 
     # Manage admins
 
-    @login_required
+    @method_decorator(login_required)
     def add_admin(self, request, group_id, user_id, extra_context=None):
         """Allow a user with administrative privileges to make another user
         admin of group.
 
         """
-        group = get_object_or_404(self.model, pk=group_id)
+        group = self.get_group(request, group_id)
         member = get_object_or_404(User, pk=user_id)
 
-        if not self.is_admin(request.user, group):
+        if not self.get_permissions(request, group).is_admin:
             return http.HttpResponseBadRequest()
 
         extra_context = extra_context or {}
@@ -345,21 +667,20 @@ class BaseUserGroupConfiguration(object):
             return self.confirmation(request, 'add_admin', group, 
                                      extra_context)
 
-        group.admins.add(member)
-        if member not in group.members.all():
-            group.members.add(member)
+        group.add_admins([member])
+        get_resolver(request).forget(group)
 
         if request.is_ajax():
             data = { 'user_id': member.id }
             return self.json_done(request, 'add_admin_done',
                                   data, group, extra_context)
 
-        url = reverse('usergroups_add_admin_done',
-                      args=(self.slug, group.pk, member.pk))
+        url = self.get_url('usergroups_add_admin_done', group.pk,
+                           member.pk)
         return http.HttpResponseRedirect(url)
 
     def add_admin_done(self, request, group_id, user_id, extra_context=None):
-        group = get_object_or_404(self.model, pk=group_id)
+        group = self.get_group(request, group_id)
         member = get_object_or_404(User, pk=user_id)
 
         extra_context = extra_context or None
@@ -371,7 +692,7 @@ class BaseUserGroupConfiguration(object):
         return self.done(request, 'add_admin_done', group=group,
                          extra_context=extra_context)
 
-    @login_required
+    @method_decorator(login_required)
     def revoke_admin(self, request, group_id, user_id, extra_context=None):
         """Allow a user with administrative privileges to remove a user from
         the list of admins in group.
@@ -380,10 +701,10 @@ class BaseUserGroupConfiguration(object):
         ``is_ajax()``.
 
         """
-        group = get_object_or_404(self.model, pk=group_id)
+        group = self.get_group(request, group_id)
         member = get_object_or_404(User, pk=user_id)
 
-        if not self.is_admin(request.user, group):
+        if not self.get_permissions(request, group).is_admin:
             return http.HttpResponseBadRequest()
 
         extra_context = extra_context or None
@@ -396,20 +717,21 @@ class BaseUserGroupConfiguration(object):
             return self.confirmation(request, 'revoke_admin', group, 
                                      extra_context)
 
-        group.remove_admin(member)
+        group.remove_admin(member, succession=self.get_succession_policy())
+        get_resolver(request).forget(group)
 
         if request.is_ajax():
             data = { 'user_id': member.id }
             return self.json_done(request, 'revoke_admin_done', data, group,
                                   extra_context)
 
-        url = reverse('usergroups_revoke_admin_done',
-                      args=(self.slug, group.pk, member.pk))
+        url = self.get_url('usergroups_revoke_admin_done', group.pk,
+                           member.pk)
         return http.HttpResponseRedirect(url)
 
     def revoke_admin_done(self, request, group_id, user_id,
                           extra_context=None):
-        group = get_object_or_404(self.model, pk=group_id)
+        group = self.get_group(request, group_id)
         member = get_object_or_404(User, pk=user_id)
 
         extra_context = extra_context or {}
@@ -423,24 +745,24 @@ class BaseUserGroupConfiguration(object):
 
     # Invitations
 
-    @login_required
+    @method_decorator(login_required)
     def create_email_invitation(self, request, group_id, extra_context=None):
         """Allow a user with administrative privileges to create and send an
         invitation to join group via e-mail.
         
         """
-        group = get_object_or_404(self.model, pk=group_id)
+        group = self.get_group(request, group_id)
 
-        if not self.is_admin(request.user, group):
+        if not self.get_permissions(request, group).is_admin:
             return http.HttpResponseBadRequest()
 
         form_class = self.get_email_invitation_form()
         form = form_class(user=request.user, group=group,
                           data=request.POST or None)
         if form.is_valid():
-            form.send_invitations(self.slug)
-            url = reverse('usergroups_email_invitation_done',
-                          args=(self.slug, group.pk))
+            form.send_invitations(self.slug, use_outbox=self.use_outbox,
+                                  signed=self.signed_invitations)
+            url = self.get_url('usergroups_email_invitation_done', group.pk)
             return http.HttpResponseRedirect(url)
 
         extra_context = extra_context or {}
@@ -453,24 +775,29 @@ class BaseUserGroupConfiguration(object):
         return direct_to_template(request, extra_context=extra_context,
                                   template=template_name)
 
-    @login_required
+    @method_decorator(login_required)
     def validate_email_invitation(self, request, group_id, key,
                                   extra_context=None):
         """Allow a user to Validate an ``EmailInvitation``."""
-        group = get_object_or_404(self.model, pk=group_id)
-
-        valid = EmailInvitation.objects.handle_invite(request.user,
-                                                      group, key)
+        group = self.get_group(request, group_id)
+
+        if tokens.is_token(key):
+            valid = tokens.redeem_token(request.user, group, key,
+                                        max_age=self.invitation_ttl)
+        else:
+            valid = EmailInvitation.objects.handle_invite(
+                request.user, group, key, max_age=self.invitation_ttl)
         if not valid:
             template_name = self.invalid_invitation_template_name
             return direct_to_template(request, template=template_name)
+        get_resolver(request).forget(group)
 
-        return http.HttpResponseRedirect(reverse('usergroups_group_joined',
-                                                 args=(self.slug, group.pk)))
+        url = self.get_url('usergroups_group_joined', group.pk)
+        return http.HttpResponseRedirect(url)
 
     # Applications
 
-    @login_required
+    @method_decorator(login_required)
     def apply_to_join_group(self, request, group_id, extra_context=None):
         """Allow a user to apply to join group.
 
@@ -478,28 +805,28 @@ class BaseUserGroupConfiguration(object):
         ``is_ajax()``.
 
         """
-        group = get_object_or_404(self.model, pk=group_id)
+        group = self.get_group(request, group_id)
 
         if request.method != 'POST':
             return self.confirmation(request, 'apply_to_join', group, 
                                      extra_context)
 
-        already_member = request.user in group.members.all()
+        already_member = self.get_permissions(request, group).is_member
 
         if not already_member:
-            ctype = ContentType.objects.get_for_model(self.model)
+            ctype = self.content_type
             (application, created) = \
                 UserGroupApplication.objects.get_or_create(user=request.user,
                                                            content_type=ctype,
                                                            object_id=group.pk)
 
-            if created and notification:
+            if created:
                 context = {
                     'application': application,
                     'group': group,
                 }
-                notification.send(group.admins.all(),
-                                  'usergroups_application', context)
+                self.send_notice(group.admins.all(),
+                                 'usergroups_application', context)
 
         extra_context = extra_context or {}
         extra_context.update({
@@ -513,10 +840,10 @@ class BaseUserGroupConfiguration(object):
             data = { 'already_member': already_member }
             return self.json_done(request, action, data, group, extra_context)
 
-        return http.HttpResponseRedirect(reverse('usergroups_%s' % action,
-                                                 args=(self.slug, group.pk)))
+        url = self.get_url('usergroups_%s' % action, group.pk)
+        return http.HttpResponseRedirect(url)
 
-    @login_required
+    @method_decorator(login_required)
     def approve_application(self, request, group_id, application_id,
                             extra_context=None):
         """Allow a user with administrative privileges to approve an
@@ -526,11 +853,11 @@ class BaseUserGroupConfiguration(object):
         ``is_ajax()``.
 
         """
-        group = get_object_or_404(self.model, pk=group_id)
+        group = self.get_group(request, group_id)
         application = get_object_or_404(UserGroupApplication, pk=application_id)
         applicant = application.user
 
-        if not self.is_admin(request.user, group):
+        if not self.get_permissions(request, group).is_admin:
             return http.HttpResponseBadRequest()
 
         extra_context = extra_context or {}
@@ -543,17 +870,17 @@ class BaseUserGroupConfiguration(object):
             return self.confirmation(request, 'approve_application', group, 
                                      extra_context)
 
-        group.members.add(application.user)
+        group.add_members([applicant])
+        get_resolver(request).forget(group)
         application_id = application.id
         application.delete()
 
-        if notification:
-            context = extra_context.copy()
-            context.update({
-                'group': group,
-            })
-            notification.send([applicant], 'usergroups_application_approved',
-                              context)
+        context = extra_context.copy()
+        context.update({
+            'group': group,
+        })
+        self.send_notice([applicant], 'usergroups_application_approved',
+                         context)
 
         if request.is_ajax():
             data = {
@@ -563,11 +890,10 @@ class BaseUserGroupConfiguration(object):
             return self.json_done(request, 'application_approved', data,
                                   extra_context)
 
-        url = reverse('usergroups_application_approved',
-                      args=(self.slug, group.pk))
+        url = self.get_url('usergroups_application_approved', group.pk)
         return http.HttpResponseRedirect(url)
 
-    @login_required
+    @method_decorator(login_required)
     def ignore_application(self, request, group_id, application_id,
                            extra_context=None):
         """Allow a user with administrative privileges to silently reject an
@@ -577,11 +903,11 @@ class BaseUserGroupConfiguration(object):
         ``is_ajax()``.
 
         """
-        group = get_object_or_404(self.model, pk=group_id)
+        group = self.get_group(request, group_id)
         application = get_object_or_404(UserGroupApplication, pk=application_id)
         applicant = application.user
 
-        if not self.is_admin(request.user, group):
+        if not self.get_permissions(request, group).is_admin:
             return http.HttpResponseBadRequest()
 
         extra_context = extra_context or {}
@@ -601,12 +927,172 @@ class BaseUserGroupConfiguration(object):
             return self.json_done(request, 'application_ignored', data,
                                   group, extra_context)
 
-        url = reverse('usergroups_application_ignored',
-                      args=(self.slug, group.pk))
+        url = self.get_url('usergroups_application_ignored', group.pk)
         return http.HttpResponseRedirect(url)
 
+    # Batch actions
+
+    @method_decorator(login_required)
+    def batch_action(self, request, group_id, extra_context=None):
+        """Allow a user with administrative privileges to perform many
+        actions in one request.
+
+        Accepts a POST with one ``actions`` value per action, formatted as
+        ``<action>:<id>`` (e.g. ``approve_application:12`` or
+        ``remove_member:3``), or a JSON body of the form ``{"actions":
+        [["approve_application", 12], ...]}``. See ``batch_actions`` for
+        the available actions. Application actions take application ids,
+        the others take user ids.
+
+        All actions are applied in a single transaction and a JSON
+        serialized dict is returned, listing the ids that were acted upon
+        per action.
+
+        """
+        if request.method != 'POST':
+            return http.HttpResponseNotAllowed(['POST'])
+
+        group = self.get_group(request, group_id)
+
+        if not self.get_permissions(request, group).is_admin:
+            return http.HttpResponseBadRequest()
+
+        try:
+            actions = self.parse_batch_actions(request)
+        except (ValueError, KeyError, TypeError):
+            return http.HttpResponseBadRequest()
+
+        (data, approved) = self.apply_batch_actions(request, group, actions)
+        get_resolver(request).forget(group)
+        # Only notify once the actions have been committed.
+        if approved:
+            self.send_notice(list(User.objects.filter(pk__in=approved)),
+                             'usergroups_application_approved',
+                             { 'group': group, 'group_config': self })
+
+        extra_context = extra_context or {}
+        extra_context.update({
+            'count': sum([len(ids) for ids in data.values()]),
+        })
+        return self.json_done(request, 'batch_done', data, group,
+                              extra_context)
+
+    def parse_batch_actions(self, request):
+        """Return a dict mapping each action in ``batch_actions`` to a set of
+        ids. Raise ``ValueError`` if the request is malformed.
+
+        """
+        if request.META.get('CONTENT_TYPE', '').startswith('application/json'):
+            pairs = simplejson.loads(request.raw_post_data)['actions']
+        else:
+            pairs = [value.split(':', 1)
+                     for value in request.POST.getlist('actions')]
+        if not pairs or len(pairs) > self.max_batch_actions:
+            raise ValueError
+        actions = dict([(action, set()) for action in self.batch_actions])
+        for (action, object_id) in pairs:
+            actions[action].add(int(object_id))
+        return actions
+
+    @commit_then_invalidate
+    def apply_batch_actions(self, request, group, actions):
+        """Apply `actions` as returned by ``parse_batch_actions()`` to
+        `group` with set-based queries, in a single transaction. Return a
+        dict mapping each action to a sorted list of the ids that were acted
+        upon, and the ids of the users whose applications were approved.
+
+        """
+        done = dict([(action, []) for action in actions])
+        approved = {}
+
+        application_ids = actions.get('approve_application', set()) | \
+                          actions.get('ignore_application', set())
+        if application_ids:
+            applications = self.get_application_queryset(group).filter(
+                pk__in=application_ids)
+            for (application_id, user_id) in \
+                applications.values_list('pk', 'user'):
+                if application_id in actions.get('approve_application', ()):
+                    approved[application_id] = user_id
+                    done['approve_application'].append(application_id)
+                else:
+                    done['ignore_application'].append(application_id)
+            if approved:
+                group._add_members(approved.values())
+            UserGroupApplication.objects.filter(
+                pk__in=done['approve_application'] +
+                       done['ignore_application']).delete()
+
+        user_ids = set()
+        for action in ('add_admin', 'revoke_admin', 'remove_member'):
+            user_ids |= actions.get(action, set())
+        if user_ids:
+            user_ids = set(User.objects.filter(pk__in=user_ids)
+                           .values_list('pk', flat=True))
+
+        if actions.get('add_admin'):
+            done['add_admin'] = list(group._add_admins(
+                actions['add_admin'] & user_ids))
+        if actions.get('revoke_admin'):
+            done['revoke_admin'] = list(group._remove_admins(
+                actions['revoke_admin'] & user_ids,
+                succession=self.get_succession_policy()))
+        if actions.get('remove_member'):
+            # Admins leave groups through `leave_group`.
+            ids = (actions['remove_member'] & user_ids) - \
+                  set([request.user.pk])
+            done['remove_member'] = list(group._remove_members(
+                ids, succession=self.get_succession_policy()))
+
+        for ids in done.values():
+            ids.sort()
+        return (done, approved.values())
+
     # Helpers
 
+    def send_notice(self, users, label, extra_context):
+        """Send a notice to `users` if the notification app is enabled,
+        through the outbox if ``use_outbox`` is set.
+
+        """
+        if notification is None:
+            return
+        if self.use_outbox:
+            outbox.enqueue_notice(users, label, extra_context)
+        else:
+            notification.send(users, label, extra_context)
+
+    def paginate(self, request, queryset, ordering, per_page, template_name,
+                 template_object_name, extra_context=None, pagination=None):
+        """Render `template_name` with a page of `queryset`, using the
+        pagination mode given by `pagination` (defaults to ``pagination``).
+
+        The context mirrors that of ``list_detail.object_list``; in keyset
+        mode ``page_obj`` provides ``next_cursor`` and ``previous_cursor``
+        instead of page numbers.
+
+        """
+        extra_context = extra_context or {}
+        if (pagination or self.pagination) != 'keyset':
+            return list_detail.object_list(
+                request, queryset, template_object_name=template_object_name,
+                extra_context=extra_context, paginate_by=per_page,
+                template_name=template_name)
+
+        paginator = KeysetPaginator(queryset, ordering, per_page)
+        try:
+            page = paginator.page(request.GET.get(self.cursor_parameter))
+        except InvalidCursor:
+            raise http.Http404
+        extra_context.update({
+            '%s_list' % template_object_name: page.object_list,
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': page.has_other_pages(),
+        })
+        return direct_to_template(request, extra_context=extra_context,
+                                  template=template_name)
+
     def render_helper(self, request, action, group, message, template_name,
                       extra_context=None):
         """Setup a context common for confirmation- and done views,
@@ -649,7 +1135,7 @@ class BaseUserGroupConfiguration(object):
         
         """
         if group is None and group_id is not None:
-            group = get_object_or_404(self.model, pk=group_id)
+            group = self.get_group(request, group_id)
         message = self.done_messages[action]
         return self.render_helper(request, action, group, message,
                                   self.done_template_name, extra_context)
@@ -699,6 +1185,96 @@ class GroupOptions(object):
         except KeyError:
             raise ConfigurationNotRegistered
 
+    def groups_for_user(self, user, role='members', per_page=25,
+                        cursor=None):
+        """Return a ``KeysetPage`` of the groups of every registered model in
+        which `user` holds `role` (``'members'`` or ``'admins'``), most
+        recently joined first, continuing from `cursor` if given. Raise
+        ``InvalidCursor`` if the cursor is malformed.
+
+        Groups are annotated with ``joined`` (the time the user joined, or
+        the time the group was created if the model doesn't record it) and
+        ``group_config``. Runs one query per model; a model registered more
+        than once is listed under its first slug in alphabetical order.
+
+        """
+        if cursor:
+            (direction, values) = decode_cursor(cursor)
+            if len(values) != 3:
+                raise InvalidCursor
+            values = self._cursor_values(values)
+        else:
+            (direction, values) = ('n', None)
+        backwards = direction == 'p'
+
+        object_list = []
+        seen = set()
+        for slug in sorted(self.configurations):
+            configuration = self.configurations[slug]
+            if configuration.model in seen:
+                continue
+            seen.add(configuration.model)
+            relation = configuration.model.get_relation(role)
+            date_field = relation.joined_field or \
+                '%s__created' % relation.group_field
+            prefix = not backwards and '-' or ''
+            rows = relation.filter(**{ relation.user_field: user.pk })
+            rows = rows.select_related(relation.group_field).order_by(
+                prefix + date_field, prefix + relation.group_field)
+            if values is not None:
+                rows = rows.filter(self._seek(relation, date_field, slug,
+                                              values, backwards))
+            for row in rows[:per_page + 1]:
+                group = getattr(row, relation.group_field)
+                if relation.joined_field is None:
+                    group.joined = group.created
+                else:
+                    group.joined = getattr(row, relation.joined_field)
+                group.group_config = configuration
+                object_list.append(group)
+
+        key = lambda group: (group.joined, group.group_config.slug, group.pk)
+        object_list.sort(key=key, reverse=not backwards)
+        has_more = len(object_list) > per_page
+        object_list = object_list[:per_page]
+        if backwards:
+            object_list.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        encode = lambda direction, group: encode_cursor(direction, [
+            unicode(group.joined), group.group_config.slug, group.pk])
+        next_cursor = previous_cursor = None
+        if object_list and has_next:
+            next_cursor = encode('n', object_list[-1])
+        if object_list and has_previous:
+            previous_cursor = encode('p', object_list[0])
+        return KeysetPage(object_list, self, next_cursor, previous_cursor)
+
+    def _cursor_values(self, values):
+        try:
+            return (models.DateTimeField().to_python(values[0]),
+                    unicode(values[1]), int(values[2]))
+        except Exception:
+            raise InvalidCursor
+
+    def _seek(self, relation, date_field, slug, values, reverse=False):
+        """Return a ``Q`` selecting the rows of `relation` that come after
+        `values` (or before them if `reverse`) in the order of
+        ``groups_for_user()``: by date, slug and group id, descending.
+
+        """
+        (joined, cursor_slug, group_id) = values
+        lookup = reverse and 'gt' or 'lt'
+        if slug == cursor_slug:
+            return Q(**{ '%s__%s' % (date_field, lookup): joined }) | \
+                   Q(**{ date_field: joined,
+                         '%s__%s' % (relation.group_field, lookup): group_id })
+        if (slug < cursor_slug) != reverse:
+            lookup += 'e'
+        return Q(**{ '%s__%s' % (date_field, lookup): joined })
+
 
 options = GroupOptions()
 
@@ -0,0 +1,209 @@
+"""A database-backed outbox for e-mails and notices.
+
+Views enqueue messages with ``enqueue_emails()`` and ``enqueue_notice()``
+instead of delivering them inside the request. The
+``process_usergroup_outbox`` command claims pending messages in batches,
+delivers them and retries failures with exponential backoff.
+
+Delivery is at-least-once: a claim is renewed before each message is
+sent, but a worker that stalls for longer than ``CLAIM_TIMEOUT`` on a
+single message (or crashes between sending and recording it) may have the
+message delivered again by another worker.
+
+"""
+import datetime
+import hashlib
+import os
+import random
+import socket
+import traceback
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+from django.utils import simplejson
+
+from usergroups import bulk
+from usergroups.models import OutboxMessage
+
+# Claims older than this are considered abandoned (e.g. by a worker that
+# crashed) and the messages are handed to another worker.
+CLAIM_TIMEOUT = datetime.timedelta(minutes=10)
+
+# Delay before the first retry; doubled on every following attempt.
+RETRY_DELAY = datetime.timedelta(minutes=1)
+
+def serialize(value):
+    """Return a JSON-serializable representation of `value`. Model
+    instances and configurations are stored as references.
+
+    """
+    from django.db.models import Model
+    from usergroups.options import BaseUserGroupConfiguration
+    if isinstance(value, Model):
+        ctype = ContentType.objects.get_for_model(value)
+        return { '__model__': [ctype.pk, value.pk] }
+    if isinstance(value, BaseUserGroupConfiguration):
+        return { '__configuration__': value.slug }
+    if isinstance(value, dict):
+        return dict([(k, serialize(v)) for (k, v) in value.items()])
+    if isinstance(value, (list, tuple)):
+        return [serialize(v) for v in value]
+    if value is None or isinstance(value, (bool, int, long, float,
+                                           basestring)):
+        return value
+    return unicode(value)
+
+def deserialize(value):
+    """Reverse ``serialize()``. References to objects that no longer exist
+    are replaced by ``None``.
+
+    """
+    from usergroups import options
+    if isinstance(value, dict):
+        if '__model__' in value:
+            (ctype_id, pk) = value['__model__']
+            model = ContentType.objects.get_for_id(ctype_id).model_class()
+            try:
+                return model._default_manager.get(pk=pk)
+            except model.DoesNotExist:
+                return None
+        if '__configuration__' in value:
+            try:
+                return options.get(value['__configuration__'])
+            except options.ConfigurationNotRegistered:
+                return None
+        return dict([(str(k), deserialize(v)) for (k, v) in value.items()])
+    if isinstance(value, list):
+        return [deserialize(v) for v in value]
+    return value
+
+
+@transaction.commit_on_success
+def enqueue_emails(datatuple):
+    """Enqueue e-mails given as ``(subject, message, from_email,
+    recipient_list)`` tuples, as accepted by ``send_mass_mail()``.
+
+    """
+    messages = [OutboxMessage(kind=OutboxMessage.KIND_EMAIL,
+                              payload=simplejson.dumps(list(data)))
+                for data in datatuple]
+    bulk.insert_objects(OutboxMessage, messages)
+
+@transaction.commit_on_success
+def enqueue_notice(users, label, extra_context):
+    """Enqueue a notice as accepted by ``notification.send()``."""
+    payload = {
+        'users': [user.pk for user in users],
+        'label': label,
+        'context': serialize(extra_context),
+    }
+    OutboxMessage.objects.create(kind=OutboxMessage.KIND_NOTICE,
+                                 payload=simplejson.dumps(payload))
+
+
+def worker_id():
+    """Return an identifier unique to this worker invocation."""
+    salt = '%s:%s:%s' % (socket.gethostname(), os.getpid(), random.random())
+    return hashlib.sha1(salt).hexdigest()
+
+@transaction.commit_on_success
+def claim(worker, batch_size):
+    """Claim up to `batch_size` pending messages for `worker` and return
+    them.
+
+    Messages are claimed with a conditional ``UPDATE`` that only succeeds
+    for rows nobody else has claimed in the meantime. Unlike ``SELECT ...
+    FOR UPDATE``, this works on SQLite too and does not keep the rows
+    locked while the messages are being delivered.
+
+    """
+    now = datetime.datetime.now()
+    unclaimed = Q(claimed_by='') | Q(claimed__lt=now - CLAIM_TIMEOUT)
+    pending = OutboxMessage.objects.filter(status=OutboxMessage.STATUS_PENDING,
+                                           available__lte=now)
+    ids = list(pending.filter(unclaimed).order_by('available', 'pk')
+               .values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return []
+    pending.filter(unclaimed, pk__in=ids).update(claimed_by=worker,
+                                                 claimed=now)
+    return list(OutboxMessage.objects.filter(pk__in=ids, claimed_by=worker)
+                .order_by('pk'))
+
+@transaction.commit_on_success
+def renew(message):
+    """Extend the claim on `message` by its worker. Return ``False`` if the
+    claim expired and another worker has taken the message over.
+
+    """
+    return bool(OutboxMessage.objects.filter(
+        pk=message.pk, status=OutboxMessage.STATUS_PENDING,
+        claimed_by=message.claimed_by).update(
+        claimed=datetime.datetime.now()))
+
+def deliver(messages, max_attempts):
+    """Deliver claimed `messages` and record the outcome of each. Return a
+    ``(sent, failed)`` tuple of counts. Messages whose claim has expired and
+    been taken over by another worker are skipped.
+
+    """
+    from django.core.mail import EmailMessage
+    from django.core.mail import get_connection
+
+    connection = None
+    sent = failed = 0
+    for message in messages:
+        if not renew(message):
+            continue
+        try:
+            payload = simplejson.loads(message.payload)
+            if message.kind == OutboxMessage.KIND_EMAIL:
+                if connection is None:
+                    connection = get_connection()
+                    connection.open()
+                (subject, body, from_email, recipients) = payload
+                connection.send_messages([EmailMessage(subject, body,
+                                                       from_email, recipients,
+                                                       connection=connection)])
+            else:
+                from notification import models as notification
+                from django.contrib.auth.models import User
+                users = User.objects.filter(pk__in=payload['users'])
+                notification.send(list(users), payload['label'],
+                                  deserialize(payload['context']))
+        except Exception:
+            record_failure(message, traceback.format_exc(), max_attempts)
+            failed += 1
+        else:
+            record_success(message)
+            sent += 1
+    if connection is not None:
+        connection.close()
+    return (sent, failed)
+
+@transaction.commit_on_success
+def record_success(message):
+    OutboxMessage.objects.filter(pk=message.pk).update(
+        status=OutboxMessage.STATUS_SENT, sent=datetime.datetime.now(),
+        claimed_by='', claimed=None)
+
+@transaction.commit_on_success
+def record_failure(message, error, max_attempts):
+    """Schedule `message` for another attempt, or mark it as failed when it
+    has been attempted `max_attempts` times.
+
+    """
+    attempts = message.attempts + 1
+    values = {
+        'attempts': attempts,
+        'last_error': error,
+        'claimed_by': '',
+        'claimed': None,
+    }
+    if attempts >= max_attempts:
+        values['status'] = OutboxMessage.STATUS_FAILED
+    else:
+        values['available'] = datetime.datetime.now() + \
+            RETRY_DELAY * 2 ** (attempts - 1)
+    OutboxMessage.objects.filter(pk=message.pk).update(**values)
@@ -0,0 +1,145 @@
+import base64
+
+from django.db.models import Q
+from django.utils import simplejson
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(direction, values):
+    """Return an opaque, URL-safe token for `direction` (``'n'`` for next or
+    ``'p'`` for previous) and the key `values` of a row.
+
+    """
+    data = simplejson.dumps([direction] + list(values))
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+def decode_cursor(cursor):
+    """Return ``(direction, values)`` from a token created by
+    ``encode_cursor()``. Raise ``InvalidCursor`` if the token is malformed.
+
+    """
+    try:
+        cursor = str(cursor)
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = simplejson.loads(data)
+        direction, values = data[0], data[1:]
+    except (TypeError, ValueError, IndexError, UnicodeError):
+        raise InvalidCursor
+    if direction not in ('n', 'p'):
+        raise InvalidCursor
+    return (direction, values)
+
+
+class KeysetPage(object):
+    def __init__(self, object_list, paginator, next_cursor=None,
+                 previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<KeysetPage>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator(object):
+    """Paginate `queryset` by seeking past the last row of the previous page
+    instead of using ``OFFSET``, and without counting the rows.
+
+    `ordering` is a field name optionally prefixed with ``-``, as used by
+    ``QuerySet.order_by()``. The primary key is used as a tiebreaker. The
+    ordering field should not be nullable.
+
+    """
+    def __init__(self, queryset, ordering, per_page):
+        opts = queryset.model._meta
+        self.queryset = queryset
+        self.per_page = per_page
+        self.descending = ordering.startswith('-')
+        name = ordering.lstrip('-')
+        if name in ('pk', opts.pk.name):
+            self.field = None
+        else:
+            self.field = opts.get_field(name)
+        self.pk = opts.pk
+
+    def _ordering(self, reverse=False):
+        prefix = self.descending != reverse and '-' or ''
+        ordering = [prefix + 'pk']
+        if self.field is not None:
+            ordering.insert(0, prefix + self.field.name)
+        return ordering
+
+    def _key(self, obj):
+        values = [obj.pk]
+        if self.field is not None:
+            values.insert(0, getattr(obj, self.field.attname))
+        return [not isinstance(v, (int, long)) and unicode(v) or v
+                for v in values]
+
+    def _seek(self, queryset, values, reverse=False):
+        """Filter `queryset` to rows after `values` in the ordering (or
+        before them if `reverse`).
+
+        """
+        lookup = (self.descending != reverse) and 'lt' or 'gt'
+        try:
+            pk = self.pk.to_python(values[-1])
+            if self.field is None:
+                return queryset.filter(**{ 'pk__%s' % lookup: pk })
+            value = self.field.to_python(values[0])
+        except Exception:
+            raise InvalidCursor
+        name = self.field.name
+        return queryset.filter(Q(**{ '%s__%s' % (name, lookup): value }) |
+                               Q(**{ name: value, 'pk__%s' % lookup: pk }))
+
+    def page(self, cursor=None):
+        """Return the ``KeysetPage`` identified by `cursor`, or the first page
+        if no cursor is given.
+
+        """
+        if cursor:
+            (direction, values) = decode_cursor(cursor)
+            if len(values) != (self.field is None and 1 or 2):
+                raise InvalidCursor
+        else:
+            (direction, values) = ('n', None)
+        backwards = direction == 'p'
+
+        queryset = self.queryset.order_by(*self._ordering(backwards))
+        if values is not None:
+            queryset = self._seek(queryset, values, backwards)
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+
+        if backwards:
+            object_list.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = previous_cursor = None
+        if object_list and has_next:
+            next_cursor = encode_cursor('n', self._key(object_list[-1]))
+        if object_list and has_previous:
+            previous_cursor = encode_cursor('p', self._key(object_list[0]))
+        return KeysetPage(object_list, self, next_cursor, previous_cursor)
@@ -0,0 +1,126 @@
+from django.utils.datastructures import SortedDict
+
+class GroupPermissions(object):
+    """The status of a single user in a single group."""
+    def __init__(self, is_owner=False, is_admin=False, is_member=False):
+        self.is_owner = is_owner
+        self.is_admin = is_owner or is_admin
+        self.is_member = self.is_admin or is_member
+
+
+ANONYMOUS = GroupPermissions()
+
+class PermissionResolver(object):
+    """Resolve and memoize the status of `user` in groups.
+
+    A resolver is attached to each request (see ``get_resolver()``) and lives
+    only as long as the request does. The status in a group is loaded with a
+    single query the first time it is asked for, or primed for free by
+    loading the group through ``BaseUserGroupConfiguration.get_group()``.
+
+    """
+    def __init__(self, user):
+        self.user = user
+        self._cache = {}
+
+    def _key(self, group):
+        return (group._meta.db_table, group.pk)
+
+    def status_selects(self, model):
+        """Return ``(select, select_params)`` for ``QuerySet.extra()`` that
+        annotates groups of `model` with ``viewer_is_admin`` and
+        ``viewer_is_member``.
+
+        """
+        admins = model.get_relation('admins')
+        members = model.get_relation('members')
+        select = SortedDict([
+            ('viewer_is_admin', admins.exists_sql()),
+            ('viewer_is_member', members.exists_sql()),
+        ])
+        return select, (self.user.pk, self.user.pk)
+
+    def prime(self, group, is_admin, is_member):
+        """Store status for `group` loaded by some other query."""
+        perms = GroupPermissions(is_owner=self.user.pk == group.creator_id,
+                                 is_admin=bool(is_admin),
+                                 is_member=bool(is_member))
+        self._cache[self._key(group)] = perms
+        return perms
+
+    def is_resolved(self, group):
+        """Return whether the status in `group` is already known."""
+        return self._key(group) in self._cache
+
+    def get(self, group):
+        """Return the ``GroupPermissions`` of the user in `group`."""
+        if not self.user.is_authenticated():
+            return ANONYMOUS
+        key = self._key(group)
+        if key not in self._cache:
+            if hasattr(group, 'viewer_is_admin'):
+                return self.prime(group, group.viewer_is_admin,
+                                  group.viewer_is_member)
+            select, params = self.status_selects(group.__class__)
+            queryset = group.__class__._default_manager.filter(pk=group.pk)
+            queryset = queryset.extra(select=select, select_params=params)
+            try:
+                (is_admin, is_member) = queryset.values_list(
+                    'viewer_is_admin', 'viewer_is_member')[0]
+            except IndexError:
+                (is_admin, is_member) = (False, False)
+            self.prime(group, is_admin, is_member)
+        return self._cache[key]
+
+    def forget(self, group):
+        """Drop memoized status for `group`, including the status annotated
+        on the instance by ``get_group()``. Views call this after changing
+        memberships of `group`.
+
+        """
+        self._cache.pop(self._key(group), None)
+        for name in ('viewer_is_admin', 'viewer_is_member'):
+            if name in group.__dict__:
+                delattr(group, name)
+
+
+class MembershipMatrix(object):
+    """The status of a set of users in a set of groups, as returned by
+    ``BaseUserGroupConfiguration.membership_matrix()``. Only the pairs in
+    which the user is a member are stored; users and groups may be given as
+    instances or ids.
+
+    """
+    def __init__(self, creators, members, admins):
+        # Group id to creator id, and sets of ``(user_id, group_id)``.
+        self.creators = creators
+        self.members = members
+        self.admins = admins
+
+    def get(self, user, group):
+        """Return the ``GroupPermissions`` of `user` in `group`."""
+        key = (getattr(user, 'pk', user), getattr(group, 'pk', group))
+        return GroupPermissions(
+            is_owner=self.creators.get(key[1]) == key[0],
+            is_admin=key in self.admins, is_member=key in self.members)
+
+    def role(self, user, group):
+        """Return ``'owner'``, ``'admin'``, ``'member'`` or ``None``."""
+        perms = self.get(user, group)
+        if perms.is_owner:
+            return 'owner'
+        if perms.is_admin:
+            return 'admin'
+        if perms.is_member:
+            return 'member'
+        return None
+
+
+def get_resolver(request):
+    """Return the ``PermissionResolver`` attached to `request`, creating it
+    if necessary.
+
+    """
+    if not hasattr(request, 'usergroups_permissions'):
+        request.usergroups_permissions = PermissionResolver(request.user)
+    return request.usergroups_permissions
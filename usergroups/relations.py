@@ -0,0 +1,198 @@
+import datetime
+
+from django.db import connection
+
+from usergroups import bulk
+
+class Relation(object):
+    """Base class for descriptions of the table that links the users
+    holding a role to groups. Subclasses set ``model``, ``table``,
+    ``group_column``, ``user_column``, ``group_field`` and ``user_field``
+    and implement ``filter()``.
+
+    """
+    def user_ids(self, group_id, user_ids=None):
+        """Return the set of ids of users related to the group. If
+        `user_ids` is given, only those among them are looked up.
+
+        """
+        queryset = self.filter(**{ self.group_field: group_id })
+        queryset = queryset.values_list(self.user_field, flat=True)
+        if user_ids is None:
+            return set(queryset)
+        found = set()
+        for chunk in bulk.chunked(user_ids):
+            found.update(queryset.filter(**{
+                '%s__in' % self.user_field: chunk,
+            }))
+        return found
+
+    def _sql_names(self):
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        return {
+            'table': qn(self.table),
+            'group': qn(self.group_column),
+            'user': qn(self.user_column),
+            'group_table': qn(opts.db_table),
+            'pk': qn(opts.pk.column),
+        }
+
+
+class M2MRelation(Relation):
+    """Describe the table that links the users holding a role (``members``
+    or ``admins``) to groups of a model, so queries against it can be built
+    without going through the related managers.
+
+    """
+    def __init__(self, model, name):
+        field = model._meta.get_field(name)
+        self.model = model
+        self.name = name
+        self.through = field.rel.through
+        self.table = field.m2m_db_table()
+        self.group_column = field.m2m_column_name()
+        self.user_column = field.m2m_reverse_name()
+        self.group_field = field.m2m_field_name()
+        self.user_field = field.m2m_reverse_field_name()
+        # The relation table doesn't record when users joined.
+        self.joined_field = None
+
+    def filter(self, **kwargs):
+        """Return a ``QuerySet`` of rows in the relation table."""
+        return self.through._default_manager.filter(**kwargs)
+
+    def add(self, group_id, user_ids):
+        """Relate `user_ids`, none of which may already be related, to the
+        group.
+
+        """
+        bulk.insert_rows(self.table, (self.group_column, self.user_column),
+                         [(group_id, user_id) for user_id in user_ids])
+
+    def remove(self, group_id, user_ids):
+        """Remove `user_ids` from the group."""
+        return bulk.delete_rows(self.table, self.group_column, group_id,
+                                self.user_column, list(user_ids))
+
+    def exists_sql(self):
+        """Return SQL for an ``EXISTS`` clause that is true if the user given
+        as the only parameter is related to the group in the current row.
+        Suitable for ``QuerySet.extra(select=...)`` on the group model.
+
+        """
+        return ('EXISTS (SELECT 1 FROM %(table)s WHERE %(table)s.%(group)s = '
+                '%(group_table)s.%(pk)s AND %(table)s.%(user)s = %%s)' %
+                self._sql_names())
+
+    def count_sql(self):
+        """Return SQL for a subquery counting the users related to the group
+        in the current row.
+
+        """
+        return ('(SELECT COUNT(*) FROM %(table)s WHERE %(table)s.%(group)s = '
+                '%(group_table)s.%(pk)s)' % self._sql_names())
+
+
+class RoleRelation(Relation):
+    """Describe the users holding a role in groups that keep memberships in
+    a single table with a role column (see ``BaseRoleUserGroup``). Every row
+    is a member; ``admins`` are the rows with the admin role.
+
+    Offers the same interface as ``M2MRelation``.
+
+    """
+    def __init__(self, model, name):
+        self.model = model
+        self.name = name
+        self.through = model.get_membership_model()
+        opts = self.through._meta
+        self.table = opts.db_table
+        self.group_column = opts.get_field('group').column
+        self.user_column = opts.get_field('user').column
+        self.role_column = opts.get_field('role').column
+        self.joined_column = opts.get_field('joined').column
+        self.group_field = 'group'
+        self.user_field = 'user'
+        self.joined_field = 'joined'
+        if name == 'admins':
+            self.role = self.through.ROLE_ADMIN
+        else:
+            self.role = None
+
+    def filter(self, **kwargs):
+        """Return a ``QuerySet`` of rows in the membership table that hold
+        the role.
+
+        """
+        queryset = self.through._default_manager.filter(**kwargs)
+        if self.role is not None:
+            queryset = queryset.filter(role=self.role)
+        return queryset
+
+    def add(self, group_id, user_ids):
+        """Give `user_ids`, none of which may already hold the role, the
+        role. Members are promoted to admins in place; everybody else gets a
+        new row, so every user is written once.
+
+        """
+        rows = self.through._default_manager.filter(group=group_id)
+        new_ids = set(user_ids)
+        if self.role is not None:
+            for chunk in bulk.chunked(user_ids):
+                existing = list(rows.filter(user__in=chunk).values_list(
+                    'user', flat=True))
+                if existing:
+                    rows.filter(user__in=existing).update(role=self.role)
+                    new_ids.difference_update(existing)
+        role = self.role
+        if role is None:
+            role = self.through.ROLE_MEMBER
+        joined = connection.ops.value_to_db_datetime(datetime.datetime.now())
+        bulk.insert_rows(self.table, (self.group_column, self.user_column,
+                                      self.role_column, self.joined_column),
+                         [(group_id, user_id, role, joined)
+                          for user_id in new_ids])
+
+    def remove(self, group_id, user_ids):
+        """Take the role from `user_ids`. Removing members deletes their
+        rows, while admins are demoted to members.
+
+        """
+        if self.role is None:
+            return bulk.delete_rows(self.table, self.group_column, group_id,
+                                    self.user_column, list(user_ids))
+        removed = 0
+        for chunk in bulk.chunked(user_ids):
+            removed += self.filter(group=group_id, user__in=chunk).update(
+                role=self.through.ROLE_MEMBER)
+        return removed
+
+    def exists_sql(self):
+        return ('EXISTS (SELECT 1 FROM %(table)s WHERE %(table)s.%(group)s = '
+                '%(group_table)s.%(pk)s AND %(table)s.%(user)s = %%s'
+                '%(role)s)' % self._sql_names())
+
+    def count_sql(self):
+        return ('(SELECT COUNT(*) FROM %(table)s WHERE %(table)s.%(group)s = '
+                '%(group_table)s.%(pk)s%(role)s)' % self._sql_names())
+
+    def _sql_names(self):
+        names = super(RoleRelation, self)._sql_names()
+        if self.role is None:
+            names['role'] = ''
+        else:
+            names['role'] = ' AND %s.%s = %d' % (
+                names['table'], connection.ops.quote_name(self.role_column),
+                self.role)
+        return names
+
+
+_relations = {}
+
+def get_relation(model, name, relation_class=M2MRelation):
+    """Return a (cached) relation description for `name` on `model`."""
+    key = (model, name)
+    if key not in _relations:
+        _relations[key] = relation_class(model, name)
+    return _relations[key]
@@ -0,0 +1,140 @@
+"""Search over the name and info of groups, backed by an inverted index.
+
+Every group is split into lowercase tokens, stored with a weight (tokens
+in the name weigh more than tokens in the info) in ``GroupSearchToken``
+whenever the group is saved. A query matches groups that have, for every
+query token, a token starting with it. Prefixes are matched with a range
+on the ``(content_type, token)`` index rather than ``LIKE``, and groups
+are ordered by the summed weight of their matching tokens.
+
+The ranges assume that the database compares tokens by code point, as
+SQLite and MySQL's binary collations do; on PostgreSQL the token column
+should use the ``C`` collation.
+
+"""
+import re
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+
+from usergroups import bulk
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Tokens shorter than this are not indexed or searched for; longer ones are
+# truncated.
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 30
+
+NAME_WEIGHT = 10
+INFO_WEIGHT = 1
+
+# Caps the index rows per group, and the tokens of a query.
+MAX_INFO_TOKENS = 200
+MAX_QUERY_TOKENS = 8
+
+def tokenize(text):
+    """Return the distinct tokens in `text`, in order of appearance."""
+    tokens = []
+    seen = set()
+    for token in TOKEN_RE.findall((text or u'').lower()):
+        token = token[:MAX_TOKEN_LENGTH]
+        if len(token) >= MIN_TOKEN_LENGTH and token not in seen:
+            seen.add(token)
+            tokens.append(token)
+    return tokens
+
+def group_tokens(group):
+    """Return a dict mapping the tokens of `group` to their weight."""
+    weights = {}
+    for token in tokenize(group.info)[:MAX_INFO_TOKENS]:
+        weights[token] = INFO_WEIGHT
+    for token in tokenize(group.name):
+        weights[token] = weights.get(token, 0) + NAME_WEIGHT
+    return weights
+
+def _token_table():
+    from usergroups.models import GroupSearchToken
+    opts = GroupSearchToken._meta
+    return (opts.db_table, opts.get_field('content_type').column,
+            opts.get_field('object_id').column,
+            opts.get_field('token').column, opts.get_field('weight').column)
+
+def unindex_groups(model, group_ids):
+    """Remove groups of `model` with `group_ids` from the index."""
+    (table, ctype, object_id, token, weight) = _token_table()
+    ctype_id = ContentType.objects.get_for_model(model).pk
+    bulk.delete_rows(table, ctype, ctype_id, object_id, list(group_ids))
+
+def index_groups(groups):
+    """(Re)index `groups`, which must all be of the same model."""
+    groups = list(groups)
+    if not groups:
+        return
+    model = groups[0].__class__
+    unindex_groups(model, [group.pk for group in groups])
+    (table, ctype, object_id, token, weight) = _token_table()
+    ctype_id = ContentType.objects.get_for_model(model).pk
+    rows = []
+    for group in groups:
+        rows.extend([(ctype_id, group.pk, t, w)
+                     for (t, w) in group_tokens(group).items()])
+    bulk.insert_rows(table, (ctype, object_id, token, weight), rows)
+
+def prefix_range(token):
+    """Return ``(low, high)`` such that ``low <= t < high`` for exactly the
+    strings ``t`` starting with `token`.
+
+    """
+    return (token, token[:-1] + unichr(ord(token[-1]) + 1))
+
+def search(queryset, query):
+    """Filter `queryset` (of groups) to those matching `query`, annotated
+    with ``relevance`` and ordered by it. Return an empty queryset if the
+    query has no searchable tokens.
+
+    """
+    tokens = tokenize(query)[:MAX_QUERY_TOKENS]
+    if not tokens:
+        return queryset.none()
+    # The longest token is likely the most selective and drives the search.
+    tokens.sort(key=len, reverse=True)
+    ranges = [prefix_range(token) for token in tokens]
+
+    qn = connection.ops.quote_name
+    opts = queryset.model._meta
+    (table, ctype, object_id, token, weight) = _token_table()
+    names = {
+        'table': qn(table),
+        'ctype': qn(ctype),
+        'object_id': qn(object_id),
+        'token': qn(token),
+        'weight': qn(weight),
+        'group_table': qn(opts.db_table),
+        'pk': qn(opts.pk.column),
+    }
+    ctype_id = ContentType.objects.get_for_model(queryset.model).pk
+    in_range = '%(table)s.%(token)s >= %%s AND %(table)s.%(token)s < %%s'
+    correlated = ('%(table)s.%(ctype)s = %%s AND %(table)s.%(object_id)s = '
+                  '%(group_table)s.%(pk)s')
+
+    where = [('%(group_table)s.%(pk)s IN (SELECT %(table)s.%(object_id)s '
+              'FROM %(table)s WHERE %(table)s.%(ctype)s = %%s AND ' +
+              in_range + ')') % names]
+    params = [ctype_id] + list(ranges[0])
+    for (low, high) in ranges[1:]:
+        where.append(('EXISTS (SELECT 1 FROM %(table)s WHERE ' + correlated +
+                      ' AND ' + in_range + ')') % names)
+        params.extend([ctype_id, low, high])
+
+    matches = ' OR '.join(['(%s)' % in_range] * len(ranges))
+    relevance = ('(SELECT SUM(%(table)s.%(weight)s) FROM %(table)s WHERE ' +
+                 correlated + ' AND (' + matches + '))') % names
+    select_params = [ctype_id]
+    for (low, high) in ranges:
+        select_params.extend([low, high])
+
+    queryset = queryset.extra(select={ 'relevance': relevance },
+                              select_params=select_params, where=where,
+                              params=params)
+    return queryset.order_by('-relevance', 'pk')
@@ -0,0 +1,13 @@
+from django.dispatch import Signal
+
+# Sent once per batch whenever users are added to or removed from a role
+# (``members`` or ``admins``) of a group, whether through the bulk API on
+# ``BaseUserGroup`` or through the related managers (see
+# ``usergroups.models.relay_m2m_changed``).
+#
+# ``sender`` is the group model, ``instance`` the group if it's at hand
+# (``None`` otherwise), ``action`` is either ``"add"`` or ``"remove"`` and
+# ``user_ids`` is a frozenset holding only the users that were actually
+# added or removed.
+memberships_changed = Signal(providing_args=['instance', 'group_id', 'role',
+                                             'action', 'user_ids'])
@@ -0,0 +1 @@
+CREATE INDEX usergroups_emailinvitation_group ON usergroups_emailinvitation (content_type_id, object_id);
@@ -0,0 +1,2 @@
+CREATE INDEX usergroups_groupsearchtoken_token ON usergroups_groupsearchtoken (content_type_id, token);
+CREATE INDEX usergroups_groupsearchtoken_group ON usergroups_groupsearchtoken (content_type_id, object_id, token);
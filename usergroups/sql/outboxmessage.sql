@@ -0,0 +1 @@
+CREATE INDEX usergroups_outboxmessage_status_available ON usergroups_outboxmessage (status, available);
@@ -0,0 +1 @@
+CREATE INDEX usergroups_usergroupapplication_inbox ON usergroups_usergroupapplication (content_type_id, object_id, created);
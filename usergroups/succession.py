@@ -0,0 +1,90 @@
+"""Policies for choosing a new creator when the creator of a group stops
+being an admin.
+
+A policy is a callable taking the group and returning the id of one of its
+remaining admins, or ``None`` if there are none. Policies are called after
+the admins have been removed, in the same transaction and with the group
+row locked (see ``lock_group()``), and should run a bounded number of
+queries. Configurations choose one with ``get_succession_policy()``.
+
+"""
+import random
+
+from django.db import connection
+from django.db.models import Max
+from django.db.models import Min
+
+def lock_group(group):
+    """Lock the row of `group` until the end of the transaction, so that
+    concurrent changes to its admins are serialized, and refresh
+    ``creator_id`` from the locked row. Return the creator id.
+
+    Succession must be decided from the refreshed value: a concurrent
+    removal may have chosen a new creator since `group` was loaded.
+
+    SQLite locks the whole database on the first write instead, so the row
+    is only read.
+
+    """
+    qn = connection.ops.quote_name
+    opts = group._meta
+    sql = 'SELECT %s FROM %s WHERE %s = %%s' % (
+        qn(opts.get_field('creator').column), qn(opts.db_table),
+        qn(opts.pk.column))
+    if not connection.settings_dict['ENGINE'].endswith('sqlite3'):
+        sql += ' FOR UPDATE'
+    cursor = connection.cursor()
+    cursor.execute(sql, [group.pk])
+    row = cursor.fetchone()
+    if row is not None and row[0] != group.creator_id:
+        group.creator_id = row[0]
+        if hasattr(group, '_creator_cache'):
+            del group._creator_cache
+    return group.creator_id
+
+def _admins(group):
+    relation = group.get_relation('admins')
+    return relation, relation.filter(**{ relation.group_field: group.pk })
+
+def oldest_admin(group):
+    """Choose the admin with the oldest row in the admins relation, by
+    primary key. For groups with a separate admins table that is the admin
+    who has been an admin the longest. Role tables promote members in place,
+    so there it is the admin who has been a *member* the longest. One query,
+    which an index on the group column (and the primary key) of the relation
+    table serves directly.
+
+    """
+    relation, admins = _admins(group)
+    for user_id in admins.order_by('pk').values_list(relation.user_field,
+                                                     flat=True)[:1]:
+        return user_id
+    return None
+
+def newest_admin(group):
+    """Choose the admin with the newest row in the admins relation: the
+    most recent admin, or for role tables the most recent member among the
+    admins.
+
+    """
+    relation, admins = _admins(group)
+    for user_id in admins.order_by('-pk').values_list(relation.user_field,
+                                                      flat=True)[:1]:
+        return user_id
+    return None
+
+def random_admin(group):
+    """Choose an admin at random, without sorting the admins randomly: a
+    random point is picked between the lowest and highest relation row and
+    the first row at or after it is taken. Two queries.
+
+    """
+    relation, admins = _admins(group)
+    bounds = admins.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return None
+    pivot = random.randint(bounds['low'], bounds['high'])
+    for user_id in admins.filter(pk__gte=pivot).order_by('pk').values_list(
+        relation.user_field, flat=True)[:1]:
+        return user_id
+    return None
@@ -0,0 +1,144 @@
+"""Generation of synthetic users, groups, memberships, applications and
+invitations for load testing, as used by ``generate_usergroup_data`` and
+the benchmarks.
+
+Group sizes follow a Zipf-like distribution: the group of rank ``r`` has
+``max_members / r ** skew`` members, so a few groups are huge and most are
+small. All choices are made by a ``random.Random`` seeded by the caller,
+so the same arguments produce the same data; only the secret keys of
+invitations, which must be unique, are random. Rows are written with
+multi-row inserts; no signals are sent, and counters and the search index
+are written directly.
+
+"""
+import datetime
+import random
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from usergroups import bulk
+from usergroups import search
+from usergroups.models import EmailInvitation
+from usergroups.models import UserGroupApplication
+from usergroups.models import UserGroupCounters
+
+def create_users(prefix, count):
+    """Create `count` users named `prefix` followed by a number, without
+    hashing passwords, and return their ids.
+
+    """
+    for chunk in bulk.chunked(xrange(count), 5000):
+        bulk.insert_objects(User, [
+            User(username='%s%d' % (prefix, i),
+                 email='%s%d@example.com' % (prefix, i), password='!')
+            for i in chunk])
+    return list(User.objects.filter(username__startswith=prefix)
+                .order_by('pk').values_list('pk', flat=True))
+
+def add_applications(group, user_ids):
+    """Create pending applications to join `group` by `user_ids`."""
+    for chunk in bulk.chunked(user_ids, 5000):
+        bulk.insert_objects(UserGroupApplication, [
+            UserGroupApplication(user_id=user_id, group=group)
+            for user_id in chunk])
+
+def add_invitations(group, user_id, emails, rng, max_age=None):
+    """Create invitations to `emails` sent by `user_id`, created at random
+    times within `max_age` (a ``timedelta``) if given.
+
+    """
+    now = datetime.datetime.now()
+    seconds = max_age and (max_age.days * 86400 + max_age.seconds) or 0
+    for chunk in bulk.chunked(emails, 5000):
+        invitations = []
+        for email in chunk:
+            invitation = EmailInvitation(user_id=user_id, group=group,
+                                         email=email)
+            invitation.secret_key = invitation.generate_secret_key()
+            invitation.created = now - datetime.timedelta(
+                seconds=rng.randint(0, seconds))
+            invitations.append(invitation)
+        bulk.insert_objects(EmailInvitation, invitations)
+
+def group_sizes(groups, max_members, skew, rng):
+    """Return the number of members of each of `groups` groups, shuffled."""
+    sizes = [max(1, int(max_members / rank ** skew))
+             for rank in range(1, groups + 1)]
+    rng.shuffle(sizes)
+    return sizes
+
+def generate(model, users=10000, groups=1000, max_members=5000, skew=1.2,
+             admins=3, application_rate=0.01, invitation_rate=0.01,
+             invitation_age=datetime.timedelta(days=30), seed=0,
+             prefix='synthetic', batch_size=100, progress=None):
+    """Generate `users` users and `groups` groups of `model` with members,
+    admins (up to `admins` per group, including the creator), applications
+    and invitations (`application_rate` and `invitation_rate` times the
+    number of members). Groups are written `batch_size` at a time, one
+    transaction each, calling `progress` with the running totals after
+    every batch. Return the totals.
+
+    """
+    rng = random.Random(seed)
+    user_ids = create_users('%s-' % prefix, users)
+    max_members = min(max_members, len(user_ids))
+    sizes = group_sizes(groups, max_members, skew, rng)
+    totals = {
+        'users': len(user_ids),
+        'groups': 0,
+        'members': 0,
+        'admins': 0,
+        'applications': 0,
+        'invitations': 0,
+    }
+    for (number, chunk) in enumerate(bulk.chunked(sizes, batch_size)):
+        generate_groups(model, chunk, user_ids, admins, application_rate,
+                        invitation_rate, invitation_age, rng,
+                        '%s-%d-' % (prefix, number), totals)
+        if progress is not None:
+            progress(totals)
+    return totals
+
+@transaction.commit_on_success
+def generate_groups(model, sizes, user_ids, admins, application_rate,
+                    invitation_rate, invitation_age, rng, prefix, totals):
+    """Generate a group for each of `sizes` and add to `totals`."""
+    plans = []
+    objects = []
+    for (i, size) in enumerate(sizes):
+        members = rng.sample(user_ids, size)
+        group = model(name='%s%d' % (prefix, i), creator_id=members[0])
+        if isinstance(group, UserGroupCounters):
+            group.member_count = len(members)
+            group.admin_count = min(admins, len(members))
+        objects.append(group)
+        plans.append((group.name, members))
+    bulk.insert_objects(model, objects)
+    ids = dict(model._default_manager.filter(name__startswith=prefix)
+               .values_list('name', 'pk'))
+
+    members_relation = model.get_relation('members')
+    admins_relation = model.get_relation('admins')
+    for (group, (name, members)) in zip(objects, plans):
+        group.pk = ids[name]
+        members_relation.add(group.pk, members)
+        admins_relation.add(group.pk, members[:admins])
+        totals['groups'] += 1
+        totals['members'] += len(members)
+        totals['admins'] += min(admins, len(members))
+
+        member_set = set(members)
+        count = int(len(members) * application_rate)
+        candidates = rng.sample(user_ids, min(len(user_ids), count * 2))
+        applicants = [user_id for user_id in candidates
+                      if user_id not in member_set][:count]
+        add_applications(group, applicants)
+        totals['applications'] += len(applicants)
+
+        count = int(len(members) * invitation_rate)
+        emails = ['%sinvitee%d-%d@example.com' % (prefix, group.pk, j)
+                  for j in range(count)]
+        add_invitations(group, members[0], emails, rng, invitation_age)
+        totals['invitations'] += count
+    search.index_groups(objects)
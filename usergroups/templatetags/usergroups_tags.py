@@ -0,0 +1,40 @@
+from django import template
+
+register = template.Library()
+
+class GroupRoleNode(template.Node):
+    def __init__(self, matrix, user, group, var_name):
+        self.matrix = template.Variable(matrix)
+        self.user = template.Variable(user)
+        self.group = template.Variable(group)
+        self.var_name = var_name
+
+    def render(self, context):
+        try:
+            matrix = self.matrix.resolve(context)
+            user = self.user.resolve(context)
+            group = self.group.resolve(context)
+        except template.VariableDoesNotExist:
+            context[self.var_name] = None
+        else:
+            context[self.var_name] = matrix.role(user, group)
+        return ''
+
+@register.tag
+def group_role(parser, token):
+    """Look up the role of a user in a group in a ``MembershipMatrix`` (see
+    ``BaseUserGroupConfiguration.membership_matrix()``) and store it in a
+    context variable, without running any queries::
+
+        {% group_role matrix user group as role %}
+        {% if role %}{{ role }}{% endif %}
+
+    The role is ``'owner'``, ``'admin'``, ``'member'`` or ``None``.
+
+    """
+    bits = token.split_contents()
+    if len(bits) != 6 or bits[4] != 'as':
+        raise template.TemplateSyntaxError("%r tag requires the arguments "
+                                           "'matrix user group as var'" %
+                                           bits[0])
+    return GroupRoleNode(bits[1], bits[2], bits[3], bits[5])
@@ -0,0 +1,112 @@
+"""Stateless, signed invitation tokens.
+
+A token encodes the content type and id of a group, an e-mail address and
+a timestamp, and is signed with an HMAC derived from ``SECRET_KEY``. Tokens
+are verified without reading the database; only the signature of a token
+that has been used is stored (as an ``UsedInvitationToken``) to make sure
+it can't be used again.
+
+"""
+import base64
+import datetime
+import hashlib
+import hmac
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError
+from django.db import transaction
+from django.utils.http import base36_to_int
+from django.utils.http import int_to_base36
+
+from usergroups.cache import commit_then_invalidate
+from usergroups.models import UsedInvitationToken
+
+try:
+    from django.utils.crypto import constant_time_compare
+    from django.utils.crypto import salted_hmac
+except ImportError:
+    # Django < 1.3
+    from django.conf import settings
+
+    def salted_hmac(key_salt, value):
+        key = hashlib.sha1(key_salt + settings.SECRET_KEY).digest()
+        return hmac.new(key, msg=value, digestmod=hashlib.sha1)
+
+    def constant_time_compare(val1, val2):
+        if len(val1) != len(val2):
+            return False
+        result = 0
+        for (x, y) in zip(val1, val2):
+            result |= ord(x) ^ ord(y)
+        return result == 0
+
+KEY_SALT = 'usergroups.tokens.invitation'
+
+def _signature(value):
+    return salted_hmac(KEY_SALT, value).hexdigest()[:20]
+
+def make_token(group, email, timestamp=None):
+    """Return a signed token inviting `email` to join `group`."""
+    ctype = ContentType.objects.get_for_model(group)
+    if timestamp is None:
+        timestamp = int(time.time())
+    email = base64.urlsafe_b64encode(email.encode('utf-8')).rstrip('=')
+    value = '.'.join([int_to_base36(ctype.pk), int_to_base36(group.pk), email,
+                      int_to_base36(timestamp)])
+    return '%s.%s' % (value, _signature(value))
+
+def is_token(key):
+    """Return whether `key` looks like a signed token rather than the secret
+    key of a stored ``EmailInvitation``.
+
+    """
+    return key.count('.') == 4
+
+def check_token(token, group, max_age=None):
+    """Verify `token` for `group`. Return ``(email, signature)`` if it's
+    valid and not older than `max_age` (a ``timedelta``), otherwise
+    ``None``. Whether the token has been used is not checked.
+
+    """
+    try:
+        (ctype_id, group_id, email, timestamp, signature) = \
+            str(token).split('.')
+        if not constant_time_compare(signature, _signature(
+            '.'.join([ctype_id, group_id, email, timestamp]))):
+            return None
+        ctype_id = base36_to_int(ctype_id)
+        group_id = base36_to_int(group_id)
+        timestamp = base36_to_int(timestamp)
+        email = base64.urlsafe_b64decode(email + '=' * (-len(email) % 4))
+        email = email.decode('utf-8')
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+    ctype = ContentType.objects.get_for_model(group)
+    if (ctype_id, group_id) != (ctype.pk, group.pk):
+        return None
+    if max_age is not None:
+        created = datetime.datetime.fromtimestamp(timestamp)
+        if created < datetime.datetime.now() - max_age:
+            return None
+    return (email, signature)
+
+@commit_then_invalidate
+def redeem_token(user, group, token, max_age=None):
+    """Validate `token` and add `user` to `group`. Return boolean stating
+    whether the token was valid and unused.
+
+    """
+    checked = check_token(token, group, max_age)
+    if checked is None:
+        return False
+    sid = transaction.savepoint()
+    try:
+        UsedInvitationToken(signature=checked[1]).save(force_insert=True)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        return False
+    transaction.savepoint_commit(sid)
+    group._add_members([user])
+    return True
@@ -1,14 +1,24 @@
 from django.conf.urls.defaults import *
 
 from usergroups.views import dispatcher
+from usergroups.views import my_groups
 
 p = (
+    # Groups of the visitor, across configurations
+    url(r'^my-groups/$', my_groups, {}, 'usergroups_my_groups'),
+    url(r'^my-groups/admin/$', my_groups, { 'role': 'admins' },
+        'usergroups_my_admin_groups'),
+
     # List and detail
     url(r'^(?P<slug>\w+)/$', dispatcher, { 'view_name': 'group_list' },
         'usergroups_group_list'),
     url(r'^(?P<slug>\w+)/(?P<group_id>\d+)/$', dispatcher,
         { 'view_name': 'group_detail' }, 'usergroups_group_detail'),
 
+    # Search
+    url(r'^(?P<slug>\w+)/search/$', dispatcher,
+        { 'view_name': 'search_groups' }, 'usergroups_search_groups'),
+
     # Create, edit and delete
     url(r'^(?P<slug>\w+)/create/$', dispatcher,
         { 'view_name': 'create_group' }, 'usergroups_create_group'),
@@ -27,6 +37,10 @@ p = (
         { 'view_name': 'done', 'action': 'leave_group_done' },
         'usergroups_leave_group_done'),
 
+    # Export members
+    url(r'^(?P<slug>\w+)/(?P<group_id>\d+)/members/export/$', dispatcher,
+        { 'view_name': 'export_members' }, 'usergroups_export_members'),
+
     # Remove member
     url(r'^(?P<slug>\w+)/(?P<group_id>\d+)/members/(?P<user_id>\d+)/remove/$',
         dispatcher, { 'view_name': 'remove_member' },
@@ -48,6 +62,10 @@ p = (
         dispatcher, { 'view_name': 'revoke_admin_done' },
         'usergroups_revoke_admin_done'),
     
+    # Batch actions
+    url(r'^(?P<slug>\w+)/(?P<group_id>\d+)/batch/$', dispatcher,
+        { 'view_name': 'batch_action' }, 'usergroups_batch_action'),
+
     # Invitations
     url(r'^(?P<slug>\w+)/(?P<group_id>\d+)/invitations/send/$',
         dispatcher, { 'view_name': 'create_email_invitation' },
@@ -63,6 +81,9 @@ p = (
         'usergroups_group_joined'),
     
     # Applications
+    url(r'^(?P<slug>\w+)/(?P<group_id>\d+)/applications/$',
+        dispatcher, { 'view_name': 'application_inbox' },
+        'usergroups_application_inbox'),
     url(r'^(?P<slug>\w+)/(?P<group_id>\d+)/applications/apply/$',
         dispatcher, { 'view_name': 'apply_to_join_group' },
         'usergroups_apply_to_join'),
@@ -1,13 +1,18 @@
 from django import http
+from django.contrib.auth.decorators import login_required
+from django.views.generic.simple import direct_to_template
 
+from usergroups import instrumentation
 from usergroups import options
+from usergroups.pagination import InvalidCursor
 
 def dispatcher(request, slug, view_name, *args, **kwargs):
     """Dispatcher that loads configuration corresponding to `slug` and
     dispatches view corresponding to `view_name` on said configuration.
 
     The configuration will be added to the `extra_context` attribute of
-    all dispatched views.
+    all dispatched views. Views are timed if instrumentation is configured
+    (see ``usergroups.instrumentation``).
     
     """
     try:
@@ -22,4 +27,32 @@ def dispatcher(request, slug, view_name, *args, **kwargs):
     extra_context.update({ 'group_config': conf })
     kwargs['extra_context'] = extra_context
 
+    if instrumentation.get_sinks():
+        return instrumentation.instrument(slug, view_name, view, request,
+                                          *args, **kwargs)
     return view(request, *args, **kwargs)
+
+@login_required
+def my_groups(request, role='members', per_page=25,
+              template_name='usergroups/my_groups.html',
+              cursor_parameter='cursor', extra_context=None):
+    """Present the visitor with the groups, of every registered
+    configuration, in which they hold `role`, most recently joined first
+    (see ``GroupOptions.groups_for_user()``).
+
+    """
+    try:
+        page = options.options.groups_for_user(
+            request.user, role, per_page, request.GET.get(cursor_parameter))
+    except InvalidCursor:
+        raise http.Http404
+    context = {
+        'group_list': page.object_list,
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+        'role': role,
+        'cursor_parameter': cursor_parameter,
+    }
+    context.update(extra_context or {})
+    return direct_to_template(request, extra_context=context,
+                              template=template_name)